@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Bulk maintenance of the Firestore users collection
+
+Uses the app's Firebase setup (FIREBASE_SERVICE_ACCOUNT), streams users/
+and commits each transform's writes in batches of 500 from a thread pool.
+Progress is checkpointed after every page; --resume continues an
+interrupted run.
+
+Usage: python admin.py <transform> [--dry-run] [--resume] [--workers 8]
+       [--rate 500] [--page-size 1000] [--limit N] [--checkpoint PATH]
+       [--report report.json] [--yes]
+       python admin.py --list
+"""
+
+import sys
+import json
+import logging
+import argparse
+
+import firebase_setup
+from bulk_update import (BULK_PAGE_SIZE, BULK_WORKERS, BULK_WRITES_PER_SEC, MAX_BATCH_SIZE,
+                         BulkRun, Checkpoint, Write)
+from lookup_pool import get_lookup_pool
+from user_store import USERS_COLLECTION, email_index_key, email_index_ref, index_entry, normalize_email
+
+logger = logging.getLogger(__name__)
+
+# ucl_data fields the callback writes, with the defaults it uses
+UCL_DATA_DEFAULTS = {
+    'department': 'Unknown',
+    'full_name': 'UCL Student',
+    'upi': 'unknown',
+    'is_student': True,
+    'auth_method': 'ucl_oauth',
+    'token_scope': 'unknown'
+}
+
+
+def _index_uids(db, emails):
+    """UIDs recorded in users_by_email for the given emails, keyed by index key"""
+    refs = {email_index_key(email): email_index_ref(db, email) for email in emails if email}
+    if not refs:
+        return {}
+    return {snapshot.id: (snapshot.to_dict() or {}).get('uid')
+            for snapshot in db.get_all(list(refs.values())) if snapshot.exists}
+
+
+def backfill_onboarded(db, auth):
+    """Set isOnboarded=true on documents written before the flag existed"""
+    def transform(docs):
+        for doc in docs:
+            if 'isOnboarded' not in (doc.to_dict() or {}):
+                # Predates onboarding, so the user has used the app already
+                yield doc.id, [Write('update', doc.reference, {'isOnboarded': True})]
+    return transform
+
+
+def normalize_emails(db, auth):
+    """Store email in normalized form (trimmed, lower case), indexing it in the same batch
+
+    The app finds users through users_by_email, so each rewritten document
+    gets its index entry (if it has none) in the batch that rewrites its
+    email. A document whose normalized email is indexed to another user is
+    left alone and reported as a conflict.
+    """
+    seen = {}
+    stats = {'normalized': 0, 'indexed': 0, 'conflicts': 0}
+
+    def transform(docs):
+        emails = {doc.id: (doc.to_dict() or {}).get('email') for doc in docs}
+        pending = [doc for doc in docs if emails[doc.id] and emails[doc.id] != normalize_email(emails[doc.id])]
+        indexed = _index_uids(db, [emails[doc.id] for doc in pending])
+        for doc in pending:
+            email = emails[doc.id]
+            key = email_index_key(email)
+            owner = seen.get(key) or indexed.get(key)
+            if owner and owner != doc.id:
+                stats['conflicts'] += 1
+                logger.warning(f"Not normalizing {doc.id}: {key} is indexed as {owner}")
+                continue
+            writes = [Write('update', doc.reference, {'email': normalize_email(email)})]
+            if not owner:
+                writes.append(Write('set', email_index_ref(db, email), index_entry(email, doc.id)))
+                stats['indexed'] += 1
+            seen[key] = doc.id
+            stats['normalized'] += 1
+            yield doc.id, writes
+
+    transform.stats = stats
+    return transform
+
+
+def migrate_ucl_data(db, auth):
+    """Fill ucl_data fields missing from documents written by older versions"""
+    def transform(docs):
+        for doc in docs:
+            ucl_data = (doc.to_dict() or {}).get('ucl_data')
+            if not isinstance(ucl_data, dict):
+                continue
+            missing = {f"ucl_data.{field}": value for field, value in UCL_DATA_DEFAULTS.items()
+                       if field not in ucl_data}
+            if missing:
+                yield doc.id, [Write('update', doc.reference, missing)]
+    return transform
+
+
+def delete_orphans(db, auth):
+    """Delete user documents with no Firebase Auth account, and their email index entries"""
+    def transform(docs):
+        # get_users takes up to 100 identifiers per call; a page's calls run together
+        chunks = [[auth.UidIdentifier(doc.id) for doc in docs[i:i + 100]] for i in range(0, len(docs), 100)]
+        found = {user.uid for result in get_lookup_pool().map(auth.get_users, chunks) for user in result.users}
+        orphans = {doc.id: doc for doc in docs if doc.id not in found}
+        emails = {uid: (doc.to_dict() or {}).get('email') for uid, doc in orphans.items()}
+        indexed = _index_uids(db, emails.values())
+        for uid, doc in orphans.items():
+            writes = [Write('delete', doc.reference, None)]
+            email = emails[uid]
+            if email and indexed.get(email_index_key(email)) == uid:
+                writes.append(Write('delete', email_index_ref(db, email), None))
+            yield uid, writes
+    return transform
+
+
+def backfill_email_index(db, auth):
+    """Create users_by_email entries for users without one
+
+    Existing entries are left untouched. When several documents share a
+    normalized email the first one seen wins and the rest are reported as
+    duplicates.
+    """
+    seen = {}
+    stats = {'indexed': 0, 'already_indexed': 0, 'duplicates': 0, 'no_email': 0}
+
+    def transform(docs):
+        emails = {doc.id: (doc.to_dict() or {}).get('email') for doc in docs}
+        indexed = _index_uids(db, emails.values())
+        for doc in docs:
+            email = emails[doc.id]
+            key = email_index_key(email)
+            if not key:
+                stats['no_email'] += 1
+                continue
+            if key in seen:
+                if seen[key] != doc.id:
+                    stats['duplicates'] += 1
+                    logger.warning(f"Duplicate email {key}: {doc.id} (indexed as {seen[key]})")
+                continue
+            owner = indexed.get(key)
+            if owner:
+                seen[key] = owner
+                stats['already_indexed'] += 1
+                if owner != doc.id:
+                    stats['duplicates'] += 1
+                    logger.warning(f"Duplicate email {key}: {doc.id} (indexed as {owner})")
+                continue
+            seen[key] = doc.id
+            stats['indexed'] += 1
+            yield doc.id, [Write('set', email_index_ref(db, email), index_entry(email, doc.id))]
+
+    transform.stats = stats
+    return transform
+
+
+TRANSFORMS = {
+    'backfill-onboarded': backfill_onboarded,
+    'normalize-email': normalize_emails,
+    'migrate-ucl-data': migrate_ucl_data,
+    'delete-orphans': delete_orphans,
+    'backfill-email-index': backfill_email_index,
+}
+DESTRUCTIVE = {'delete-orphans'}
+
+
+def print_report(report):
+    print(f"✅ Scanned {report['scanned']} users in {report['elapsed_s']} s ({report['docs_per_sec']} docs/s)")
+    print(f"   {'Would change' if report['dry_run'] else 'Changed'}: "
+          f"{report['changed']} documents, {report['writes']} writes")
+    if not report['dry_run']:
+        print(f"   Committed: {report['committed']} writes in {report['batches']} batches "
+              f"({report['writes_per_sec']} writes/s, commit p50 {report['commit_p50_ms']} ms, "
+              f"p95 {report['commit_p95_ms']} ms, {report['retries']} retries)")
+    for name, value in (report.get('stats') or {}).items():
+        print(f"   {name.replace('_', ' ').capitalize()}: {value}")
+
+
+def firebase_clients():
+    """(Firestore client, firebase_admin.auth) from the app's Firebase setup, or None
+
+    Uses firebase_setup directly rather than importing app.py, whose import
+    also sets up the server's logging, signers and metrics store.
+    """
+    if not firebase_setup.init_firebase():
+        return None
+    from firebase_admin import auth
+    return firebase_setup.get_db(), auth
+
+
+def main(argv=None):
+    """Run a bulk transform over the users collection"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('transform', nargs='?', choices=sorted(TRANSFORMS))
+    parser.add_argument('--list', action='store_true', help='describe the available transforms')
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without writing')
+    parser.add_argument('--resume', action='store_true', help='continue from the checkpoint of an interrupted run')
+    parser.add_argument('--checkpoint', help='checkpoint file (default: <transform>.checkpoint.json)')
+    parser.add_argument('--workers', type=int, default=BULK_WORKERS, help='parallel batch commits')
+    parser.add_argument('--rate', type=float, default=BULK_WRITES_PER_SEC, help='max writes/sec (0 = unlimited)')
+    parser.add_argument('--page-size', type=int, default=BULK_PAGE_SIZE, help='documents read per query')
+    parser.add_argument('--limit', type=int, help='stop after this many documents')
+    parser.add_argument('--report', help='also write the throughput report as JSON')
+    parser.add_argument('--yes', action='store_true', help='confirm a destructive transform')
+    args = parser.parse_args(argv)
+
+    if args.list or not args.transform:
+        for name in sorted(TRANSFORMS):
+            summary = TRANSFORMS[name].__doc__.strip().splitlines()[0]
+            print(f"  {name:<22}{summary}{' (destructive)' if name in DESTRUCTIVE else ''}")
+        return 0
+    if args.transform in DESTRUCTIVE and not (args.dry_run or args.yes):
+        print(f"❌ {args.transform} deletes data - run with --dry-run first, then pass --yes")
+        return 1
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(name)s: %(message)s')
+    clients = firebase_clients()
+    if clients is None:
+        print("❌ Firebase is not initialized - check FIREBASE_SERVICE_ACCOUNT")
+        return 1
+    db, auth = clients
+
+    checkpoint = Checkpoint(args.checkpoint or f"{args.transform}.checkpoint.json")
+    start_after = None
+    state = checkpoint.load()
+    if args.resume and state:
+        if state.get('transform') != args.transform:
+            print(f"❌ {checkpoint.path} belongs to {state.get('transform')}, not {args.transform}")
+            return 1
+        if state.get('finished'):
+            print(f"✅ {args.transform} already finished ({checkpoint.path}); nothing to resume")
+            return 0
+        start_after = state.get('last_doc_id')
+        print(f"⏩ Resuming after {start_after or 'the beginning'}")
+    elif state and not state.get('finished') and not args.dry_run:
+        print(f"⚠️  Starting over; {checkpoint.path} had an unfinished run (use --resume to continue it)")
+
+    transform = TRANSFORMS[args.transform](db, auth)
+    run = BulkRun(db, args.transform, transform,
+                  collection=USERS_COLLECTION,
+                  page_size=args.page_size,
+                  workers=args.workers,
+                  writes_per_sec=args.rate,
+                  dry_run=args.dry_run,
+                  checkpoint=checkpoint,
+                  limit=args.limit,
+                  progress=lambda r: print(f"📈 {r['scanned']} scanned, {r['committed']} writes committed, "
+                                           f"{r['docs_per_sec']} docs/s"))
+
+    print(f"🔎 {args.transform}" + (" (dry run)" if args.dry_run else "")
+          + f": {args.workers} workers, batches of {MAX_BATCH_SIZE}, "
+          + (f"{args.rate:g} writes/s" if args.rate > 0 else "no rate limit"))
+    try:
+        report = run.run(start_after=start_after)
+    except KeyboardInterrupt:
+        print(f"⏸  Interrupted; rerun with --resume to continue from {checkpoint.path}")
+        return 130
+    report['stats'] = getattr(transform, 'stats', None)
+    print_report(report)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    if report['error']:
+        print(f"❌ Stopped after a batch failed: {report['error']}")
+        print(f"   Rerun with --resume to continue from {checkpoint.path}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
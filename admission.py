@@ -0,0 +1,269 @@
+"""
+Admission control for /callback
+
+SingleFlight runs one handler per authorization code and state: exact
+duplicates that arrive while it is running (browser retries, double taps)
+wait for it and get the same response instead of failing at the token
+exchange with an already-used code. The state is part of the key, so a
+request with the same code but another state never gets the leader's
+redirect. ConcurrencyLimiter caps how many callbacks run at once
+and how many may wait for a slot; anything beyond that is shed with a
+fast 503 so the worker threads stay free for /health and in-flight logins.
+Both are per process; the Async* variants do the same on an event loop
+for the ASGI app.
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict, deque
+
+CALLBACK_MAX_CONCURRENT = int(os.environ.get('CALLBACK_MAX_CONCURRENT', 16))
+CALLBACK_MAX_QUEUE = int(os.environ.get('CALLBACK_MAX_QUEUE', 32))
+CALLBACK_QUEUE_TIMEOUT = float(os.environ.get('CALLBACK_QUEUE_TIMEOUT', 2))
+CALLBACK_RETRY_AFTER = int(os.environ.get('CALLBACK_RETRY_AFTER', 2))
+# Keeping a finished login for later duplicates would hand its custom token to
+# a request whose state has already been used, so by default only concurrent
+# duplicates share a result
+SINGLE_FLIGHT_LINGER = float(os.environ.get('SINGLE_FLIGHT_LINGER', 0))
+
+# /callback outcomes that spent nothing on the code: shared with concurrent
+# duplicates but never kept, so a retry runs again
+UNCACHED_OUTCOMES = ('shed', 'invalid_state')
+
+
+class Uncached(Exception):
+    """Raised by a SingleFlight function to return `result` to the callers
+    already waiting for it without keeping it for later duplicates"""
+
+    def __init__(self, result):
+        super().__init__()
+        self.result = result
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'expires_at')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.expires_at = None
+
+
+def flight_key(code, state):
+    """SingleFlight key for a /callback: only exact duplicates share a result"""
+    return f"{code}\n{state or ''}"
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one
+
+    With linger > 0 a finished result is kept for `linger` seconds so a
+    duplicate that arrives just after the first completes still gets it,
+    unless the function raised Uncached. Keys are hashed, so authorization codes are
+    not kept in memory.
+    """
+
+    def __init__(self, linger=SINGLE_FLIGHT_LINGER, max_entries=10000):
+        self.linger = linger
+        self.max_entries = max_entries
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._calls:
+            key, call = next(iter(self._calls.items()))
+            if call.expires_at is None or (call.expires_at > now and len(self._calls) <= self.max_entries):
+                break
+            del self._calls[key]
+
+    def _join(self, key, new_call):
+        """Return (hashed key, call, leader) for key, registering a new call if none is tracked"""
+        key = hashlib.sha256(key.encode('utf-8')).digest()
+        with self._lock:
+            self._expire(time.monotonic())
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = new_call()
+                self.leaders += 1
+                return key, call, True
+            self.coalesced += 1
+            return key, call, False
+
+    def _finish(self, key, call):
+        with self._lock:
+            if call.error is not None or self.linger <= 0:
+                self._calls.pop(key, None)
+            else:
+                call.expires_at = time.monotonic() + self.linger
+                self._calls.move_to_end(key)
+
+    def do(self, key, fn):
+        """Return (fn(), shared); shared is True if another caller's result was reused"""
+        key, call, leader = self._join(key, _Call)
+        if not leader:
+            call.done.wait()
+            if isinstance(call.error, Uncached):
+                return call.error.result, True
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Uncached as e:
+            call.error = e
+            return e.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {'leaders': self.leaders, 'coalesced': self.coalesced, 'tracked': len(self._calls)}
+
+
+class ConcurrencyLimiter:
+    """At most max_concurrent holders, at most max_queue waiters, waits bounded by timeout"""
+
+    def __init__(self, max_concurrent=CALLBACK_MAX_CONCURRENT, max_queue=CALLBACK_MAX_QUEUE,
+                 timeout=CALLBACK_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = {'queue_full': 0, 'timeout': 0}
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Take a slot; returns None, or the reason the request was shed"""
+        with self._cond:
+            if self.active < self.max_concurrent and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                return None
+            if self.waiting >= self.max_queue:
+                self.shed['queue_full'] += 1
+                return 'queue_full'
+            self.waiting += 1
+            try:
+                if not self._cond.wait_for(lambda: self.active < self.max_concurrent, self.timeout):
+                    self.shed['timeout'] += 1
+                    return 'timeout'
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+            return None
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'shed': dict(self.shed),
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue
+            }
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight for coroutine functions on one event loop"""
+
+    @staticmethod
+    def _new_call():
+        call = _Call()
+        call.done = asyncio.get_running_loop().create_future()
+        return call
+
+    async def do(self, key, fn):
+        """Return (await fn(), shared)"""
+        key, call, leader = self._join(key, self._new_call)
+        if not leader:
+            await asyncio.shield(call.done)
+            if isinstance(call.error, Uncached):
+                return call.error.result, True
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = await fn()
+        except Uncached as e:
+            call.error = e
+            return e.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+            if not call.done.done():
+                call.done.set_result(None)
+        return call.result, False
+
+
+class AsyncConcurrencyLimiter(ConcurrencyLimiter):
+    """ConcurrencyLimiter for one event loop; a released slot goes to the oldest waiter"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._waiters = deque()
+
+    async def acquire(self):
+        """Take a slot; returns None, or the reason the request was shed"""
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            self.shed['queue_full'] += 1
+            return 'queue_full'
+        slot = asyncio.get_running_loop().create_future()
+        self._waiters.append(slot)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(slot), self.timeout)
+        except asyncio.TimeoutError:
+            if not slot.done():
+                slot.cancel()
+                self._waiters.remove(slot)
+                self.shed['timeout'] += 1
+                return 'timeout'
+        except asyncio.CancelledError:
+            # Client went away: pass on a slot we were already handed, or leave the queue
+            if slot.done():
+                self.release()
+            else:
+                slot.cancel()
+                self._waiters.remove(slot)
+            raise
+        finally:
+            self.waiting -= 1
+        # release() handed its slot over, so active is already counted
+        self.admitted += 1
+        return None
+
+    def release(self):
+        while self._waiters:
+            slot = self._waiters.popleft()
+            if not slot.done():
+                slot.set_result(None)
+                return
+        self.active -= 1
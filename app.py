@@ -1,16 +1,48 @@
-from flask import Flask, redirect, request, session, jsonify, url_for
+from flask import Flask, Response, g, redirect, request, jsonify, url_for
 import requests
-import secrets
 import os
+import hmac
+import time
 from datetime import datetime, timedelta
-import json
+from functools import partial
 import logging
+from urllib.parse import urlencode
+
+import firebase_setup
+from firebase_setup import init_firebase, get_db, startup_report
+from ucl_client import get_ucl_client
+from circuit_breaker import STATES as BREAKER_STATES, CircuitOpenError
+from user_cache import get_email_uid_cache
+from user_store import normalize_email, resolve_uid, save_new_user
+from write_behind import get_write_behind_queue
+import lookup_pool
+from token_signer import get_token_signer
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, StageTimer, record_request, registry, render_metrics
+from metrics import store as metrics_store
+from log_setup import end_request_sampling, setup_logging, start_request_sampling
+from oauth_state import InvalidState, get_state_signer
+from admission import CALLBACK_RETRY_AFTER, UNCACHED_OUTCOMES, ConcurrencyLimiter, SingleFlight, Uncached, flight_key
+from readiness import get_dependency_prober, tcp_probe
+from traffic_recorder import get_traffic_recorder
+from profiler import FORMATS as PROFILE_FORMATS, get_profiler
+from login_analytics import get_login_analytics
+from static_responses import CompiledTemplate, PrecomputedResponse
+
+# Publicly known keys: the hard-coded development default and the env.example placeholder
+INSECURE_SECRET_KEYS = ('supersecretkey123', 'your_super_secret_key_here')
 
 app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', 'supersecretkey123')
+app.secret_key = os.environ.get('SECRET_KEY') or INSECURE_SECRET_KEYS[0]
+if app.secret_key in INSECURE_SECRET_KEYS and os.environ.get('FLASK_ENV') == 'production':
+    # Anyone could sign a valid OAuth state with a published key
+    raise RuntimeError('SECRET_KEY must be set to a private value in production')
+
+# OAuth state is signed with SECRET_KEY instead of kept in the session,
+# so every replica must share the same SECRET_KEY
+state_signer = get_state_signer(app.secret_key)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (queue-based, structured JSON, redacted and sampled)
+log_handler = setup_logging()
 logger = logging.getLogger(__name__)
 
 # UCL API Configuration
@@ -18,272 +50,470 @@ UCL_CLIENT_ID = os.environ.get('UCL_CLIENT_ID', 'your_ucl_client_id')
 UCL_CLIENT_SECRET = os.environ.get('UCL_CLIENT_SECRET', 'your_ucl_client_secret')
 REDIRECT_URI = os.environ.get('REDIRECT_URI', 'http://localhost:5000/callback')
 
+# Bearer token for the /admin endpoints; they 404 while it is unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
 # Firebase Admin SDK for user management
-try:
-    import firebase_admin
-    from firebase_admin import credentials, auth, firestore
+# Credentials are parsed here (once in the gunicorn master with --preload);
+# the Firestore client is created lazily per worker by get_db()
+firebase_initialized = init_firebase()
+firebase_cred = firebase_setup.firebase_cred
+if firebase_initialized:
+    from firebase_admin import auth
     from firebase_admin.exceptions import FirebaseError
+    from google.api_core.exceptions import NotFound
+
+email_uid_cache = get_email_uid_cache()
+write_behind = get_write_behind_queue(get_db) if firebase_initialized else None
+token_signer = get_token_signer(firebase_cred) if firebase_initialized else None
+# Optional JSONL capture of request timing for benchmarks/replay.py
+traffic_recorder = get_traffic_recorder()
+# On-demand sampling profiler behind /admin/profile (idle unless a session is running)
+profiler = get_profiler()
+# Per-minute/per-day login counts and unique users for /admin/analytics
+login_analytics = get_login_analytics()
+
+# Duplicate /callback requests for one code share a single run; at most
+# CALLBACK_MAX_CONCURRENT run at once and the overflow queue is bounded
+callback_flights = SingleFlight()
+callback_limiter = ConcurrencyLimiter()
+
+def _probe_firestore(timeout):
+    """Readiness check: one document read (the document doesn't need to exist)"""
+    if not firebase_initialized:
+        raise RuntimeError('Firebase not initialized')
+    get_db().collection('_readiness').document('probe').get(retry=None, timeout=timeout)
+
+# Dependency reachability for /ready, probed in the background per worker.
+# Only Firestore gates readiness: uclapi.com is shared by every replica, so
+# taking them all out of rotation when it fails would not help (the circuit
+# breaker handles that) - it is reported for visibility
+dependency_prober = get_dependency_prober({
+    'firestore': _probe_firestore,
+    'ucl_api': lambda timeout: tcp_probe(get_ucl_client().base_url, timeout)
+}, required=('firestore',))
+
+# Fold the snapshots of workers that have exited into the aggregate
+metrics_store.fold()
+
+# Component counters exported on /metrics alongside the request metrics
+def _ucl_breaker_metric(fn):
+    """Collector reading the UCL client's circuit breaker (nothing if disabled)"""
+    def collect():
+        breaker = get_ucl_client().breaker
+        return fn(breaker) if breaker else {}
+    return collect
+
+registry.collector('conni_ucl_api_connections_total', 'counter', 'Upstream uclapi.com connections by kind',
+                   lambda: {f'kind="{kind.split("_")[0]}"': count
+                            for kind, count in get_ucl_client().connection_stats().items()})
+registry.collector('conni_email_uid_cache_requests_total', 'counter', 'Email -> UID cache lookups by result',
+                   lambda: {'result="hit"': email_uid_cache.hits, 'result="miss"': email_uid_cache.misses})
+registry.collector('conni_write_behind_queue_depth', 'gauge', 'Updates waiting in the write-behind queue',
+                   lambda: write_behind.stats()['queue_depth'] if write_behind else 0)
+registry.collector('conni_log_records_dropped_total', 'counter', 'Log records dropped because the log queue was full',
+                   lambda: log_handler.dropped)
+registry.collector('conni_ucl_breaker_state', 'gauge', 'uclapi.com circuit breaker state (1 = current)',
+                   _ucl_breaker_metric(lambda b: {f'state="{state}"': int(b.state == state) for state in BREAKER_STATES}))
+registry.collector('conni_ucl_breaker_calls_total', 'counter', 'uclapi.com calls by breaker outcome',
+                   _ucl_breaker_metric(lambda b: {f'result="{result}"': n for result, n in b.calls.items()}))
+registry.collector('conni_ucl_breaker_transitions_total', 'counter', 'uclapi.com circuit breaker state changes',
+                   _ucl_breaker_metric(lambda b: {f'from="{a}",to="{t}"': n for (a, t), n in b.transitions.items()}))
+registry.collector('conni_ucl_hedged_requests_total', 'counter', 'Hedged user-data requests sent and won',
+                   lambda: {f'result="{result}"': count for result, count in get_ucl_client().hedge_stats().items()})
+registry.collector('conni_callback_coalesced_total', 'counter', 'Duplicate /callback requests that reused a result',
+                   lambda: callback_flights.coalesced)
+registry.collector('conni_callback_shed_total', 'counter', '/callback requests rejected with 503 by reason',
+                   lambda: {f'reason="{reason}"': n for reason, n in callback_limiter.stats()['shed'].items()})
+registry.collector('conni_callback_inflight', 'gauge', '/callback requests running',
+                   lambda: callback_limiter.active)
+registry.collector('conni_callback_queued', 'gauge', '/callback requests waiting for a slot',
+                   lambda: callback_limiter.waiting)
+registry.collector('conni_dependency_up', 'gauge', 'Last background probe of each dependency succeeded and is fresh',
+                   lambda: {f'dependency="{name}"': int(dep['status'] == 'up')
+                            for name, dep in dependency_prober.snapshot()['dependencies'].items()})
+registry.collector('conni_write_behind_dropped_total', 'counter', 'Write-behind updates that could not be written',
+                   lambda: write_behind.stats()['dropped'] if write_behind else 0)
+registry.collector('conni_write_behind_recreated_total', 'counter',
+                   'Users recreated because a write-behind update found their document deleted',
+                   lambda: write_behind.stats()['recreated'] if write_behind else 0)
+
+@app.before_request
+def start_request_timer():
+    """Start timing the request (and its stages, for /callback)"""
+    g.log_sampling = start_request_sampling()
+    g.request_start = time.perf_counter()
+    g.stage_timer = StageTimer() if request.endpoint == 'callback' else None
+    dependency_prober.ensure_running()
+    if profiler.active:
+        profiler.begin(request.url_rule.rule if request.url_rule else 'unmatched', g.stage_timer)
+
+@app.teardown_request
+def end_request_profile(exc):
+    """Stop attributing this thread's profile samples (and log records) to the request"""
+    if profiler.active:
+        profiler.end()
+    if 'log_sampling' in g:
+        end_request_sampling(g.log_sampling)
+
+@app.after_request
+def record_request_metrics(response):
+    """Record latency metrics and expose them in a Server-Timing header"""
+    start = g.get('request_start')
+    if start is None:
+        return response
+    duration = time.perf_counter() - start
+    timer = g.get('stage_timer')
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    record_request(route, response.status_code, duration, timer)
+    if traffic_recorder:
+        traffic_recorder.record(route, response.status_code, duration, timer)
+    if timer is not None:
+        response.headers['Server-Timing'] = timer.server_timing(total=duration)
+    else:
+        response.headers['Server-Timing'] = f"total;dur={duration * 1000:.1f}"
+    return response
+
+def ucl_authorise_url():
+    """UCL OAuth authorization URL with a fresh state"""
+    # Signed, self-contained state; verified in /callback without a session
+    state = state_signer.issue()
     
-    # Initialize Firebase Admin SDK
-    if not firebase_admin._apps:
-        # For production, use environment variable for Firebase config
-        if os.environ.get('FIREBASE_SERVICE_ACCOUNT'):
-            # Parse JSON from environment variable
-            firebase_config = json.loads(os.environ['FIREBASE_SERVICE_ACCOUNT'])
-            cred = credentials.Certificate(firebase_config)
-        else:
-            # Fallback to file (for local development)
-            cred = credentials.Certificate('firebase-service-account.json')
-        firebase_admin.initialize_app(cred)
-    
-    db = firestore.client()
-    firebase_initialized = True
-except ImportError:
-    print("Firebase Admin SDK not installed. Install with: pip install firebase-admin")
-    firebase_initialized = False
-except Exception as e:
-    print(f"Firebase initialization failed: {e}")
-    firebase_initialized = False
+    # Build the UCL OAuth authorization URL exactly as per documentation
+    return (
+        f"https://uclapi.com/oauth/authorise/"
+        f"?client_id={UCL_CLIENT_ID}"
+        f"&state={state}"
+    )
 
 @app.route('/login/ucl')
 def login_ucl():
     """Initiate UCL OAuth flow"""
     try:
-        # Generate a random state parameter for security
-        state = secrets.token_urlsafe(32)
-        session['oauth_state'] = state
-        
-        # Build the UCL OAuth authorization URL exactly as per documentation
-        auth_url = (
-            f"https://uclapi.com/oauth/authorise/"
-            f"?client_id={UCL_CLIENT_ID}"
-            f"&state={state}"
-        )
-        
-        return redirect(auth_url)
+        return redirect(ucl_authorise_url())
     except Exception as e:
         return jsonify({'error': f'Failed to initiate UCL login: {str(e)}'}), 500
 
 @app.route('/callback')
 def callback():
     """Handle UCL OAuth callback"""
+    code = request.args.get('code')
+    if not code:
+        return _handle_callback()
+    
+    (body, status, headers, outcome), shared = callback_flights.do(flight_key(code, request.args.get('state')),
+                                                                   _admit_callback)
+    if shared:
+        # A shed or invalid-state result is passed on as what it is, so /metrics counts it
+        g.stage_timer.outcome = outcome if outcome in UNCACHED_OUTCOMES else 'coalesced'
+        logger.info("Reused result of an in-flight callback for the same code")
+    return Response(body, status, headers)
+
+def _admit_callback():
+    """Run the callback under the concurrency limit; returns a shareable (body, status, headers, outcome)"""
+    timer = g.stage_timer
+    with timer.stage('admission_wait'):
+        shed_reason = callback_limiter.acquire()
+    if shed_reason:
+        logger.warning("Shedding /callback request", extra={'reason': shed_reason})
+        timer.outcome = 'shed'
+        response = jsonify({'error': 'Server busy, please retry shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(CALLBACK_RETRY_AFTER)
+    else:
+        try:
+            response = app.make_response(_handle_callback())
+        finally:
+            callback_limiter.release()
+    # Plain values, so waiting duplicates can each build their own Response
+    result = response.get_data(), response.status_code, list(response.headers.items()), timer.outcome
+    if timer.outcome in UNCACHED_OUTCOMES:
+        # Nothing was spent on the code: a retry after Retry-After must run again
+        raise Uncached(result)
+    return result
+
+def _find_auth_uid(email):
+    """UID of the Firebase Auth user with this email, or None"""
     try:
+        return auth.get_user_by_email(email).uid
+    except auth.UserNotFoundError:
+        return None
+
+def _mint_custom_token(user_id):
+    """Custom token for the app, signed locally with the preloaded service-account key when possible"""
+    if token_signer:
+        return token_signer.create_custom_token(user_id)
+    return auth.create_custom_token(user_id)
+
+def ucl_user_fields(ucl_user_data):
+    """The fields we keep from a UCL API user-data response"""
+    return {
+        'email': ucl_user_data.get('email', ''),
+        'is_student': ucl_user_data.get('is_student', True),
+        'full_name': ucl_user_data.get('full_name', 'UCL Student'),
+        'department': ucl_user_data.get('department', 'Unknown'),
+        'upi': ucl_user_data.get('upi', 'unknown')
+    }
+
+def new_user_doc(user_data, ucl_data):
+    """users/{uid} document for a user first seen (or recreated) at this login"""
+    return {
+        'email': user_data.get('email'),
+        'display_name': user_data.get('full_name', 'UCL Student'),
+        'ucl_verified': True,
+        'ucl_data': ucl_data,
+        'created_at': datetime.utcnow(),
+        'last_login': datetime.utcnow(),
+        'auth_method': 'ucl_oauth',
+        'isOnboarded': False  # New users should go through onboarding
+    }
+
+def _recreate_user(user_id, email, user_doc):
+    """Write-behind found the user document deleted: recreate it like the synchronous path would"""
+    logger.warning("User document no longer exists, recreating", extra={'uid': user_id})
+    email_uid_cache.invalidate(normalize_email(email))
+    save_new_user(get_db(), user_id, email, user_doc)
+
+def complete_login(user_data, token_data, timer):
+    """Find or create the Firebase user for verified UCL data and mint their custom token
+
+    Returns (redirect_url, None), or (None, error) on a Firebase error.
+    Blocking; the async app (asgi_app.py) runs it in a worker thread.
+    """
+    email = user_data['email']
+    
+    # Check if user exists in Firebase/Firestore
+    user_info = {
+        'email': user_data.get('email'),
+        'ucl_data': {
+            'department': user_data.get('department', 'Unknown'),
+            'full_name': user_data.get('full_name', 'UCL Student'),
+            'upi': user_data.get('upi', 'unknown'),
+            'is_student': user_data.get('is_student', True),
+            'verified_at': datetime.utcnow().isoformat(),
+            'auth_method': 'ucl_oauth',
+            'token_scope': token_data.get('scope', 'unknown')
+        }
+    }
+    
+    if firebase_initialized:
+        try:
+            # Returning users are usually resolved from the email -> UID cache
+            email_key = normalize_email(email)
+            is_new_user = False
+            
+            with timer.stage('user_lookup'):
+                user_id = email_uid_cache.get(email_key)
+                auth_lookup = None
+                
+                if user_id:
+                    logger.debug("Email -> UID cache hit", extra={'uid': user_id})
+                else:
+                    # The users_by_email index read and the Firebase Auth lookup are
+                    # independent, so both go out at once. The index wins; the Auth
+                    # result is only used if this turns out to be a new UCL user.
+                    auth_lookup = lookup_pool.submit(_find_auth_uid, email)
+                    user_id = resolve_uid(get_db(), email)
+                    
+                    if user_id:
+                        logger.debug("Found existing user", extra={'uid': user_id})
+                        email_uid_cache.put(email_key, user_id)
+            
+            if user_id:
+                # Update existing user's UCL data and last login
+                # Ensure existing users are marked as onboarded (they've used the app before)
+                last_login_update = {
+                    'ucl_data': user_info['ucl_data'],
+                    'last_login': datetime.utcnow(),
+                    'ucl_token_scope': token_data.get('scope', 'unknown'),
+                    'isOnboarded': True  # Existing users should skip onboarding
+                }
+                # The UID is known: mint the token while the update is written
+                minted = lookup_pool.submit(_mint_custom_token, user_id)
+                with timer.stage('firestore_write'):
+                    recreate = partial(_recreate_user, user_id, email, new_user_doc(user_data, user_info['ucl_data']))
+                    if write_behind and write_behind.submit(user_id, last_login_update, on_missing=recreate):
+                        # Flushed in the background - the redirect doesn't wait for it
+                        logger.debug("Queued update for existing UCL user", extra={'uid': user_id})
+                    else:
+                        user_ref = get_db().collection('users').document(user_id)
+                        try:
+                            user_ref.update(last_login_update)
+                            logger.debug("Updated existing UCL user", extra={'uid': user_id})
+                        except NotFound:
+                            # Cached or indexed UID points at a deleted document - treat as a new user
+                            logger.warning("User document no longer exists, recreating", extra={'uid': user_id})
+                            email_uid_cache.invalidate(email_key)
+                            user_id = None
+            
+            if not user_id:
+                # No existing UCL user found - create new one
+                logger.info("No existing UCL user found, creating new user", extra={'email': email})
+                is_new_user = True
+                
+                # Check if Firebase user exists by email (might be from regular signup)
+                ucl_email = user_data.get('email')
+                with timer.stage('auth_user'):
+                    user_id = auth_lookup.result() if auth_lookup else _find_auth_uid(ucl_email)
+                    if user_id:
+                        logger.info("Found existing Firebase user", extra={'uid': user_id})
+                    else:
+                        # Create new Firebase user
+                        firebase_user = auth.create_user(
+                            email=ucl_email,
+                            email_verified=True,  # UCL email is considered verified
+                            display_name=user_data.get('full_name', 'UCL Student')
+                        )
+                        user_id = firebase_user.uid
+                        logger.info("Created new Firebase user", extra={'uid': user_id})
+                
+                # Create/update user document and its email index entry in Firestore,
+                # minting the token at the same time
+                minted = lookup_pool.submit(_mint_custom_token, user_id)
+                with timer.stage('firestore_write'):
+                    # Written with merge=True so existing fields are not overwritten
+                    save_new_user(get_db(), user_id, email, new_user_doc(user_data, user_info['ucl_data']))
+                email_uid_cache.put(email_key, user_id)
+            
+            # Custom token for the React Native app (time spent waiting for it, if any)
+            with timer.stage('mint_token'):
+                custom_token = minted.result()
+            
+            # Redirect back to the app with the custom token
+            # For Expo Go, we'll use a different approach
+            custom_token_str = custom_token.decode('utf-8')
+            
+            # Store the token in a way that the app can retrieve it
+            # We'll use a simple approach: redirect to a success page with the token
+            action = "signup" if is_new_user else "login"
+            redirect_url = f"conni://success?token={custom_token_str}&action={action}"
+            
+            # The redirect URL carries the custom token, so it is never logged
+            logger.info("UCL login complete", extra={'uid': user_id, 'action': action})
+            
+            if login_analytics:
+                ucl_data = user_info['ucl_data']
+                # Unique users are counted by UPI (by email if UCL sent none)
+                upi = ucl_data['upi'] if ucl_data['upi'] != 'unknown' else email_key
+                login_analytics.record(upi, ucl_data['department'], ucl_data['is_student'], is_new_user)
+            
+            timer.outcome = 'new_user' if is_new_user else 'returning_user'
+            return redirect_url, None
+            
+        except FirebaseError as e:
+            timer.outcome = 'firebase_error'
+            return None, f'Firebase error: {str(e)}'
+    
+    else:
+        # Fallback if Firebase is not initialized - redirect with error
+        app_scheme = "conni"  # Update this to your app's URL scheme
+        redirect_url = f"{app_scheme}://ucl-callback?error=Firebase not initialized"
+        timer.outcome = 'firebase_unavailable'
+        return redirect_url, None
+
+def _handle_callback():
+    try:
+        timer = g.stage_timer
         result = request.args.get('result')
         code = request.args.get('code')
         state = request.args.get('state')
         
         # Verify the state parameter
-        if state != session.get('oauth_state'):
+        try:
+            state_signer.verify(state)
+        except InvalidState as e:
+            logger.warning("Rejected OAuth state", extra={'reason': e.reason})
+            timer.outcome = 'invalid_state'
             return jsonify({'error': 'Invalid state parameter'}), 400
         
         # Check if user denied access
         if result != 'allowed':
+            timer.outcome = 'access_denied'
             return jsonify({'error': 'Access denied by user'}), 403
         
         if not code:
+            timer.outcome = 'missing_code'
             return jsonify({'error': 'Authorization code not provided'}), 400
         
+        ucl_client = get_ucl_client()
+        
         # Exchange authorization code for access token
-        token_response = requests.post(
-            'https://uclapi.com/oauth/token',
-            data={
-                'client_id': UCL_CLIENT_ID,
-                'client_secret': UCL_CLIENT_SECRET,
-                'code': code
-            },
-            timeout=30
-        )
+        with timer.stage('token_exchange'):
+            token_response = ucl_client.exchange_code(code, UCL_CLIENT_ID, UCL_CLIENT_SECRET)
         
         if token_response.status_code != 200:
-            logger.error(f"Token exchange error: Status {token_response.status_code}")
-            logger.error(f"Response: {token_response.text}")
+            logger.error("Token exchange failed", extra={'status': token_response.status_code,
+                                                         'body': token_response.text[:500]})
+            timer.outcome = 'token_exchange_failed'
             return jsonify({'error': f'Failed to exchange code for token: {token_response.status_code}'}), 400
         
         token_data = token_response.json()
-        logger.info(f"Token response: {token_data}")
         access_token = token_data.get('token')
         
         if not access_token:
+            timer.outcome = 'no_access_token'
             return jsonify({'error': 'No access token received'}), 400
         
         # Fetch user data from UCL API
-        logger.info(f"Fetching user data from UCL API with token: {access_token[:10]}...")
-        
         try:
-            user_response = requests.get(
-                f'https://uclapi.com/oauth/user/data',
-                params={
-                    'token': access_token,
-                    'client_secret': UCL_CLIENT_SECRET
-                },
-                timeout=30
-            )
+            with timer.stage('user_data'):
+                user_response = ucl_client.get_user_data(access_token, UCL_CLIENT_SECRET)
             
             if user_response.status_code == 200:
-                ucl_user_data = user_response.json()
-                logger.info(f"UCL API user data response: {ucl_user_data}")
-                
-                # Extract user data from UCL API response
-                email = ucl_user_data.get('email', '')
-                full_name = ucl_user_data.get('full_name', 'UCL Student')
-                department = ucl_user_data.get('department', 'Unknown')
-                upi = ucl_user_data.get('upi', 'unknown')
-                is_student = ucl_user_data.get('is_student', True)
-                
-                user_data = {
-                    'email': email,
-                    'is_student': is_student,
-                    'full_name': full_name,
-                    'department': department,
-                    'upi': upi
-                }
+                user_data = ucl_user_fields(user_response.json())
+                email = user_data['email']
                 
-                logger.info(f"Successfully retrieved UCL user data for: {email}")
+                logger.info("Retrieved UCL user data", extra={'email': email, 'scope': token_data.get('scope')})
             else:
-                logger.error(f"Failed to get user data from UCL: Status {user_response.status_code}")
-                logger.error(f"Response: {user_response.text}")
+                logger.error("Failed to get user data from UCL", extra={'status': user_response.status_code,
+                                                                        'body': user_response.text[:500]})
+                timer.outcome = 'user_data_failed'
                 return jsonify({'error': f'Failed to get user data from UCL: {user_response.status_code}'}), 400
                 
         except requests.RequestException as e:
-            logger.error(f"Network error fetching UCL user data: {e}")
+            logger.error("Network error fetching UCL user data", extra={'error': str(e)})
+            timer.outcome = 'network_error'
             return jsonify({'error': f'Network error: {str(e)}'}), 500
         
         if not email:
             logger.error("No email received from UCL API")
+            timer.outcome = 'no_email'
             return jsonify({'error': 'No email received from UCL API'}), 400
         
-        # Check if user exists in Firebase/Firestore
-        user_info = {
-            'email': user_data.get('email'),
-            'ucl_data': {
-                'department': user_data.get('department', 'Unknown'),
-                'full_name': user_data.get('full_name', 'UCL Student'),
-                'upi': user_data.get('upi', 'unknown'),
-                'is_student': user_data.get('is_student', True),
-                'verified_at': datetime.utcnow().isoformat(),
-                'auth_method': 'ucl_oauth',
-                'token_scope': token_data.get('scope', 'unknown')
-            }
-        }
-        
-        if firebase_initialized:
-            try:
-                # First, check if a UCL user already exists by looking for UCL data in Firestore
-                logger.info(f"Looking for existing UCL user with email: {user_data.get('email')}")
-                
-                # Query Firestore for existing UCL users by email
-                # Use the real UCL email to find existing users
-                existing_users = db.collection('users').where('email', '==', user_data.get('email')).limit(1).get()
-                
-                user_id = None
-                is_new_user = False
-                
-                if existing_users:
-                    # User exists - get their Firebase UID
-                    for doc in existing_users:
-                        user_id = doc.id
-                        logger.info(f"Found existing user with email {email}: {user_id}")
-                        break
-                
-                if user_id:
-                    # Update existing user's UCL data and last login
-                    # Ensure existing users are marked as onboarded (they've used the app before)
-                    user_ref = db.collection('users').document(user_id)
-                    user_ref.update({
-                        'ucl_data': user_info['ucl_data'],
-                        'last_login': datetime.utcnow(),
-                        'ucl_token_scope': token_data.get('scope', 'unknown'),
-                        'isOnboarded': True  # Existing users should skip onboarding
-                    })
-                    logger.info(f"Updated existing UCL user: {user_id}")
-                else:
-                    # No existing UCL user found - create new one
-                    logger.info("No existing UCL user found, creating new user")
-                    is_new_user = True
-                    
-                    # Check if Firebase user exists by email (might be from regular signup)
-                    ucl_email = user_data.get('email')
-                    try:
-                        firebase_user = auth.get_user_by_email(ucl_email)
-                        user_id = firebase_user.uid
-                        logger.info(f"Found existing Firebase user: {user_id}")
-                    except auth.UserNotFoundError:
-                        # Create new Firebase user
-                        firebase_user = auth.create_user(
-                            email=ucl_email,
-                            email_verified=True,  # UCL email is considered verified
-                            display_name=user_data.get('full_name', 'UCL Student')
-                        )
-                        user_id = firebase_user.uid
-                        logger.info(f"Created new Firebase user: {user_id}")
-                    
-                    # Create/update user document in Firestore
-                    user_ref = db.collection('users').document(user_id)
-                    user_ref.set({
-                        'email': user_data.get('email'),
-                        'display_name': user_data.get('full_name', 'UCL Student'),
-                        'ucl_verified': True,
-                        'ucl_data': user_info['ucl_data'],
-                        'created_at': datetime.utcnow(),
-                        'last_login': datetime.utcnow(),
-                        'auth_method': 'ucl_oauth',
-                        'isOnboarded': False  # New users should go through onboarding
-                    }, merge=True)  # merge=True updates existing fields without overwriting
-                
-                # Generate a custom token for the React Native app
-                custom_token = auth.create_custom_token(user_id)
-                
-                # Redirect back to the app with the custom token
-                # For Expo Go, we'll use a different approach
-                custom_token_str = custom_token.decode('utf-8')
-                
-                # Store the token in a way that the app can retrieve it
-                # We'll use a simple approach: redirect to a success page with the token
-                action = "signup" if is_new_user else "login"
-                redirect_url = f"conni://success?token={custom_token_str}&action={action}"
-                
-                logger.info(f"Redirecting to app with URL: {redirect_url} (action: {action})")
-                
-                return redirect(redirect_url)
-                
-            except FirebaseError as e:
-                return jsonify({'error': f'Firebase error: {str(e)}'}), 500
-        
-        else:
-            # Fallback if Firebase is not initialized - redirect with error
-            app_scheme = "conni"  # Update this to your app's URL scheme
-            redirect_url = f"{app_scheme}://ucl-callback?error=Firebase not initialized"
-            return redirect(redirect_url)
+        redirect_url, error = complete_login(user_data, token_data, timer)
+        if error:
+            return jsonify({'error': error}), 500
+        return redirect(redirect_url)
     
+    except CircuitOpenError as e:
+        # uclapi.com is failing or too slow: send the user straight back to
+        # the app instead of holding a worker on it
+        logger.warning("UCL API circuit open, skipping login", extra={'retry_after': round(e.retry_after)})
+        g.stage_timer.outcome = 'upstream_unavailable'
+        return redirect("conni://ucl-callback?" + urlencode({
+            'error': 'UCL login is temporarily unavailable. Please try again shortly.',
+            'retry_after': int(e.retry_after)
+        }))
     except requests.RequestException as e:
+        g.stage_timer.outcome = 'network_error'
         return jsonify({'error': f'Network error: {str(e)}'}), 500
     except Exception as e:
+        g.stage_timer.outcome = 'unexpected_error'
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
 
-@app.route('/success')
-def success_page():
-    """Success page for OAuth callback"""
-    token = request.args.get('token')
-    action = request.args.get('action', 'login')  # 'login' or 'signup'
-    
-    if not token:
-        return jsonify({'error': 'No token provided'}), 400
-    
-    action_text = "Welcome back!" if action == "login" else "Welcome to Conni!"
-    action_description = "You've successfully logged in with UCL." if action == "login" else "Your UCL account has been created successfully."
-    
-    return f"""
+# Compiled once; each request only substitutes the escaped token and action
+SUCCESS_PAGE = CompiledTemplate("""
     <!DOCTYPE html>
     <html>
     <head>
-        <title>UCL {action.title()} Successful</title>
+        <title>UCL {{ action_title }} Successful</title>
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
         <style>
-            body {{ font-family: Arial, sans-serif; text-align: center; padding: 20px; }}
-            .success {{ color: #4CAF50; }}
-            .action {{ color: #1E40AF; font-size: 18px; margin: 10px 0; }}
-            .token {{ background: #f5f5f5; padding: 10px; border-radius: 5px; word-break: break-all; font-family: monospace; margin: 10px 0; }}
-            .copy-btn {{ 
+            body { font-family: Arial, sans-serif; text-align: center; padding: 20px; }
+            .success { color: #4CAF50; }
+            .action { color: #1E40AF; font-size: 18px; margin: 10px 0; }
+            .token { background: #f5f5f5; padding: 10px; border-radius: 5px; word-break: break-all; font-family: monospace; margin: 10px 0; }
+            .copy-btn { 
                 background: #836FFF; 
                 color: white; 
                 border: none; 
@@ -292,109 +522,227 @@ def success_page():
                 cursor: pointer; 
                 font-size: 16px;
                 margin: 10px 0;
-            }}
-            .copy-btn:hover {{ background: #6B46C1; }}
-            .copied {{ background: #4CAF50 !important; }}
+            }
+            .copy-btn:hover { background: #6B46C1; }
+            .copied { background: #4CAF50 !important; }
         </style>
     </head>
     <body>
-        <h1 class="success">✅ UCL {action.title()} Successful!</h1>
-        <p class="action">{action_text}</p>
-        <p>{action_description}</p>
+        <h1 class="success">✅ UCL {{ action_title }} Successful!</h1>
+        <p class="action">{{ action_text }}</p>
+        <p>{{ action_description }}</p>
         <p><strong>Token:</strong></p>
-        <div class="token" id="token">{token}</div>
+        <div class="token" id="token">{{ token }}</div>
         <button class="copy-btn" onclick="copyToken()">📋 Copy Token to Clipboard</button>
-        <p><small>Copy this token and paste it in the Conni app to complete your {action}.</small></p>
+        <p><small>Copy this token and paste it in the Conni app to complete your {{ action }}.</small></p>
         
         <script>
-            function copyToken() {{
+            function copyToken() {
                 const tokenElement = document.getElementById('token');
                 const token = tokenElement.textContent;
                 
-                navigator.clipboard.writeText(token).then(function() {{
+                navigator.clipboard.writeText(token).then(function() {
                     const btn = document.querySelector('.copy-btn');
                     const originalText = btn.textContent;
                     btn.textContent = '✅ Copied!';
                     btn.classList.add('copied');
                     
-                    setTimeout(function() {{
+                    setTimeout(function() {
                         btn.textContent = originalText;
                         btn.classList.remove('copied');
-                    }}, 2000);
-                }}).catch(function(err) {{
+                    }, 2000);
+                }).catch(function(err) {
                     console.error('Could not copy text: ', err);
                     alert('Failed to copy token. Please manually select and copy the token above.');
-                }});
-            }}
+                });
+            }
             
             // Auto-copy on page load (optional)
-            window.onload = function() {{
-                setTimeout(function() {{
+            window.onload = function() {
+                setTimeout(function() {
                     copyToken();
-                }}, 1000);
-            }};
+                }, 1000);
+            };
         </script>
     </body>
     </html>
-    """
+    """)
+
+def render_success_page(token, action):
+    """/success HTML for a custom token and 'login' or 'signup'"""
+    action_text = "Welcome back!" if action == "login" else "Welcome to Conni!"
+    action_description = "You've successfully logged in with UCL." if action == "login" else "Your UCL account has been created successfully."
+    
+    return SUCCESS_PAGE.render(action_title=action.title(), action_text=action_text,
+                               action_description=action_description, token=token, action=action)
+
+@app.route('/success')
+def success_page():
+    """Success page for OAuth callback"""
+    token = request.args.get('token')
+    action = request.args.get('action', 'login')  # 'login' or 'signup'
+    
+    if not token:
+        return jsonify({'error': 'No token provided'}), 400
+    
+    # The page embeds the custom token, so it must never be cached
+    return Response(render_success_page(token, action), mimetype='text/html', headers={'Cache-Control': 'no-store'})
 
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return jsonify(health_report())
+
+@app.route('/ready')
+def readiness_check():
+    """Readiness from the background dependency probes (no network calls)"""
+    report = dependency_prober.snapshot()
+    response = jsonify(report)
+    response.status_code = 200 if report['ready'] else 503
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def health_report():
+    """Status and component stats reported by /health"""
+    return {
         'status': 'healthy',
         'firebase_initialized': firebase_initialized,
         'ucl_client_id_set': bool(UCL_CLIENT_ID and UCL_CLIENT_ID != 'your_ucl_client_id'),
+        'ucl_api_connections': get_ucl_client().connection_stats(),
+        'ucl_api_breaker': get_ucl_client().breaker.stats() if get_ucl_client().breaker else {'enabled': False},
+        'ucl_api_hedging': get_ucl_client().hedge_stats(),
+        'callback_admission': dict(callback_limiter.stats(), single_flight=callback_flights.stats()),
+        'email_uid_cache': email_uid_cache.stats(),
+        'write_behind': write_behind.stats() if write_behind else {'enabled': False},
+        'traffic_recorder': traffic_recorder.stats() if traffic_recorder else {'enabled': False},
+        'login_analytics': login_analytics.stats() if login_analytics else {'enabled': False},
+        'startup': startup_report(),
         'timestamp': datetime.utcnow().isoformat()
-    })
+    }
+
+def admin_check(authorization):
+    """None if an Authorization header carries ADMIN_TOKEN, else (error, status)"""
+    if not ADMIN_TOKEN:
+        return 'Not found', 404
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return 'Unauthorized', 401
+    return None
+
+def admin_denied():
+    """Error response for a request to an /admin endpoint without ADMIN_TOKEN, else None"""
+    failure = admin_check(request.headers.get('Authorization'))
+    if failure:
+        message, status = failure
+        return jsonify({'error': message}), status, {'WWW-Authenticate': 'Bearer'} if status == 401 else {}
+    return None
+
+def profile_params(args):
+    """(seconds, rate, idle, format) from /admin/profile query args; raises ValueError"""
+    seconds = float(args.get('seconds', 10))
+    rate = args.get('rate')
+    rate = float(rate) if rate is not None else None
+    fmt = args.get('format', 'collapsed')
+    if seconds <= 0 or (rate is not None and not 0 < rate <= 1) or fmt not in PROFILE_FORMATS:
+        raise ValueError(f"seconds must be > 0, rate in (0, 1], format one of {', '.join(PROFILE_FORMATS)}")
+    return seconds, rate, args.get('idle', '1') not in ('0', 'false', 'no'), fmt
+
+@app.route('/admin/profile')
+def admin_profile():
+    """Sample this worker's stacks for ?seconds (all threads, or a ?rate share of requests)"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        seconds, rate, idle, fmt = profile_params(request.args)
+        session = profiler.profile(seconds, rate=rate, idle=idle)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    body, content_type, headers = session.render(fmt)
+    return Response(body, content_type=content_type, headers=headers)
+
+def analytics_window(args):
+    """Minutes covered by /admin/analytics (?minutes, default 60); raises ValueError"""
+    window = int(args.get('minutes', 60))
+    if not 1 <= window <= login_analytics.minutes:
+        raise ValueError(f"minutes must be between 1 and {login_analytics.minutes}")
+    return window
+
+@app.route('/admin/analytics')
+def admin_analytics():
+    """Login counts and unique users merged across workers (no Firestore reads)"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    if not login_analytics:
+        return jsonify({'error': 'Login analytics are disabled'}), 404
+    try:
+        window = analytics_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = jsonify(login_analytics.report(window))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics aggregated across gunicorn workers"""
+    return Response(render_metrics(), mimetype=METRICS_CONTENT_TYPE)
+
+INDEX_RESPONSE = PrecomputedResponse.json(app, {
+    'message': 'Conni UCL OAuth Backend',
+    'endpoints': {
+        'login': '/login/ucl',
+        'callback': '/callback',
+        'health': '/health',
+        'ready': '/ready'
+    }
+})
 
 @app.route('/')
 def index():
     """Root endpoint"""
-    return jsonify({
-        'message': 'Conni UCL OAuth Backend',
-        'endpoints': {
-            'login': '/login/ucl',
-            'callback': '/callback',
-            'health': '/health'
-        }
-    })
+    return INDEX_RESPONSE.serve()
+
+# ⚠️ IMPORTANT: Replace YOUR_TEAM_ID and com.mycompany.conni
+# Serialized once with Content-Type: application/json, as jsonify would
+APPLE_APP_SITE_ASSOCIATION = PrecomputedResponse.json(app, {
+    "applinks": {
+        "details": [
+            {
+                "appID": "5ZHL4H672X.com.mycompany.conni",
+                "paths": [ "/*" ]
+            }
+        ]
+    }
+}, max_age=3600)
 
 @app.route('/.well-known/apple-app-site-association')
 def apple_app_site_association():
     """Serves the Apple App Site Association file."""
-    # ⚠️ IMPORTANT: Replace YOUR_TEAM_ID and com.mycompany.conni
-    data = {
-        "applinks": {
-            "details": [
-                {
-                    "appID": "5ZHL4H672X.com.mycompany.conni",
-                    "paths": [ "/*" ]
-                }
-            ]
-        }
+    return APPLE_APP_SITE_ASSOCIATION.serve()
+
+# ⚠️ IMPORTANT: Replace com.mycompany.conni and YOUR_SHA256_FINGERPRINT
+ASSETLINKS = PrecomputedResponse.json(app, [
+  {
+    "relation": ["delegate_permission/common.handle_all_urls"],
+    "target": {
+      "namespace": "android_app",
+      "package_name": "com.mycompany.conni",
+      "sha256_cert_fingerprints": [
+        "94:C8:4A:3D:94:8F:60:2B:4C:18:FF:AD:8D:2C:82:6D:33:99:CF:59:2F:F0:44:E6:80:15:56:2B:82:B1:91:30",
+        "69:F3:2B:04:F5:C0:32:6B:4F:10:21:5E:8E:07:6A:A6:F0:92:9F:51:F1:50:0A:1F:3D:02:48:91:A8:C9:D7:8C",
+        "D4:59:DF:8F:3F:39:F0:0C:2C:B1:5E:A6:3E:29:32:78:59:3D:85:8E:47:FC:F2:A7:D7:CC:0C:06:40:90:88:B1"]
     }
-    # Flask's jsonify automatically sets Content-Type: application/json
-    return jsonify(data)
+  }
+], max_age=3600)
 
 @app.route('/.well-known/assetlinks.json')
 def assetlinks():
     """Serves the Android Asset Links file."""
-    # ⚠️ IMPORTANT: Replace com.mycompany.conni and YOUR_SHA256_FINGERPRINT
-    data = [
-      {
-        "relation": ["delegate_permission/common.handle_all_urls"],
-        "target": {
-          "namespace": "android_app",
-          "package_name": "com.mycompany.conni",
-          "sha256_cert_fingerprints": [
-            "94:C8:4A:3D:94:8F:60:2B:4C:18:FF:AD:8D:2C:82:6D:33:99:CF:59:2F:F0:44:E6:80:15:56:2B:82:B1:91:30",
-            "69:F3:2B:04:F5:C0:32:6B:4F:10:21:5E:8E:07:6A:A6:F0:92:9F:51:F1:50:0A:1F:3D:02:48:91:A8:C9:D7:8C",
-            "D4:59:DF:8F:3F:39:F0:0C:2C:B1:5E:A6:3E:29:32:78:59:3D:85:8E:47:FC:F2:A7:D7:CC:0C:06:40:90:88:B1"]
-        }
-      }
-    ]
-    return jsonify(data)
+    return ASSETLINKS.serve()
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,323 @@
+"""
+ASGI serving mode: the same routes on Starlette with non-blocking upstream calls
+
+A login is almost all network wait, so one event loop can hold many of
+them at once: the uclapi.com calls go through httpx on the loop, and the
+blocking Firebase Admin work (complete_login() from app.py) runs on a
+bounded thread pool. Configuration, Firebase setup, caches, the token
+signer, state signing and metrics are shared with the Flask app, which
+stays the default serving mode.
+
+    gunicorn -k uvicorn.workers.UvicornWorker asgi_app:app    # async
+    gunicorn app:app                                          # sync (default)
+"""
+
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
+from starlette.routing import Route
+
+import app as sync_app
+from admission import (CALLBACK_RETRY_AFTER, UNCACHED_OUTCOMES, AsyncConcurrencyLimiter, AsyncSingleFlight, Uncached,
+                       flight_key)
+from circuit_breaker import CircuitOpenError
+from log_setup import end_request_sampling, start_request_sampling
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, StageTimer, record_request, render_metrics
+from oauth_state import InvalidState
+from ucl_client import get_ucl_client
+
+logger = logging.getLogger(__name__)
+
+# Threads for the blocking Firebase Admin / Firestore calls (per worker)
+ASYNC_FIREBASE_THREADS = int(os.environ.get('ASYNC_FIREBASE_THREADS', 32))
+
+# Event-loop versions of the /callback admission control. They replace the
+# Flask app's instances so /health and /metrics report these.
+callback_flights = sync_app.callback_flights = AsyncSingleFlight()
+callback_limiter = sync_app.callback_limiter = AsyncConcurrencyLimiter()
+
+_firebase_executor = None
+
+
+async def run_blocking(fn, *args):
+    """Run a blocking call on the Firebase thread pool, in this request's context"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_firebase_executor, context.run, fn, *args)
+
+
+def timed(route, stages=False):
+    """Record request metrics and Server-Timing, as the Flask app's request hooks do"""
+    def decorator(handler):
+        async def endpoint(request):
+            # Log records are sampled per request, like the Flask hooks do
+            sampling = start_request_sampling()
+            try:
+                start = time.perf_counter()
+                timer = StageTimer() if stages else None
+                response = await (handler(request, timer) if stages else handler(request))
+                duration = time.perf_counter() - start
+                record_request(route, response.status_code, duration, timer)
+                if sync_app.traffic_recorder:
+                    sync_app.traffic_recorder.record(route, response.status_code, duration, timer)
+                if timer is not None:
+                    response.headers['Server-Timing'] = timer.server_timing(total=duration)
+                else:
+                    response.headers['Server-Timing'] = f"total;dur={duration * 1000:.1f}"
+                return response
+            finally:
+                end_request_sampling(sampling)
+        return endpoint
+    return decorator
+
+
+def error(message, status):
+    return JSONResponse({'error': message}, status_code=status)
+
+
+def redirect(url):
+    return RedirectResponse(url, status_code=302)
+
+
+@timed('/login/ucl')
+async def login_ucl(request):
+    """Initiate UCL OAuth flow"""
+    try:
+        return redirect(sync_app.ucl_authorise_url())
+    except Exception as e:
+        return error(f'Failed to initiate UCL login: {str(e)}', 500)
+
+
+@timed('/callback', stages=True)
+async def callback(request, timer):
+    """Handle UCL OAuth callback"""
+    code = request.query_params.get('code')
+    if not code:
+        return await handle_callback(request, timer)
+
+    (body, status, headers, outcome), shared = await callback_flights.do(
+        flight_key(code, request.query_params.get('state')), lambda: admit_callback(request, timer))
+    if shared:
+        timer.outcome = outcome if outcome in UNCACHED_OUTCOMES else 'coalesced'
+        logger.info("Reused result of an in-flight callback for the same code")
+    response = Response(body, status_code=status)
+    response.raw_headers = list(headers)
+    return response
+
+
+async def admit_callback(request, timer):
+    """Run the callback under the concurrency limit; returns a shareable (body, status, headers, outcome)"""
+    with timer.stage('admission_wait'):
+        shed_reason = await callback_limiter.acquire()
+    if shed_reason:
+        logger.warning("Shedding /callback request", extra={'reason': shed_reason})
+        timer.outcome = 'shed'
+        response = error('Server busy, please retry shortly', 503)
+        response.headers['Retry-After'] = str(CALLBACK_RETRY_AFTER)
+    else:
+        try:
+            response = await handle_callback(request, timer)
+        finally:
+            callback_limiter.release()
+    result = response.body, response.status_code, list(response.raw_headers), timer.outcome
+    if timer.outcome in UNCACHED_OUTCOMES:
+        # Nothing was spent on the code: a retry after Retry-After must run again
+        raise Uncached(result)
+    return result
+
+
+async def handle_callback(request, timer):
+    params = request.query_params
+    try:
+        try:
+            sync_app.state_signer.verify(params.get('state'))
+        except InvalidState as e:
+            logger.warning("Rejected OAuth state", extra={'reason': e.reason})
+            timer.outcome = 'invalid_state'
+            return error('Invalid state parameter', 400)
+
+        if params.get('result') != 'allowed':
+            timer.outcome = 'access_denied'
+            return error('Access denied by user', 403)
+
+        code = params.get('code')
+        if not code:
+            timer.outcome = 'missing_code'
+            return error('Authorization code not provided', 400)
+
+        ucl_client = get_ucl_client()
+
+        with timer.stage('token_exchange'):
+            token_response = await ucl_client.exchange_code_async(code, sync_app.UCL_CLIENT_ID,
+                                                                  sync_app.UCL_CLIENT_SECRET)
+        if token_response.status_code != 200:
+            logger.error("Token exchange failed", extra={'status': token_response.status_code,
+                                                         'body': token_response.text[:500]})
+            timer.outcome = 'token_exchange_failed'
+            return error(f'Failed to exchange code for token: {token_response.status_code}', 400)
+
+        token_data = token_response.json()
+        access_token = token_data.get('token')
+        if not access_token:
+            timer.outcome = 'no_access_token'
+            return error('No access token received', 400)
+
+        with timer.stage('user_data'):
+            user_response = await ucl_client.get_user_data_async(access_token, sync_app.UCL_CLIENT_SECRET)
+        if user_response.status_code != 200:
+            logger.error("Failed to get user data from UCL", extra={'status': user_response.status_code,
+                                                                    'body': user_response.text[:500]})
+            timer.outcome = 'user_data_failed'
+            return error(f'Failed to get user data from UCL: {user_response.status_code}', 400)
+
+        user_data = sync_app.ucl_user_fields(user_response.json())
+        logger.info("Retrieved UCL user data", extra={'email': user_data['email'], 'scope': token_data.get('scope')})
+        if not user_data['email']:
+            logger.error("No email received from UCL API")
+            timer.outcome = 'no_email'
+            return error('No email received from UCL API', 400)
+
+        redirect_url, failure = await run_blocking(sync_app.complete_login, user_data, token_data, timer)
+        if failure:
+            return error(failure, 500)
+        return redirect(redirect_url)
+
+    except CircuitOpenError as e:
+        logger.warning("UCL API circuit open, skipping login", extra={'retry_after': round(e.retry_after)})
+        timer.outcome = 'upstream_unavailable'
+        return redirect("conni://ucl-callback?" + urlencode({
+            'error': 'UCL login is temporarily unavailable. Please try again shortly.',
+            'retry_after': int(e.retry_after)
+        }))
+    except httpx.HTTPError as e:
+        logger.error("Network error calling UCL API", extra={'error': str(e)})
+        timer.outcome = 'network_error'
+        return error(f'Network error: {str(e)}', 500)
+    except Exception as e:
+        timer.outcome = 'unexpected_error'
+        return error(f'Unexpected error: {str(e)}', 500)
+
+
+@timed('/success')
+async def success_page(request):
+    """Success page for OAuth callback"""
+    token = request.query_params.get('token')
+    action = request.query_params.get('action', 'login')
+    if not token:
+        return error('No token provided', 400)
+    # The page embeds the custom token, so it must never be cached
+    return HTMLResponse(sync_app.render_success_page(token, action), headers={'Cache-Control': 'no-store'})
+
+
+@timed('/health')
+async def health_check(request):
+    """Health check endpoint"""
+    return JSONResponse(sync_app.health_report())
+
+
+@timed('/ready')
+async def readiness_check(request):
+    """Readiness from the background dependency probes (no network calls)"""
+    report = sync_app.dependency_prober.snapshot()
+    return JSONResponse(report, status_code=200 if report['ready'] else 503, headers={'Cache-Control': 'no-store'})
+
+
+@timed('/metrics')
+async def metrics_endpoint(request):
+    """Prometheus metrics aggregated across workers"""
+    # Reads the other workers' snapshot files, so keep it off the loop
+    return Response(await asyncio.to_thread(render_metrics), media_type=METRICS_CONTENT_TYPE)
+
+
+def admin_denied(request):
+    """Error response for a request to an /admin endpoint without ADMIN_TOKEN, else None"""
+    failure = sync_app.admin_check(request.headers.get('authorization'))
+    if failure:
+        message, status = failure
+        return JSONResponse({'error': message}, status_code=status,
+                            headers={'WWW-Authenticate': 'Bearer'} if status == 401 else None)
+    return None
+
+
+async def admin_profile(request):
+    """Sample this worker's stacks for ?seconds across all threads"""
+    denied = admin_denied(request)
+    if denied:
+        return denied
+    try:
+        seconds, rate, idle, fmt = sync_app.profile_params(request.query_params)
+        if rate is not None:
+            # Requests share the event loop thread, so samples can't be tied to one of them
+            raise ValueError('rate is not supported in async mode; profile all threads instead')
+        session = await asyncio.to_thread(sync_app.profiler.profile, seconds, idle=idle)
+    except ValueError as e:
+        return error(str(e), 400)
+    except RuntimeError as e:
+        return error(str(e), 409)
+    body, content_type, headers = session.render(fmt)
+    return Response(body, media_type=content_type, headers=headers)
+
+
+async def admin_analytics(request):
+    """Login counts and unique users merged across workers (no Firestore reads)"""
+    denied = admin_denied(request)
+    if denied:
+        return denied
+    analytics = sync_app.login_analytics
+    if not analytics:
+        return error('Login analytics are disabled', 404)
+    try:
+        window = sync_app.analytics_window(request.query_params)
+    except ValueError as e:
+        return error(str(e), 400)
+    # Reads and merges the other workers' files, so keep it off the loop
+    return JSONResponse(await asyncio.to_thread(analytics.report, window), headers={'Cache-Control': 'no-store'})
+
+
+def precomputed(route, prebuilt):
+    """Endpoint serving a PrecomputedResponse"""
+    @timed(route)
+    async def endpoint(request):
+        status, body, headers = prebuilt.negotiate(request.headers.get('accept-encoding'),
+                                                   request.headers.get('if-none-match'))
+        if status == 304:
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type=prebuilt.mimetype, headers=headers)
+    return endpoint
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Runs in each worker after fork
+    global _firebase_executor
+    _firebase_executor = ThreadPoolExecutor(max_workers=ASYNC_FIREBASE_THREADS, thread_name_prefix='firebase')
+    sync_app.dependency_prober.ensure_running()
+    try:
+        yield
+    finally:
+        await get_ucl_client().aclose()
+        _firebase_executor.shutdown(wait=False)
+
+
+app = Starlette(routes=[
+    Route('/', precomputed('/', sync_app.INDEX_RESPONSE)),
+    Route('/login/ucl', login_ucl),
+    Route('/callback', callback),
+    Route('/success', success_page),
+    Route('/health', health_check),
+    Route('/ready', readiness_check),
+    Route('/metrics', metrics_endpoint),
+    Route('/admin/profile', admin_profile),
+    Route('/admin/analytics', admin_analytics),
+    Route('/.well-known/apple-app-site-association',
+          precomputed('/.well-known/apple-app-site-association', sync_app.APPLE_APP_SITE_ASSOCIATION)),
+    Route('/.well-known/assetlinks.json', precomputed('/.well-known/assetlinks.json', sync_app.ASSETLINKS)),
+], lifespan=lifespan)
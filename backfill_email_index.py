@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""
+Backfill the users_by_email index for existing Firestore users
+Run this once after deploying the email index so every login resolves
+with a single document get. Shortcut for `python admin.py backfill-email-index`
+
+Usage: python backfill_email_index.py [--dry-run] [--resume]
+"""
+
+import sys
+
+from admin import main
+
+if __name__ == "__main__":
+    sys.exit(main(['backfill-email-index'] + sys.argv[1:]))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+admin.py bulk transforms over a large synthetic users collection
+
+Seeds the in-memory Firestore with --users synthetic users (a share of
+them missing isOnboarded, with unnormalized emails, with incomplete
+ucl_data, unindexed, or without a Firebase Auth account) and times:
+
+  throughput    backfill-onboarded with 1 commit thread vs. --workers
+  rate limit    backfill-email-index under --rate stays at or below the limit
+
+What each transform changes, dry runs and --resume are covered by
+tests/test_admin.py, which uses seed() and run() from here.
+
+Usage: python -m benchmarks.bench_admin [--users 100000] [--workers 8]
+       [--rate 5000] [--firestore-latency-ms 20] [--write-latency-ms 0.5]
+       [--output results.json]
+"""
+
+import argparse
+import logging
+import random
+import sys
+import uuid
+
+import admin
+from bulk_update import BulkRun
+from benchmarks.common import check, save_results
+from benchmarks.fakes import FakeAuth, FakeFirestore
+from user_store import EMAIL_INDEX_COLLECTION, USERS_COLLECTION, email_index_key, index_entry
+
+SHARES = {'not_onboarded': 0.3, 'unnormalized': 0.1, 'partial_ucl_data': 0.2, 'unindexed': 0.5, 'orphan': 0.02}
+
+
+def seed(count, latency_ms, write_latency_ms, rng):
+    """Fresh fake Firestore/Auth holding `count` synthetic users; returns (db, auth, expected)"""
+    db = FakeFirestore(latency_ms=latency_ms, jitter=0.2, write_latency_ms=write_latency_ms)
+    auth = FakeAuth(latency_ms=latency_ms, jitter=0.2)
+    users, index = db.docs(USERS_COLLECTION), db.docs(EMAIL_INDEX_COLLECTION)
+    expected = dict.fromkeys(SHARES, 0)
+    for i in range(count):
+        uid = uuid.UUID(int=rng.getrandbits(128)).hex[:28]
+        email = f"student{i}@ucl.ac.uk"
+        doc = {
+            'email': email,
+            'display_name': f"Student {i}",
+            'auth_method': 'ucl_oauth',
+            'isOnboarded': True,
+            'ucl_data': dict(admin.UCL_DATA_DEFAULTS, department='Computer Science')
+        }
+        flags = {name for name, share in SHARES.items() if rng.random() < share}
+        if 'not_onboarded' in flags:
+            del doc['isOnboarded']
+        if 'unnormalized' in flags:
+            doc['email'] = f" Student{i}@UCL.ac.uk"
+        if 'partial_ucl_data' in flags:
+            del doc['ucl_data']['token_scope'], doc['ucl_data']['auth_method']
+        if 'unindexed' not in flags:
+            index[email_index_key(email)] = index_entry(email, uid)
+        if 'orphan' not in flags:
+            auth.add_user(email, uid=uid)
+        users[uid] = doc
+        for name in flags:
+            expected[name] += 1
+    return db, auth, expected
+
+
+def run(db, auth, name, start_after=None, **kwargs):
+    transform = admin.TRANSFORMS[name](db, auth)
+    report = BulkRun(db, name, transform, **kwargs).run(start_after=start_after)
+    report['stats'] = getattr(transform, 'stats', None)
+    return report
+
+
+def line(report):
+    return (f"{report['scanned']} scanned, {report['committed']} writes in {report['elapsed_s']} s: "
+            f"{report['docs_per_sec']} docs/s, {report['writes_per_sec']} writes/s, "
+            f"commit p50 {report['commit_p50_ms']} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=5000, help='writes/sec for the rate-limit scenario')
+    parser.add_argument('--firestore-latency-ms', type=float, default=20.0)
+    parser.add_argument('--write-latency-ms', type=float, default=0.5, help='added per write in a batch commit')
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    failures = []
+    results = {}
+
+    def fresh():
+        return seed(args.users, args.firestore_latency_ms, args.write_latency_ms, random.Random(42))
+
+    print(f"🌱 {args.users} synthetic users, {args.firestore_latency_ms:.0f} ms per Firestore call "
+          f"+ {args.write_latency_ms} ms per batched write")
+    db, auth, expected = fresh()
+    print(f"   {expected}")
+
+    print("🚚 throughput: backfill-onboarded, no rate limit")
+    results['throughput'] = {}
+    for workers in (1, args.workers):
+        db, auth, _ = fresh()
+        report = run(db, auth, 'backfill-onboarded', workers=workers, writes_per_sec=0)
+        results['throughput'][workers] = report
+        print(f"   {workers} worker(s): {line(report)}")
+        missing = sum('isOnboarded' not in doc for doc in db.docs(USERS_COLLECTION).values())
+        check(failures, missing == 0 and report['committed'] == expected['not_onboarded'],
+              f"every document has isOnboarded ({missing} missing)")
+    one, many = results['throughput'][1], results['throughput'][args.workers]
+    check(failures, many['docs_per_sec'] > one['docs_per_sec'] * 2,
+          f"{args.workers} workers are {many['docs_per_sec'] / one['docs_per_sec']:.1f}x faster than 1")
+
+    print(f"🐌 rate limit: backfill-email-index, {args.workers} workers")
+    results['rate_limit'] = {}
+    for rate in (0, args.rate):
+        db, auth, _ = fresh()
+        report = results['rate_limit'][rate] = run(db, auth, 'backfill-email-index', workers=args.workers,
+                                                   writes_per_sec=rate)
+        print(f"   {f'{rate:g} writes/s' if rate else 'unlimited'}: {line(report)}")
+    limited = results['rate_limit'][args.rate]['writes_per_sec']
+    check(failures, limited <= args.rate * 1.05, f"{limited} writes/s within the {args.rate:g} limit")
+
+    if args.output:
+        save_results(args.output, 'admin', results)
+    if failures:
+        print(f"❌ {len(failures)} check(s) failed")
+        sys.exit(1)
+    print("✅ all checks passed")
+
+
+if __name__ == "__main__":
+    main()
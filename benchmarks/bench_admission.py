@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+/callback admission control: duplicate-request coalescing and load shedding
+
+  duplicates  every login's /callback is sent several times at once (browser
+              retries, double taps); all copies should get the same redirect
+              while uclapi.com sees one token exchange per login
+  storm       more concurrent logins than the limiter admits plus its queue,
+              against a slow upstream; the overflow should get a fast 503
+              with Retry-After instead of waiting for a worker
+  reuse       a finished login's code sent again with a missing or forged
+              state must not get its redirect; a shed callback retried
+              after Retry-After must run again, not get the 503 back
+
+Exits non-zero if a check fails.
+
+Usage: python -m benchmarks.bench_admission [--logins 50] [--duplicates 3]
+       [--storm 64] [--output results.json]
+"""
+
+import argparse
+import logging
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.common import check, save_results, summarize
+from benchmarks.fakes import FakeAuth, FakeFirestore, FakeUCLServer, install_fakes, make_code, make_signer
+
+
+def start_login(flask_app):
+    response = flask_app.test_client().get('/login/ucl')
+    return parse_qs(urlparse(response.location).query)['state'][0]
+
+
+def fire(flask_app, requests_to_send):
+    """Send all (code, state) callbacks at once; returns [(status, location, retry_after, seconds)]"""
+    results = [None] * len(requests_to_send)
+    barrier = threading.Barrier(len(requests_to_send))
+
+    def worker(i, code, state):
+        client = flask_app.test_client()
+        barrier.wait()
+        start = time.perf_counter()
+        response = client.get('/callback', query_string={'result': 'allowed', 'code': code, 'state': state})
+        results[i] = (response.status_code, response.location or '', response.headers.get('Retry-After'),
+                      time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(i, code, state))
+               for i, (code, state) in enumerate(requests_to_send)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def duplicates(app_module, args, signer, failures):
+    print(f"👯 duplicates: {args.logins} logins, each /callback sent {args.duplicates}x at once")
+    from admission import ConcurrencyLimiter, SingleFlight
+    with FakeUCLServer(latency_ms=50) as ucl:
+        install_fakes(app_module, ucl.url, FakeFirestore(), FakeAuth(signer=signer), signer)
+        app_module.callback_flights = SingleFlight()
+        app_module.callback_limiter = ConcurrencyLimiter(max_concurrent=64, max_queue=64)
+        identical = 0
+        statuses = {}
+        for i in range(args.logins):
+            code, state = make_code(f"dup{i}"), start_login(app_module.app)
+            results = fire(app_module.app, [(code, state)] * args.duplicates)
+            for status, location, _, _ in results:
+                key = location.split('?', 1)[0] if status == 302 else str(status)
+                statuses[key] = statuses.get(key, 0) + 1
+            identical += len({location for _, location, _, _ in results}) == 1
+        print(f"  {statuses}, {ucl.requests['token']} token exchanges, {app_module.callback_flights.stats()}")
+        check(failures, statuses == {'conni://success': args.logins * args.duplicates},
+              "every duplicate got the success redirect")
+        check(failures, identical == args.logins, "duplicates of one login got the same redirect")
+        check(failures, ucl.requests['token'] == args.logins, "one token exchange per login")
+        return {'statuses': statuses, 'token_exchanges': ucl.requests['token'],
+                'single_flight': app_module.callback_flights.stats()}
+
+
+def storm(app_module, args, signer, failures):
+    max_concurrent, max_queue = 8, 8
+    print(f"🌩  storm: {args.storm} logins at once, limit {max_concurrent} running + {max_queue} queued,"
+          f" 300 ms upstream")
+    from admission import ConcurrencyLimiter, SingleFlight
+    with FakeUCLServer(latency_ms=300) as ucl:
+        install_fakes(app_module, ucl.url, FakeFirestore(), FakeAuth(signer=signer), signer)
+        app_module.callback_flights = SingleFlight()
+        app_module.callback_limiter = ConcurrencyLimiter(max_concurrent=max_concurrent, max_queue=max_queue,
+                                                         timeout=5)
+        results = fire(app_module.app, [(make_code(f"storm{i}"), start_login(app_module.app))
+                                        for i in range(args.storm)])
+        shed = [r for r in results if r[0] == 503]
+        ok = [r for r in results if r[0] == 302 and r[1].startswith('conni://success')]
+        shed_summary = summarize([r[3] for r in shed], 1.0)
+        ok_summary = summarize([r[3] for r in ok], 1.0)
+        print(f"  {len(ok)} succeeded (p50 {ok_summary['p50_ms']} ms), {len(shed)} shed"
+              f" (p99 {shed_summary['p99_ms']} ms), limiter {app_module.callback_limiter.stats()['shed']}")
+        check(failures, len(ok) == max_concurrent + max_queue, "running + queued logins succeeded")
+        check(failures, len(shed) == args.storm - max_concurrent - max_queue, "the rest were shed")
+        check(failures, all(r[2] for r in shed), "shed responses carry Retry-After")
+        check(failures, shed_summary['p99_ms'] < 100, "shed responses are fast")
+        return {'succeeded': ok_summary, 'shed': shed_summary, 'limiter': app_module.callback_limiter.stats()}
+
+
+def reuse(app_module, args, signer, failures):
+    print("🔁 reuse: a replayed callback, the same code with another state, and a retried shed callback")
+    from admission import ConcurrencyLimiter, SingleFlight
+    with FakeUCLServer(latency_ms=0) as ucl:
+        install_fakes(app_module, ucl.url, FakeFirestore(), FakeAuth(signer=signer), signer)
+        app_module.callback_flights = SingleFlight()
+        app_module.callback_limiter = ConcurrencyLimiter(max_concurrent=8, max_queue=8)
+        client = app_module.app.test_client()
+        query = {'result': 'allowed', 'code': make_code('replayed'), 'state': start_login(app_module.app)}
+        first = client.get('/callback', query_string=query)
+        again = client.get('/callback', query_string=query)
+        check(failures, first.location.startswith('conni://success')
+              and not (again.location or '').startswith('conni://success'),
+              f"the same code and state after the first finished: {again.status_code}, not its redirect")
+
+        app_module.callback_flights = SingleFlight(linger=60)
+        code, state = make_code('reuse'), start_login(app_module.app)
+        first = client.get('/callback', query_string={'result': 'allowed', 'code': code, 'state': state})
+        check(failures, first.status_code == 302 and first.location.startswith('conni://success'), "first login")
+        for label, query in (('missing state', {}), ('forged state', {'state': 'forged'}),
+                             ('another valid state', {'state': start_login(app_module.app)})):
+            response = client.get('/callback', query_string=dict(query, result='allowed', code=code))
+            check(failures, not (response.location or '').startswith('conni://success'),
+                  f"{label}: {response.status_code}, not the first login's redirect")
+
+        app_module.callback_limiter = ConcurrencyLimiter(max_concurrent=0, max_queue=0)
+        query = {'result': 'allowed', 'code': make_code('reuse-shed'), 'state': start_login(app_module.app)}
+        shed = client.get('/callback', query_string=query).status_code
+        app_module.callback_limiter = ConcurrencyLimiter(max_concurrent=8, max_queue=8)
+        retried = client.get('/callback', query_string=query)
+        check(failures, shed == 503 and retried.status_code == 302, f"shed {shed}, retry {retried.status_code}")
+        return {'single_flight': app_module.callback_flights.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--duplicates', type=int, default=3)
+    parser.add_argument('--storm', type=int, default=64)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    import app as app_module
+    logging.getLogger().setLevel(logging.ERROR)
+    signer = make_signer()
+
+    failures = []
+    results = {
+        'duplicates': duplicates(app_module, args, signer, failures),
+        'storm': storm(app_module, args, signer, failures),
+        'reuse': reuse(app_module, args, signer, failures)
+    }
+    if args.output:
+        save_results(args.output, 'admission', results)
+    if failures:
+        print(f"❌ {len(failures)} check(s) failed")
+        sys.exit(1)
+    print("✅ all checks passed")
+
+
+if __name__ == "__main__":
+    main()
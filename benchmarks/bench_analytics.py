@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Login analytics: sketch accuracy, per-login cost, memory bound and worker merge
+
+Checks that:
+
+  - HyperLogLog unique counts stay within 3 standard errors from 100 to
+    1M distinct users
+  - record() costs microseconds per login
+  - a worker's sketches stay within the documented bound however many
+    minutes, days and departments it sees
+  - --workers forked processes with overlapping users merge into exact
+    login counts and the approximate size of the union, also after the
+    workers have exited
+  - /admin/analytics behind the app (local fakes) reports the logins it
+    served, by new/returning, is_student and department, with no
+    Firestore reads and only with ADMIN_TOKEN
+
+Usage: python -m benchmarks.bench_analytics [--workers 4] [--logins 50000]
+       [--output results.json]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.common import check, save_results
+from benchmarks.fakes import FakeAuth, FakeFirestore, FakeUCLServer, install_fakes, make_code, make_signer
+from login_analytics import ANALYTICS_HLL_PRECISION, HyperLogLog, LoginAnalytics
+
+TOKEN = 'bench-admin-token'
+DEPARTMENTS = [f"Department {i}" for i in range(40)]
+
+
+def worker(directory, index, logins, now):
+    """One 'gunicorn worker': logins by users index*logins/2 .. index*logins/2 + logins"""
+    analytics = LoginAnalytics(directory=directory, interval=3600)
+    start = index * logins // 2
+    for i in range(start, start + logins):
+        analytics.record(f"user{i}", DEPARTMENTS[i % len(DEPARTMENTS)], i % 10 != 0, i % 3 == 0, now=now)
+    analytics.write()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--logins', type=int, default=50000, help='logins per worker')
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    failures = []
+    results = {}
+    error = 1.04 / (1 << ANALYTICS_HLL_PRECISION) ** 0.5
+
+    print(f"🎲 HyperLogLog, {1 << ANALYTICS_HLL_PRECISION} registers (standard error {error:.1%})")
+    results['accuracy'] = {}
+    for n in (100, 1000, 10000, 100000, 1000000):
+        sketch = HyperLogLog(ANALYTICS_HLL_PRECISION)
+        for i in range(n):
+            sketch.add(f"upi{i}")
+        estimate = sketch.count()
+        results['accuracy'][n] = estimate
+        check(failures, abs(estimate - n) <= 3 * error * n, f"{n} distinct -> {estimate} ({estimate / n - 1:+.1%})")
+
+    print(f"⏱  record(), {args.logins} logins")
+    with tempfile.TemporaryDirectory() as tmp:
+        analytics = LoginAnalytics(directory=tmp, interval=3600)
+        now = time.time()
+        start = time.perf_counter()
+        for i in range(args.logins):
+            analytics.record(f"user{i % 20000}", DEPARTMENTS[i % len(DEPARTMENTS)], i % 10 != 0, i % 3 == 0,
+                             now=now + i * 3600 / args.logins)
+        per_login = (time.perf_counter() - start) / args.logins * 1e6
+        results['record_us'] = round(per_login, 2)
+        check(failures, per_login < 20, f"{per_login:.1f} µs per login")
+        start = time.perf_counter()
+        snapshot = analytics.write()
+        results['write_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        print(f"   snapshot of {len(snapshot['minutes'])} minutes and {len(snapshot['days'])} days written "
+              f"in {results['write_ms']} ms")
+
+    print("📦 memory bound: 10 days of logins across 300 departments")
+    with tempfile.TemporaryDirectory() as tmp:
+        analytics = LoginAnalytics(directory=tmp, interval=3600)
+        now = time.time() - 10 * 86400
+        for i in range(10 * 24 * 60):
+            for j in range(3):
+                analytics.record(f"user{i}-{j}", f"Department {(i * 3 + j) % 300}", j != 0, j == 1, now=now + i * 60)
+        stats = results['memory'] = analytics.stats()
+        bound = 3 * analytics.minutes + analytics.days * (analytics.max_departments + 4)
+        print(f"   {stats}")
+        check(failures, stats['sketches'] <= bound and stats['day_buckets'] == analytics.days
+              and stats['minute_buckets'] == analytics.minutes,
+              f"{stats['sketches']} sketches ({stats['sketch_bytes'] // 1024} KiB), bound {bound}")
+        check(failures, stats['departments'] == analytics.max_departments, "departments capped")
+
+    print(f"🧩 {args.workers} worker processes, {args.logins} logins each")
+    with tempfile.TemporaryDirectory() as tmp:
+        now = time.time()
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=worker, args=(tmp, index, args.logins, now))
+                     for index in range(args.workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        analytics = LoginAnalytics(directory=tmp)
+        start = time.perf_counter()
+        report = analytics.report(now=now)
+        results['report_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        window = report['window']
+        union = (args.workers + 1) * args.logins // 2
+        logins = args.workers * args.logins
+        print(f"   report merged {report['workers'] - 1} exited workers in {results['report_ms']} ms: "
+              f"{window['logins']} logins, ~{window['unique_users']} unique (union {union})")
+        check(failures, window['logins'] == logins, f"logins summed exactly ({logins})")
+        check(failures, abs(window['unique_users'] - union) <= 3 * error * union, "unique users merged as a union")
+        today = report['days'][0]
+        check(failures, sum(d['logins'] for d in today['by_department'].values()) == logins
+              and sum(d['logins'] for d in today['by_is_student'].values()) == logins,
+              f"day breakdown: {len(today['by_department'])} departments, is_student {sorted(today['by_is_student'])}")
+        results['merge'] = window
+
+    print("🌐 /admin/analytics behind the app")
+    import app as app_module
+    signer = make_signer()
+    db = FakeFirestore(latency_ms=0)
+    with FakeUCLServer(latency_ms=0) as ucl, tempfile.TemporaryDirectory() as tmp:
+        install_fakes(app_module, ucl.url, db, FakeAuth(signer=signer), signer)
+        app_module.login_analytics = LoginAnalytics(directory=tmp)
+        client = app_module.app.test_client()
+        users = [f"analytics{i}" for i in range(150)] + [f"analytics{i}" for i in range(50)]
+        for user in users:
+            state = parse_qs(urlparse(client.get('/login/ucl').location).query)['state'][0]
+            client.get('/callback', query_string={'result': 'allowed', 'code': make_code(user), 'state': state})
+
+        app_module.ADMIN_TOKEN = TOKEN
+        status = client.get('/admin/analytics').status_code
+        check(failures, status == 401, f"needs the admin token ({status})")
+        reads = dict(db.counts)
+        response = client.get('/admin/analytics', query_string={'minutes': 5},
+                              headers={'Authorization': f'Bearer {TOKEN}'})
+        report = response.get_json()
+        window = report['window']
+        print(f"   {window}")
+        check(failures, db.counts == reads, "no Firestore calls")
+        check(failures, (window['logins'], window['new'], window['returning']) == (200, 150, 50),
+              "200 logins: 150 new, 50 returning")
+        check(failures, abs(window['unique_users'] - 150) <= 3, f"~{window['unique_users']} unique users (150)")
+        today = report['days'][0]
+        check(failures, sum(d['logins'] for d in today['by_department'].values()) == 200,
+              f"{len(today['by_department'])} departments")
+        results['app'] = report
+
+    if args.output:
+        save_results(args.output, 'analytics', results)
+    if failures:
+        print(f"❌ {len(failures)} check(s) failed")
+        sys.exit(1)
+    print("✅ all checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+uclapi.com latency tail: login latency with hedged user-data requests off and on
+
+Drives the real /login/ucl -> /callback flow against the local fake
+uclapi.com while 5% of user-data GETs take an extra 800 ms, and exits
+non-zero if hedging does not lower p99 login latency. The breaker's
+behaviour under errors and slow calls is covered by tests/test_breaker.py;
+run_logins() and use_client() here are shared with it.
+
+Usage: python -m benchmarks.bench_breaker [--logins 200] [--concurrency 8]
+       [--output results.json]
+"""
+
+import argparse
+import logging
+import sys
+import threading
+import time
+
+from benchmarks.bench_login import login
+from benchmarks.common import check, save_results, summarize
+from benchmarks.fakes import FakeAuth, FakeFirestore, FakeUCLServer, install_fakes, make_code, make_signer
+
+
+def use_client(app_module, ucl, **kwargs):
+    """Swap in a UCL client for the fake with scenario-specific breaker/hedge settings"""
+    import ucl_client
+    from circuit_breaker import CircuitBreaker
+    from ucl_client import UCLAPIClient
+
+    breaker = CircuitBreaker('uclapi', slow_call_duration=kwargs.pop('slow_call_duration', 5.0),
+                             window_size=10, minimum_calls=5, open_duration=1.0, half_open_calls=2)
+    ucl_client._client = UCLAPIClient(base_url=ucl.url, max_retries=0, breaker=breaker, **kwargs)
+    return ucl_client._client
+
+
+def run_logins(flask_app, count, concurrency, prefix):
+    """count logins spread over `concurrency` clients; returns outcomes and latencies"""
+    outcomes = {}
+    latencies = []
+    lock = threading.Lock()
+    remaining = [count]
+
+    def worker(n):
+        client = flask_app.test_client()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                i = remaining[0]
+            start = time.perf_counter()
+            status, location = login(client, make_code(f"{prefix}{n}x{i}"))
+            elapsed = time.perf_counter() - start
+            key = location.split('?', 1)[0] if status == 302 else str(status)
+            with lock:
+                outcomes[key] = outcomes.get(key, 0) + 1
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = summarize(latencies, time.perf_counter() - start)
+    result['outcomes'] = outcomes
+    return result
+
+
+def hedging(app_module, args, failures):
+    print("🎯 hedging: 5% of user-data calls take an extra 800 ms")
+    results = {}
+    for enabled in (False, True):
+        with FakeUCLServer(latency_ms=20, jitter=0.2, slow_rate=0.05, slow_ms=800,
+                           slow_endpoints=('user_data',)) as ucl:
+            install_fakes(app_module, ucl.url, FakeFirestore(), FakeAuth(signer=args.signer), args.signer)
+            client = use_client(app_module, ucl, hedge_enabled=enabled, hedge_max_delay=0.2)
+            # Warm up the latency window the hedge delay comes from
+            run_logins(app_module.app, 40, args.concurrency, 'warmup')
+            result = run_logins(app_module.app, args.logins * 2, args.concurrency, f"hedge{enabled}")
+            result['hedges'] = client.hedge_stats()
+            result['user_data_requests'] = ucl.requests['user_data']
+            results['on' if enabled else 'off'] = result
+            print(f"  hedging {'on ' if enabled else 'off'}: p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms,"
+                  f" max {result['max_ms']} ms, hedges {result['hedges']}")
+    check(failures, results['on']['p99_ms'] < results['off']['p99_ms'], "hedging lowers p99 login latency")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    import app as app_module
+    logging.getLogger().setLevel(logging.ERROR)
+    args.signer = make_signer()
+
+    failures = []
+    results = {'hedging': hedging(app_module, args, failures)}
+    if args.output:
+        save_results(args.output, 'breaker', results)
+    if failures:
+        print(f"❌ {len(failures)} check(s) failed")
+        sys.exit(1)
+    print("✅ all checks passed")
+
+
+if __name__ == "__main__":
+    main()
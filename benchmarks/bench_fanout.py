@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+/callback identity lookups: sequential vs. concurrent fan-out
+
+Runs the login flow against the local fakes with Google round trips of
+--google-latency-ms, once with LOOKUP_FANOUT_ENABLED off (index read, then
+Auth lookup, then minting, one after the other) and once with it on (index
+read and Auth lookup together, minting alongside the Firestore write).
+First-time logins should drop by about one Google round trip. Returning
+users are measured with a cold email -> UID cache, the case that reaches
+the index read.
+
+Usage: python -m benchmarks.bench_fanout [--logins 100] [--concurrency 4]
+       [--google-latency-ms 100] [--output results.json]
+"""
+
+import argparse
+import logging
+
+from benchmarks.bench_login import run_level
+from benchmarks.common import save_results
+from benchmarks.fakes import FakeAuth, FakeFirestore, FakeUCLServer, install_fakes, make_signer, seed_user
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--google-latency-ms', type=float, default=100.0)
+    parser.add_argument('--ucl-latency-ms', type=float, default=20.0)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    import app as app_module
+    import lookup_pool
+    logging.getLogger().setLevel(logging.WARNING)
+
+    signer = make_signer()
+    results = {}
+    print(f"{'mode':<12}{'scenario':<11}{'p50 ms':>10}{'p95 ms':>10}{'req/s':>9}  errors")
+    with FakeUCLServer(latency_ms=args.ucl_latency_ms) as ucl:
+        for mode, enabled in (('sequential', False), ('concurrent', True)):
+            lookup_pool.LOOKUP_FANOUT_ENABLED = enabled
+            db = FakeFirestore(latency_ms=args.google_latency_ms)
+            auth = FakeAuth(latency_ms=args.google_latency_ms, signer=signer)
+            install_fakes(app_module, ucl.url, db, auth, signer)
+            returning = [f"ret{mode}{i}" for i in range(args.logins)]
+            for user in returning:
+                seed_user(db, auth, user)
+            for scenario, users, action in (('new', [f"new{mode}{i}" for i in range(args.logins)], 'signup'),
+                                            ('returning', returning, 'login')):
+                result = run_level(app_module.app, users, args.concurrency, action)
+                results[f"{mode} {scenario}"] = result
+                print(f"{mode:<12}{scenario:<11}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+                      f"{result['per_sec']:>9}  {result['errors'] or '-'}")
+
+    for scenario in ('new', 'returning'):
+        saved = results[f"sequential {scenario}"]['p50_ms'] - results[f"concurrent {scenario}"]['p50_ms']
+        print(f"⏱  {scenario}: fan-out saves {saved:.1f} ms at p50")
+    if args.output:
+        save_results(args.output, 'fanout', results)
+
+
+if __name__ == "__main__":
+    main()
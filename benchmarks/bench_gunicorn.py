@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+gunicorn.conf.py: worker class / worker / thread matrix and lifecycle checks
+
+Starts the fake uclapi.com here and runs benchmarks.fake_app (in-memory
+Firestore/Auth fakes) under real gunicorn with gunicorn.conf.py, once per
+configuration in the matrix (overriding the class, workers and threads
+through GUNICORN_WORKER_CLASS / WEB_CONCURRENCY / GUNICORN_THREADS) and
+once with the config's own sizing ("auto"). Each drives returning-user
+logins from --concurrency clients for --duration seconds. Then, with the
+auto sizing, checks that:
+
+  - /ready turns 200 without any request (probes start at worker boot)
+  - workers recycled by max_requests (with jitter), with keep-alive on and
+    off, fail no logins other than connection resets. An exiting worker
+    closes the connections it has accepted (or kept alive) but not started
+    on; those resets are reported as a warning, per recycle
+  - a storm of callbacks on a slow uclapi.com beyond what the /callback
+    limiters run and queue gets fast 503s, and /health still answers
+  - SIGTERM lets logins in flight on a slow uclapi.com finish
+
+Usage: python -m benchmarks.bench_gunicorn [--concurrency 64] [--duration 8]
+       [--quick] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+from urllib.parse import parse_qs, urlparse
+
+import server_sizing
+from benchmarks.bench_serving import drive, free_port
+from benchmarks.common import check, save_results
+from benchmarks.fakes import FakeUCLServer, make_code
+
+# How httpx reports a request on a connection the server closed without answering
+RESET_ERRORS = ('ReadError', 'RemoteProtocolError')
+
+# (label, worker class, workers, threads); None leaves the value to the config
+MATRIX = [
+    ('sync 1x1', 'sync', 1, None),
+    ('sync 3x1', 'sync', 3, None),
+    ('gthread 1x8', 'gthread', 1, 8),
+    ('gthread 1x16', 'gthread', 1, 16),
+    ('gthread 1x32', 'gthread', 1, 32),
+    ('gthread 1x64', 'gthread', 1, 64),
+    ('gthread 2x16', 'gthread', 2, 16),
+    ('gthread 2x32', 'gthread', 2, 32),
+    ('gthread 4x32', 'gthread', 4, 32),
+    ('async 1', 'uvicorn.workers.UvicornWorker', 1, None),
+    ('async 2', 'uvicorn.workers.UvicornWorker', 2, None),
+    ('auto', None, None, None),
+]
+QUICK = {'sync 1x1', 'gthread 1x16', 'gthread 2x32', 'async 2', 'auto'}
+
+
+def start_server(args, ucl_url, workdir, worker_class=None, workers=None, threads=None, **extra):
+    """gunicorn -c gunicorn.conf.py on fake_app; returns (process, base_url)"""
+    port = free_port()
+    env = dict(os.environ,
+               PORT=str(port),
+               FAKE_UCL_URL=ucl_url,
+               FAKE_FIRESTORE_LATENCY_MS=str(args.firestore_latency_ms),
+               FAKE_AUTH_LATENCY_MS=str(args.auth_latency_ms),
+               FAKE_SEED_USERS=str(args.seed_users),
+               METRICS_DIR=os.path.join(workdir, 'metrics'),
+               ANALYTICS_DIR=os.path.join(workdir, 'analytics'),
+               READINESS_PROBE_INTERVAL='1',
+               LOG_LEVEL='WARNING')
+    for name, value in (('GUNICORN_WORKER_CLASS', worker_class), ('WEB_CONCURRENCY', workers),
+                        ('GUNICORN_THREADS', threads)):
+        env.pop(name, None)
+        if value is not None:
+            env[name] = str(value)
+    env.update({name: str(value) for name, value in extra.items()})
+    target = 'benchmarks.fake_app:asgi' if worker_class and 'uvicorn' in worker_class else 'benchmarks.fake_app:app'
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', target],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited: {server.stderr.read().decode()[-2000:]}")
+        try:
+            httpx.get(f"{base_url}/", timeout=1)
+            return server, base_url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=120)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def recycle(args, ucl_url, workdir, keepalive):
+    """Drive logins with workers recycled every ~100 requests; returns (result, worker pids seen)"""
+    server, base_url = start_server(args, ucl_url, workdir, GUNICORN_MAX_REQUESTS=100,
+                                    GUNICORN_MAX_REQUESTS_JITTER=20, GUNICORN_KEEPALIVE=keepalive)
+    pids = set()
+    done = threading.Event()
+
+    def watch():
+        while not done.is_set():
+            try:
+                # A fresh connection each time, so the watcher itself never hits a reset
+                pids.add(httpx.get(f"{base_url}/health", timeout=5).json()['startup']['pid'])
+            except (httpx.HTTPError, ValueError, KeyError):
+                pass
+            time.sleep(0.05)
+
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    try:
+        result = asyncio.run(drive(base_url, returning_users(args), args.concurrency // 2, args.duration))
+    finally:
+        done.set()
+        watcher.join()
+        stop_server(server)
+    return result, len(pids)
+
+
+async def storm(base_url, logins):
+    """Send `logins` callbacks at once; returns ([(status, retry_after, seconds)], /health seconds meanwhile)"""
+    limits = httpx.Limits(max_connections=logins + 1, max_keepalive_connections=logins + 1)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        states = [parse_qs(urlparse((await client.get('/login/ucl')).headers['location']).query)['state'][0]
+                  for _ in range(logins)]
+
+        async def login(n):
+            start = time.perf_counter()
+            response = await client.get('/callback', params={'result': 'allowed', 'code': make_code(f"storm{n}"),
+                                                             'state': states[n]})
+            return response.status_code, response.headers.get('retry-after'), time.perf_counter() - start
+
+        tasks = [asyncio.create_task(login(n)) for n in range(logins)]
+        await asyncio.sleep(1.0)
+        start = time.perf_counter()
+        await client.get('/health')
+        health = time.perf_counter() - start
+        return await asyncio.gather(*tasks), health
+
+
+def returning_users(args):
+    return lambda n, i: f"seed{(i * args.concurrency + n) % args.seed_users}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=8.0, help='seconds per configuration')
+    parser.add_argument('--quick', action='store_true', help=f"only {', '.join(sorted(QUICK))}")
+    parser.add_argument('--ucl-latency-ms', type=float, default=80.0)
+    parser.add_argument('--firestore-latency-ms', type=float, default=30.0)
+    parser.add_argument('--auth-latency-ms', type=float, default=60.0)
+    parser.add_argument('--seed-users', type=int, default=5000)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    sizing = server_sizing.plan()
+    print(f"🧮 auto sizing here: {sizing['worker_class']}, {sizing['workers']} workers x {sizing['threads']} threads, "
+          f"timeout {sizing['timeout']} s, graceful {sizing['graceful_timeout']} s ({sizing['inputs']})")
+    failures = []
+    results = {'sizing': sizing, 'matrix': {}}
+
+    with FakeUCLServer(latency_ms=args.ucl_latency_ms, jitter=0.2) as ucl, tempfile.TemporaryDirectory() as tmp:
+        print(f"{'config':<15}{'logins/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  errors")
+        for label, worker_class, workers, threads in MATRIX:
+            if args.quick and label not in QUICK:
+                continue
+            server, base_url = start_server(args, ucl.url, tmp, worker_class, workers, threads)
+            try:
+                result = asyncio.run(drive(base_url, returning_users(args), args.concurrency, args.duration))
+            finally:
+                stop_server(server)
+            results['matrix'][label] = result
+            print(f"{label:<15}{result['per_sec']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+                  f"{result['p99_ms']:>10}  {result['errors'] or '-'}")
+
+        matrix = results['matrix']
+        best_label = max((label for label in matrix if label.startswith('gthread')),
+                         key=lambda label: matrix[label]['per_sec'], default=None)
+        if best_label:
+            auto, best = matrix['auto']['per_sec'], matrix[best_label]['per_sec']
+            check(failures, auto >= 0.8 * best, f"auto sizing: {auto} logins/s, best gthread ({best_label}) {best}")
+        if 'sync 1x1' in matrix:
+            check(failures, matrix['auto']['per_sec'] > 5 * matrix['sync 1x1']['per_sec'],
+                  f"auto sizing beats the old single sync worker {matrix['auto']['per_sec'] / max(matrix['sync 1x1']['per_sec'], 0.1):.0f}x")
+
+        print("🚦 /ready after boot, no requests")
+        server, base_url = start_server(args, ucl.url, tmp)
+        try:
+            deadline = time.time() + 10
+            status = None
+            while time.time() < deadline and status != 200:
+                time.sleep(0.5)
+                status = httpx.get(f"{base_url}/ready", timeout=5).status_code
+            check(failures, status == 200, f"/ready {status}")
+        finally:
+            stop_server(server)
+
+        results['recycling'] = {}
+        for keepalive in sorted({sizing['keepalive'], 0}, reverse=True):
+            print(f"♻️  recycling: max_requests 100, jitter 20, keepalive {keepalive}")
+            result, pids = recycle(args, ucl.url, tmp, keepalive)
+            results['recycling'][keepalive] = dict(result, worker_pids=pids)
+            resets = sum(count for error, count in result['errors'].items() if error in RESET_ERRORS)
+            print(f"   {result['count']} logins at {result['per_sec']}/s across {pids} worker processes, "
+                  f"errors {result['errors'] or '-'}")
+            check(failures, pids > sizing['workers'], "workers were recycled")
+            check(failures, all(error in RESET_ERRORS for error in result['errors']),
+                  "no errors other than connection resets")
+            recycles = max(pids - sizing['workers'], 1)
+            results['recycling'][keepalive]['resets_per_recycle'] = round(resets / recycles, 1)
+            if resets:
+                print(f"  ⚠️  {resets} requests reset, {resets / recycles:.1f} per recycle: sent on connections the "
+                      f"exiting worker had accepted{' or kept alive' if keepalive else ''} but not started; "
+                      f"the proxy must retry them")
+
+        with FakeUCLServer(latency_ms=3000) as slow:
+            capacity = sizing['workers'] * (sizing['inputs']['callback_max_concurrent'] +
+                                            sizing['inputs']['callback_max_queue'])
+            logins = 2 * capacity
+            print(f"🌩  storm: {logins} callbacks at once on a 3 s uclapi.com, limiters hold {capacity}")
+            server, base_url = start_server(args, slow.url, tmp)
+            try:
+                outcomes, health = asyncio.run(storm(base_url, logins))
+            finally:
+                stop_server(server)
+            shed = [seconds for status, retry_after, seconds in outcomes if status == 503 and retry_after]
+            ok = [seconds for status, _, seconds in outcomes if status == 302]
+            results['storm'] = {'succeeded': len(ok), 'shed': len(shed), 'health_s': round(health, 3)}
+            print(f"   {len(ok)} succeeded, {len(shed)} shed (fastest half within "
+                  f"{sorted(shed)[len(shed) // 2 - 1] if shed else 0:.2f} s), /health in {health:.2f} s")
+            check(failures, len(ok) + len(shed) == logins, "every callback got a redirect or a 503 with Retry-After")
+            check(failures, len(shed) >= logins - capacity and shed and min(shed) < 1,
+                  "the /callback limiters shed the overflow with fast 503s")
+            check(failures, health < 1, "/health answered while the limiters were full")
+
+        print("🛑 SIGTERM with logins in flight on a 3 s uclapi.com")
+        with FakeUCLServer(latency_ms=3000) as slow:
+            server, base_url = start_server(args, slow.url, tmp)
+            try:
+                outcome = {}
+                runner = threading.Thread(target=lambda: outcome.update(
+                    asyncio.run(drive(base_url, returning_users(args), 16, 0.5))))
+                runner.start()
+                time.sleep(1.0)
+                stopping = time.perf_counter()
+                server.send_signal(signal.SIGTERM)
+                runner.join()
+                server.wait(timeout=sizing['graceful_timeout'] + 10)
+                stopped = time.perf_counter() - stopping
+            finally:
+                if server.poll() is None:
+                    server.kill()
+        results['graceful'] = dict(outcome, stopped_s=round(stopped, 1))
+        print(f"   {outcome['count']} logins completed, errors {outcome['errors'] or '-'}; "
+              f"gunicorn exited {stopped:.1f} s after SIGTERM")
+        check(failures, outcome['count'] >= 16 and not outcome['errors'], "in-flight logins finished")
+
+    if args.output:
+        save_results(args.output, 'gunicorn', results)
+    if failures:
+        print(f"❌ {len(failures)} check(s) failed")
+        sys.exit(1)
+    print("✅ all checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Per-request logging cost: the old synchronous INFO logging vs. the queue pipeline
+
+Replays the log records one /callback produced before the structured
+logging change (full token response, full UCL user data, redirect URL with
+the custom token, ...) and the records it produces now, inside a Flask
+request context with the sampling decision the request hooks draw. Reports the time the
+request thread spends in logging calls; the queue pipeline's formatting
+and I/O happen on its listener thread.
+
+Usage: python -m benchmarks.bench_logging [--requests 5000] [--threads 4]
+       [--sample-rate 0.1] [--stream stdout] [--output results.json]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import save_results, summarize
+from log_setup import end_request_sampling, start_request_sampling
+
+TOKEN_DATA = {'ok': True, 'token': 'uclapi-user-1a2b3c4d5e6f7a8b9c0d', 'scope': '["student_number"]',
+              'client_id': '1234567890123456.1234567890123456', 'state': 'x' * 43}
+USER_DATA = {'ok': True, 'email': 'zcabxyz@ucl.ac.uk', 'full_name': 'Student Xyz',
+             'department': 'Computer Science', 'upi': 'abxyz12', 'is_student': True,
+             'cn': 'zcabxyz', 'given_name': 'Student', 'mail': 'student.xyz.23@ucl.ac.uk'}
+CUSTOM_TOKEN = 'eyJhbGciOiAiUlMyNTYiLCAidHlwIjogIkpXVCJ9.' + 'eyJ1aWQiOiAiYWJjIn0' * 20 + '.' + 'c2ln' * 86
+UID = 'Xk3v9QmT2bZr8YpL1sWn4HcJ7aEd'
+
+
+def legacy_request(logger):
+    """The INFO records a returning-user /callback emitted before"""
+    logger.info(f"Token response: {TOKEN_DATA}")
+    logger.info(f"Fetching user data from UCL API with token: {TOKEN_DATA['token'][:10]}...")
+    logger.info(f"UCL API user data response: {USER_DATA}")
+    logger.info(f"Successfully retrieved UCL user data for: {USER_DATA['email']}")
+    logger.info(f"Looking for existing UCL user with email: {USER_DATA['email']}")
+    logger.info(f"Found existing user with email {USER_DATA['email']}: {UID}")
+    logger.info(f"Updated existing UCL user: {UID}")
+    logger.info(f"Redirecting to app with URL: conni://success?token={CUSTOM_TOKEN}&action=login (action: login)")
+
+
+def structured_request(logger):
+    """The records a returning-user /callback emits now"""
+    logger.info("Retrieved UCL user data", extra={'email': USER_DATA['email'], 'scope': TOKEN_DATA['scope']})
+    logger.debug("Found existing user", extra={'uid': UID})
+    logger.debug("Updated existing UCL user", extra={'uid': UID})
+    logger.info("UCL login complete", extra={'uid': UID, 'action': 'login'})
+
+
+def configure(mode, stream, sample_rate):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if mode == 'sync':
+        # What logging.basicConfig(level=logging.INFO) set up
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        return None
+    from log_setup import setup_logging
+    return setup_logging(level='INFO', fmt='json', sample_rate=sample_rate, stream=stream)
+
+
+def run(flask_app, emit, requests_total, threads):
+    logger = logging.getLogger('app')
+    latencies = []
+    lock = threading.Lock()
+    per_thread = requests_total // threads
+
+    def worker():
+        local = []
+        for _ in range(per_thread):
+            with flask_app.test_request_context('/callback'):
+                start = time.perf_counter()
+                sampling = start_request_sampling()
+                emit(logger)
+                end_request_sampling(sampling)
+                local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--sample-rate', type=float, default=0.1)
+    parser.add_argument('--stream', choices=['file', 'stdout'], default='file',
+                        help='write log output to a temp file (default) or real stdout')
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    from flask import Flask
+    flask_app = Flask('bench_logging')
+
+    scenarios = [
+        ('legacy records, sync handler', legacy_request, 'sync', 1.0),
+        ('legacy records, queue pipeline', legacy_request, 'queue', 1.0),
+        ('structured records, queue pipeline', structured_request, 'queue', 1.0),
+        (f"structured records, sampled {args.sample_rate:g}", structured_request, 'queue', args.sample_rate),
+    ]
+
+    results = {}
+    print(f"{'scenario':<40}{'p50 us':>10}{'p99 us':>10}{'max us':>10}")
+    for name, emit, mode, rate in scenarios:
+        if args.stream == 'stdout':
+            stream = sys.stdout
+        else:
+            stream = tempfile.NamedTemporaryFile('w', prefix='bench-logging-', suffix='.log', delete=False)
+        handler = configure(mode, stream, rate)
+        result = run(flask_app, emit, args.requests, args.threads)
+        if handler is not None:
+            handler.stop()
+            result['dropped'] = handler.dropped
+        if stream is not sys.stdout:
+            stream.close()
+            result['bytes_written'] = os.path.getsize(stream.name)
+            os.unlink(stream.name)
+        results[name] = result
+        print(f"{name:<40}{result['p50_ms'] * 1000:>10.1f}{result['p99_ms'] * 1000:>10.1f}"
+              f"{result['max_ms'] * 1000:>10.1f}", file=sys.stderr if args.stream == 'stdout' else sys.stdout)
+
+    if args.output:
+        save_results(args.output, 'logging', results)
+
+
+if __name__ == "__main__":
+    main()
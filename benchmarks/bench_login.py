@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+End-to-end login benchmark: /login/ucl -> /callback against local fakes
+
+Starts a fake uclapi.com on 127.0.0.1, swaps Firestore and Firebase Auth
+for in-memory fakes, then drives the real Flask app through the OAuth
+flow (state round-trip included) for new and returning users at several
+concurrency levels. Each virtual user has its own test client, so cookies
+are isolated the way separate browsers are.
+
+Usage: python -m benchmarks.bench_login [--concurrency 1 4 16] [--logins 200]
+       [--ucl-latency-ms 80] [--firestore-latency-ms 30] [--auth-latency-ms 60]
+       [--output benchmarks/results/login.json]
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.common import save_results, summarize
+from benchmarks.fakes import (FakeAuth, FakeFirestore, FakeUCLServer, install_fakes,
+                              make_code, make_signer, seed_user)
+
+
+def login(client, code):
+    """Run one OAuth round trip; returns (status, location)"""
+    response = client.get('/login/ucl')
+    state = parse_qs(urlparse(response.location).query)['state'][0]
+    response = client.get('/callback', query_string={'result': 'allowed', 'code': code, 'state': state})
+    return response.status_code, response.location or ''
+
+
+def run_level(flask_app, users, concurrency, expected_action):
+    """Log every user in once using `concurrency` parallel clients"""
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    queue = list(users)
+
+    def worker():
+        client = flask_app.test_client()
+        while True:
+            with lock:
+                if not queue:
+                    return
+                user = queue.pop()
+            start = time.perf_counter()
+            status, location = login(client, make_code(user))
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status == 302 and location.startswith('conni://success') and f"action={expected_action}" in location:
+                    latencies.append(elapsed)
+                else:
+                    key = f"{status} {location.split('?', 1)[0]}".strip()
+                    errors[key] = errors.get(key, 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = summarize(latencies, time.perf_counter() - start)
+    result['errors'] = errors
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--logins', type=int, default=200, help='logins per scenario and level')
+    parser.add_argument('--ucl-latency-ms', type=float, default=80.0)
+    parser.add_argument('--firestore-latency-ms', type=float, default=30.0)
+    parser.add_argument('--auth-latency-ms', type=float, default=60.0)
+    parser.add_argument('--jitter', type=float, default=0.2, help='relative latency jitter')
+    parser.add_argument('--output', default=os.path.join('benchmarks', 'results', f"login-{int(time.time())}.json"))
+    parser.add_argument('--verbose', action='store_true', help='keep the app INFO logs')
+    args = parser.parse_args()
+
+    import app as app_module
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    results = {
+        'config': {
+            'ucl_latency_ms': args.ucl_latency_ms,
+            'firestore_latency_ms': args.firestore_latency_ms,
+            'auth_latency_ms': args.auth_latency_ms,
+            'jitter': args.jitter,
+            'logins': args.logins
+        },
+        'runs': []
+    }
+
+    signer = make_signer()
+    with FakeUCLServer(latency_ms=args.ucl_latency_ms, jitter=args.jitter) as ucl:
+        print(f"{'scenario':<11}{'conc':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  errors")
+        for concurrency in args.concurrency:
+            db = FakeFirestore(latency_ms=args.firestore_latency_ms, jitter=args.jitter)
+            auth = FakeAuth(latency_ms=args.auth_latency_ms, jitter=args.jitter, signer=signer)
+            install_fakes(app_module, ucl.url, db, auth, signer)
+
+            returning = [f"returning{concurrency}x{i}" for i in range(args.logins)]
+            for user in returning:
+                seed_user(db, auth, user)
+            scenarios = [
+                ('new', [f"new{concurrency}x{i}" for i in range(args.logins)], 'signup'),
+                ('returning', returning, 'login')
+            ]
+            for name, users, action in scenarios:
+                result = run_level(app_module.app, users, concurrency, action)
+                result.update(scenario=name, concurrency=concurrency)
+                results['runs'].append(result)
+                print(f"{name:<11}{concurrency:>6}{result['per_sec']:>9}{result['p50_ms']:>10}"
+                      f"{result['p95_ms']:>10}{result['p99_ms']:>10}  {result['errors'] or '-'}")
+
+    save_results(args.output, 'login', results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Signed OAuth state: rejection of tampered, expired and reused states, cost and replay cache bound
+
+Checks that StateSigner.verify():
+
+  - accepts a fresh state once, and rejects it the second time (replayed)
+  - rejects a missing or malformed state, a wrong version, a tampered MAC,
+    a changed nonce, issue time or expiry, and a state signed with another
+    SECRET_KEY
+  - rejects an expired state, and one issued more than a minute in the
+    future (both correctly signed)
+
+and that the replay cache forgets used nonces once their states have
+expired, so a worker's cache stays small at a steady login rate.
+
+Usage: python -m benchmarks.bench_oauth_state [--iterations 20000] [--output results.json]
+"""
+
+import argparse
+import sys
+import time
+
+from benchmarks.common import check, save_results
+from oauth_state import InvalidState, ReplayCache, StateSigner
+from user_cache import InMemoryLRUBackend
+
+SECRET = 'bench-secret'
+
+
+def rejection(signer, state):
+    """InvalidState reason for state, or None if it verified"""
+    try:
+        signer.verify(state)
+    except InvalidState as e:
+        return e.reason
+    return None
+
+
+def signed(signer, version, nonce, issued_at, expires_at):
+    """A correctly signed state with arbitrary fields"""
+    message = f"{version}.{nonce}.{issued_at}.{expires_at}"
+    return f"{message}.{signer._mac(message)}"
+
+
+def resign(state, **fields):
+    """state with some fields replaced but the original MAC kept"""
+    version, nonce, issued_at, expires_at, mac = state.split('.')
+    parts = dict(version=version, nonce=nonce, issued_at=issued_at, expires_at=expires_at)
+    parts.update(fields)
+    return f"{parts['version']}.{parts['nonce']}.{parts['issued_at']}.{parts['expires_at']}.{mac}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    failures = []
+    results = {}
+    signer = StateSigner(SECRET, ttl=600)
+    now = int(time.time())
+
+    print("🔏 verify()")
+    state = signer.issue()
+    check(failures, rejection(signer, state) is None, "a fresh state verifies")
+    check(failures, rejection(signer, state) == 'replayed', "the same state again is replayed")
+
+    original = signer.issue()
+    version, nonce, issued_at, expires_at, mac = original.split('.')
+    flipped = ('A' if mac[0] != 'A' else 'B') + mac[1:]
+    cases = [
+        ('missing', None, 'missing'),
+        ('empty', '', 'missing'),
+        ('not a token', 'forged', 'malformed'),
+        ('too many fields', f"{version}.{nonce}.{issued_at}.{expires_at}.{mac}.x", 'malformed'),
+        ('wrong version', signed(signer, 'v2', nonce, issued_at, expires_at), 'malformed'),
+        ('tampered MAC', f"{version}.{nonce}.{issued_at}.{expires_at}.{flipped}", 'bad_signature'),
+        ('no MAC', f"{version}.{nonce}.{issued_at}.{expires_at}.", 'bad_signature'),
+        ('changed nonce', resign(original, nonce='x' + nonce[1:]), 'bad_signature'),
+        ('changed issue time', resign(original, issued_at=str(int(issued_at) + 1)), 'bad_signature'),
+        ('extended expiry', resign(original, expires_at=str(int(expires_at) + 86400)), 'bad_signature'),
+        ('other SECRET_KEY', StateSigner('another-secret').issue(), 'bad_signature'),
+        ('non-numeric times', signed(signer, 'v1', 'nonce', 'soon', 'later'), 'malformed'),
+        ('expired', signed(signer, 'v1', 'expired', now - 700, now - 100), 'expired'),
+        ('expires now', signed(signer, 'v1', 'now', now - 600, now), 'expired'),
+        ('issued in the future', signed(signer, 'v1', 'future', now + 120, now + 720), 'expired'),
+    ]
+    results['rejections'] = {}
+    for label, bad_state, reason in cases:
+        got = rejection(signer, bad_state)
+        results['rejections'][label] = got
+        check(failures, got == reason, f"{label}: {got}")
+    check(failures, rejection(signer, original) is None,
+          "the untampered original still verifies (rejections don't use up the nonce)")
+    check(failures, rejection(signer, signed(signer, 'v1', 'skew', now + 30, now + 630)) is None,
+          "an issue time within a minute of clock skew verifies")
+
+    print(f"⏱  issue() + verify(), {args.iterations} states")
+    timed = StateSigner(SECRET)
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        timed.verify(timed.issue())
+    per_state = (time.perf_counter() - start) / args.iterations * 1e6
+    results['issue_verify_us'] = round(per_state, 1)
+    check(failures, per_state < 100, f"{per_state:.1f} µs per state")
+
+    print("🧹 replay cache: 2 s states, used at a steady rate for 6 s")
+    backend = InMemoryLRUBackend(max_entries=1000000)
+    short = StateSigner(SECRET, ttl=2, replay_cache=ReplayCache(ttl=2, backend=backend))
+    deadline = time.perf_counter() + 6
+    used = peak = 0
+    while time.perf_counter() < deadline:
+        short.verify(short.issue())
+        used += 1
+        if used % 1000 == 0:
+            peak = max(peak, len(backend))
+    per_second = used / 6
+    results['replay_cache'] = {'used': used, 'peak': peak, 'evictions': backend.evictions}
+    print(f"   {used} states used, at most {peak} nonces held")
+    check(failures, peak <= 2.5 * per_second and backend.evictions == 0,
+          f"only the last 2 s of nonces are kept ({peak} of {used}, ~{per_second:.0f}/s)")
+
+    if args.output:
+        save_results(args.output, 'oauth_state', results)
+    if failures:
+        print(f"❌ {len(failures)} check(s) failed")
+        sys.exit(1)
+    print("✅ all checks passed")
+
+
+if __name__ == "__main__":
+    main()
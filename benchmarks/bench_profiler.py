@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+/admin/profile: sampling a worker under login load
+
+Drives the in-process app (local fakes, real RSA token signing) with
+--threads concurrent logins and profiles it through /admin/profile. Checks
+that:
+
+  - the endpoint is off without ADMIN_TOKEN and needs the token when set
+  - samples are attributed to /callback stages: the upstream calls are
+    mostly socket wait, and by the per-stage CPU clock token minting (on
+    the lookup pool, attributed to the request) is mostly CPU
+  - collapsed and speedscope output are well formed and agree
+  - ?rate samples only that share of requests, and nothing outside them
+  - one session at a time per worker
+  - login throughput with and without a session running
+
+Usage: python -m benchmarks.bench_profiler [--threads 8] [--seconds 3]
+       [--interval-ms 5] [--output results.json]
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.common import check, save_results
+from benchmarks.fakes import FakeAuth, FakeFirestore, FakeUCLServer, install_fakes, make_code, make_signer
+
+TOKEN = 'bench-admin-token'
+AUTH = {'Authorization': f'Bearer {TOKEN}'}
+
+
+class LoginLoad:
+    """Threads logging new users in back to back through the test client"""
+
+    def __init__(self, flask_app, threads):
+        self.flask_app = flask_app
+        self.threads = threads
+        self.logins = 0
+        self._ids = itertools.count()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._workers = []
+
+    def _run(self):
+        client = self.flask_app.test_client()
+        while not self._stop.is_set():
+            location = client.get('/login/ucl').location
+            state = parse_qs(urlparse(location).query)['state'][0]
+            code = make_code(f"prof{next(self._ids)}")
+            if client.get('/callback', query_string={'result': 'allowed', 'code': code,
+                                                   'state': state}).status_code == 302:
+                with self._lock:
+                    self.logins += 1
+
+    def __enter__(self):
+        self._workers = [threading.Thread(target=self._run, daemon=True) for _ in range(self.threads)]
+        for worker in self._workers:
+            worker.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        for worker in self._workers:
+            worker.join()
+
+    def rate(self, seconds):
+        """Logins/sec over the next `seconds`"""
+        before = self.logins
+        time.sleep(seconds)
+        return (self.logins - before) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=3.0, help='length of each profiling session')
+    parser.add_argument('--interval-ms', type=float, default=5.0)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    import app as app_module
+    logging.getLogger().setLevel(logging.ERROR)
+    app_module.profiler.interval = args.interval_ms / 1000
+    signer = make_signer()
+    client = app_module.app.test_client()
+    failures = []
+    results = {}
+
+    def profile(fmt='summary', **params):
+        return client.get('/admin/profile', query_string=dict(params, seconds=args.seconds, format=fmt), headers=AUTH)
+
+    with FakeUCLServer(latency_ms=80, jitter=0.2) as ucl:
+        install_fakes(app_module, ucl.url, FakeFirestore(latency_ms=30, jitter=0.2),
+                      FakeAuth(latency_ms=60, jitter=0.2, signer=signer), signer)
+
+        print("🔐 access")
+        app_module.ADMIN_TOKEN = ''
+        status = client.get('/admin/profile', headers=AUTH).status_code
+        check(failures, status == 404, f"disabled without ADMIN_TOKEN ({status})")
+        app_module.ADMIN_TOKEN = TOKEN
+        statuses = [client.get('/admin/profile', headers=headers).status_code
+                    for headers in ({}, {'Authorization': 'Bearer wrong'})]
+        check(failures, statuses == [401, 401], f"missing or wrong token rejected ({statuses})")
+        status = client.get('/admin/profile', query_string={'format': 'svg'}, headers=AUTH).status_code
+        check(failures, status == 400, f"unknown format rejected ({status})")
+
+        with LoginLoad(app_module.app, args.threads) as load:
+            load.rate(1.0)
+            print(f"🏃 {args.threads} login threads")
+            baseline = load.rate(args.seconds)
+
+            print(f"🔬 all threads, {args.seconds:g} s at {args.interval_ms:g} ms")
+            before = load.logins
+            start = time.perf_counter()
+            response = profile()
+            profiled = (load.logins - before) / (time.perf_counter() - start)
+            summary = results['all_threads'] = response.get_json()
+            stages = summary['stages']
+            print(f"   {summary['samples']} samples over {summary['ticks']} ticks; "
+                  f"{baseline:.1f} logins/s unprofiled, {profiled:.1f} while sampling")
+            print(f"   {'stage':<18}{'cpu ms':>9}{'wait ms':>9}  top components")
+            for stage, entry in sorted(stages.items(), key=lambda item: -item[1]['cpu_ms'] - item[1]['wait_ms']):
+                top = sorted(entry['components'].items(), key=lambda item: -item[1]['cpu_ms'] - item[1]['wait_ms'])
+                print(f"   {stage:<18}{entry['cpu_ms']:>9}{entry['wait_ms']:>9}  "
+                      + ', '.join(f"{name} {part['cpu_ms']:g}/{part['wait_ms']:g}" for name, part in top[:3]))
+            results['logins_per_sec'] = {'unprofiled': round(baseline, 1), 'profiled': round(profiled, 1)}
+
+            check(failures, {'token_exchange', 'user_data', 'user_lookup'} <= set(stages),
+                  "samples attributed to /callback stages")
+            for stage in ('token_exchange', 'user_data'):
+                entry = stages.get(stage, {'cpu_ms': 0, 'wait_ms': 0})
+                check(failures, entry['wait_ms'] > 3 * entry['cpu_ms'], f"{stage} is mostly wait")
+            clock = summary['stage_clock']
+            print(f"   {'stage clock':<18}{'count':>9}{'wall ms':>9}{'cpu ms':>9}")
+            for stage, entry in clock.items():
+                print(f"   {stage:<18}{entry['count']:>9}{entry['wall_ms']:>9}{entry['cpu_ms']:>9}")
+            mint = clock.get('mint_custom_token', {'wall_ms': 0, 'cpu_ms': 0})
+            check(failures, mint['cpu_ms'] > mint['wall_ms'] / 2,
+                  "token minting on the lookup pool is mostly CPU by the stage clock")
+            exchange = clock.get('token_exchange', {'wall_ms': 0, 'cpu_ms': 0})
+            check(failures, exchange['cpu_ms'] < exchange['wall_ms'] / 4, "token_exchange is mostly wait by the stage clock")
+            check(failures, profiled >= baseline * 0.8,
+                  f"sampling costs {max(0.0, 1 - profiled / baseline):.0%} of login throughput")
+
+            print("📄 collapsed and speedscope")
+            collapsed = profile('collapsed').get_data(as_text=True)
+            lines = [line.rsplit(' ', 1) for line in collapsed.splitlines()]
+            check(failures, lines and all(count.isdigit() and stack.endswith(('[cpu]', '[wait]'))
+                                          for stack, count in lines), f"{len(lines)} collapsed stacks")
+            check(failures, any(stack.startswith('/callback;stage:token_exchange;') for stack, _ in lines),
+                  "collapsed stacks are rooted at route and stage")
+            response = profile('speedscope')
+            doc = json.loads(response.get_data())
+            profile_doc = doc['profiles'][0]
+            frames = len(doc['shared']['frames'])
+            check(failures, 'speedscope' in response.headers.get('Content-Disposition', '')
+                  and len(profile_doc['samples']) == len(profile_doc['weights'])
+                  and all(0 <= i < frames for sample in profile_doc['samples'] for i in sample),
+                  f"speedscope file: {frames} frames, {len(profile_doc['samples'])} stacks")
+
+            print("🎯 half of requests")
+            response = profile('collapsed', rate=0.5)
+            stacks = response.get_data(as_text=True).splitlines()
+            check(failures, stacks and not any(line.startswith('thread:') for line in stacks),
+                  "only request threads sampled")
+            before = load.logins
+            summary = results['requests'] = profile(rate=0.5).get_json()
+            # Each login is two requests: /login/ucl and /callback
+            expected = (load.logins - before) * 2 * 0.5
+            print(f"   {summary['requests_profiled']} requests profiled, ~{expected:.0f} expected")
+            check(failures, 0.5 * expected <= summary['requests_profiled'] <= 1.5 * expected,
+                  "about half the requests profiled")
+
+            print("🚧 overlapping sessions")
+            second = {}
+            thread = threading.Thread(target=lambda: second.update(status=profile().status_code))
+            thread.start()
+            time.sleep(0.2)
+            status = client.get('/admin/profile', query_string={'seconds': 1}, headers=AUTH).status_code
+            thread.join()
+            check(failures, status == 409 and second['status'] == 200, f"second session rejected ({status})")
+
+        check(failures, app_module.profiler.active is None, "no session left running")
+
+    if args.output:
+        save_results(args.output, 'profiler', results)
+    if failures:
+        print(f"❌ {len(failures)} check(s) failed")
+        sys.exit(1)
+    print("✅ all checks passed")
+
+
+if __name__ == "__main__":
+    main()
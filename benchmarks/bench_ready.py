@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+/ready: cost per request and how the background probes track dependencies
+
+Runs the app's dependency prober (with a short interval) against the fake
+uclapi.com and in-memory Firestore and checks that:
+
+  - /ready answers 503 until the first probe round, then 200
+  - serving /ready makes no Firestore or uclapi.com call, and costs
+    microseconds while a Firestore read costs --firestore-latency-ms
+  - a Firestore probe that stops returning makes the result stale
+  - a uclapi.com that stops accepting connections shows up as down, but
+    /ready stays 200 (only Firestore gates readiness)
+
+Usage: python -m benchmarks.bench_ready [--requests 2000] [--interval 0.2]
+       [--firestore-latency-ms 30] [--output results.json]
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+from benchmarks.common import check, save_results, summarize
+from benchmarks.fakes import FakeAuth, FakeFirestore, FakeUCLServer, install_fakes, make_signer
+
+
+def wait_for(predicate, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--interval', type=float, default=0.2, help='probe interval in seconds')
+    parser.add_argument('--firestore-latency-ms', type=float, default=30.0)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    import app as app_module
+    logging.getLogger().setLevel(logging.ERROR)
+    signer = make_signer()
+    db = FakeFirestore(latency_ms=args.firestore_latency_ms)
+    prober = app_module.dependency_prober
+    prober.interval = args.interval
+    prober.stale_after = args.interval * 5
+    client = app_module.app.test_client()
+    failures = []
+    results = {}
+
+    with FakeUCLServer() as ucl:
+        install_fakes(app_module, ucl.url, db, FakeAuth(signer=signer), signer)
+
+        print("🚦 startup")
+        response = client.get('/ready')
+        check(failures, response.status_code == 503, f"first /ready is {response.status_code} before any probe")
+        check(failures, wait_for(lambda: prober.snapshot()['ready'], 5), "ready after the first probe round")
+        response = client.get('/ready')
+        dependencies = response.get_json()['dependencies']
+        print('  ' + ', '.join(f"{name} {dep['latency_ms']} ms" for name, dep in dependencies.items()))
+        check(failures, response.status_code == 200, f"/ready is {response.status_code}")
+        check(failures, response.headers.get('Cache-Control') == 'no-store', "/ready is not cacheable")
+
+        print(f"⏱  {args.requests} /ready requests")
+        gets, rounds = db.counts.get('get', 0), prober.rounds
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            t = time.perf_counter()
+            client.get('/ready')
+            latencies.append(time.perf_counter() - t)
+        results['ready'] = summarize(latencies, time.perf_counter() - start)
+        probe_gets, probe_rounds = db.counts.get('get', 0) - gets, prober.rounds - rounds
+        print(f"  p50 {results['ready']['p50_ms'] * 1000:.0f} µs, p99 {results['ready']['p99_ms'] * 1000:.0f} µs; "
+              f"{probe_gets} Firestore reads over {probe_rounds} probe rounds")
+        check(failures, probe_gets <= probe_rounds + 1, "Firestore reads come from the prober, not /ready")
+        check(failures, results['ready']['p99_ms'] < args.firestore_latency_ms / 3,
+              f"p99 well under one Firestore read ({args.firestore_latency_ms:.0f} ms)")
+
+        print("🐢 stuck Firestore probe")
+        db.latency_ms = prober.stale_after * 3000
+        stale = wait_for(lambda: prober.snapshot()['dependencies']['firestore']['status'] == 'stale',
+                         prober.stale_after * 2)
+        response = client.get('/ready')
+        check(failures, stale and response.status_code == 503,
+              f"firestore reported stale, /ready {response.status_code}")
+        db.latency_ms = 0
+        check(failures, wait_for(lambda: prober.snapshot()['ready'], prober.stale_after * 4),
+              "ready again once the probe returns")
+
+        print("🔌 uclapi.com unreachable")
+        ucl.stop()
+        down = wait_for(lambda: prober.snapshot()['dependencies']['ucl_api']['status'] == 'down', 5)
+        response = client.get('/ready')
+        dependencies = response.get_json()['dependencies']
+        print(f"  ucl_api: {dependencies['ucl_api']['error']}")
+        check(failures, down and response.status_code == 200,
+              f"ucl_api reported down, /ready still {response.status_code}")
+        check(failures, dependencies['firestore']['status'] == 'up', "firestore still up")
+        results['down'] = dependencies
+
+    if args.output:
+        save_results(args.output, 'ready', results)
+    if failures:
+        print(f"❌ {len(failures)} check(s) failed")
+        sys.exit(1)
+    print("✅ all checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Capture and replay round trip for a login storm
+
+Drives the in-process app (local fakes) with a synthetic storm while the
+traffic recorder is on: steady logins, a burst at --burst-rate, health
+and readiness probes, and a few denied and invalid-state callbacks. It
+then replays the capture at 1× and at --scale× and checks that:
+
+  - the capture has one sanitized record per request
+  - a 1× replay reproduces the captured /callback outcomes at the
+    captured arrival rate
+  - a --scale× replay sends --scale× the requests at --scale× the rate
+
+Usage: python -m benchmarks.bench_replay [--base-rate 5] [--burst-rate 40]
+       [--scale 2] [--output results.json]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+
+from benchmarks.common import check, save_results
+from benchmarks.fakes import FakeAuth, FakeFirestore, FakeUCLServer, install_fakes, make_signer, seed_user
+from benchmarks.replay import InProcessTarget, Replayer, build_schedule, load_capture, print_report
+from traffic_recorder import TrafficRecorder
+
+RECORD_KEYS = {'ts', 'route', 'status', 'duration_ms', 'stages', 'outcome', 'user'}
+
+
+def storm(base_rate, burst_rate, rng):
+    """Synthetic records for the storm: (route, outcome, user) arrivals over ~8 s"""
+    records = []
+    t = 0.0
+    for duration, rate in ((3.0, base_rate), (2.0, burst_rate), (3.0, base_rate)):
+        end = t + duration
+        while t < end:
+            roll = rng.random()
+            outcome, user = ('new_user', 'new') if roll < 0.3 else ('returning_user', 'returning')
+            if roll > 0.97:
+                outcome, user = ('invalid_state', None) if roll > 0.985 else ('access_denied', None)
+            records.append({'ts': t, 'route': '/callback', 'status': 302, 'outcome': outcome, 'user': user})
+            t += rng.expovariate(rate)
+    probes = [{'ts': i * 0.5, 'route': route, 'status': 200}
+              for i in range(16) for route in ('/health', '/ready')]
+    return sorted(records + probes, key=lambda record: record['ts'])
+
+
+def main():
+    import random
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--base-rate', type=float, default=5.0, help='logins/sec outside the burst')
+    parser.add_argument('--burst-rate', type=float, default=40.0, help='logins/sec during the burst')
+    parser.add_argument('--scale', type=float, default=2.0)
+    parser.add_argument('--seed-users', type=int, default=500)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    import app as app_module
+    logging.getLogger().setLevel(logging.ERROR)
+    signer = make_signer()
+    db = FakeFirestore(latency_ms=30, jitter=0.2)
+    auth = FakeAuth(latency_ms=60, jitter=0.2, signer=signer)
+    failures = []
+    results = {}
+
+    with FakeUCLServer(latency_ms=80, jitter=0.2) as ucl, tempfile.TemporaryDirectory() as tmp:
+        install_fakes(app_module, ucl.url, db, auth, signer)
+        for i in range(args.seed_users):
+            seed_user(db, auth, f"seed{i}")
+        target = InProcessTarget(app_module.app)
+
+        print(f"🎬 capture: {args.base_rate:g} logins/s with a burst of {args.burst_rate:g}/s")
+        path = os.path.join(tmp, 'traffic.jsonl')
+        app_module.traffic_recorder = TrafficRecorder(path, flush_interval=0.2)
+        synthetic = build_schedule(storm(args.base_rate, args.burst_rate, random.Random(7)))
+        results['capture'] = Replayer(target, seed_users=args.seed_users).run(synthetic)
+        app_module.traffic_recorder.flush()
+        app_module.traffic_recorder = None
+
+        with open(path) as f:
+            text = f.read()
+        records = load_capture(path)
+        expected = len(synthetic) + sum(1 for _, record in synthetic if record['route'] == '/callback')
+        print(f"   {len(records)} records, {len(text)} bytes")
+        check(failures, len(records) == expected, f"one record per request ({expected} sent)")
+        check(failures, all(set(record) <= RECORD_KEYS for record in records) and '@' not in text
+              and 'eyJ' not in text and 'state' not in text, "records hold only timing and shape")
+
+        runs = {}
+        for scale in (1.0, args.scale):
+            print(f"▶️  replay at {scale:g}×")
+            report = runs[scale] = Replayer(target, seed_users=args.seed_users).run(
+                build_schedule(records, scale=scale))
+            print_report(report)
+        results['replay'] = runs
+
+        one, scaled = runs[1.0], runs[args.scale]
+        logins = {key: n for key, n in one['captured'].items() if key.startswith('/callback')}
+        check(failures, logins == {key: n for key, n in one['replayed'].items() if key.startswith('/callback')},
+              "1× replay reproduced the captured /callback outcomes")
+        check(failures, abs(one['achieved_per_sec'] - one['offered_per_sec']) <= 0.1 * one['offered_per_sec'],
+              f"1× replay ran at {one['achieved_per_sec']}/s (captured {one['offered_per_sec']}/s)")
+        check(failures, abs(scaled['requests'] - args.scale * one['requests']) <= 0.05 * scaled['requests'],
+              f"{args.scale:g}× replay sent {scaled['requests']} requests ({one['requests']} at 1×)")
+        ratio = scaled['achieved_per_sec'] / one['achieved_per_sec']
+        check(failures, abs(ratio - args.scale) <= 0.15 * args.scale, f"{args.scale:g}× replay ran {ratio:.2f}× faster")
+
+    if args.output:
+        save_results(args.output, 'replay', results)
+    if failures:
+        print(f"❌ {len(failures)} check(s) failed")
+        sys.exit(1)
+    print("✅ all checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Logins/sec per worker process: sync Flask vs. the ASGI serving mode
+
+Starts the fake uclapi.com here and runs the backend (benchmarks.fake_app,
+with in-memory Firestore/Auth fakes) under real gunicorn with ONE worker
+per mode:
+
+  sync      gunicorn app:app with the default sync worker (one request at a time)
+  gthread   the same Flask app on the gthread worker with --threads
+  async     gunicorn -k uvicorn.workers.UvicornWorker asgi_app:app
+
+then drives complete /login/ucl -> /callback logins from --concurrency
+concurrent clients for --duration seconds per scenario (new users and
+returning users) and reports completed logins/sec and latency.
+
+Usage: python -m benchmarks.bench_serving [--modes sync gthread async]
+       [--concurrency 64] [--duration 10] [--threads 16] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+from benchmarks.common import save_results, summarize
+from benchmarks.fakes import FakeUCLServer, make_code
+
+SERVER_ARGS = {
+    'sync': ['benchmarks.fake_app:app'],
+    'gthread': ['-k', 'gthread', '--threads', '{threads}', 'benchmarks.fake_app:app'],
+    'async': ['-k', 'uvicorn.workers.UvicornWorker', 'benchmarks.fake_app:asgi'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, args, ucl_url, port):
+    env = dict(os.environ,
+               FAKE_UCL_URL=ucl_url,
+               FAKE_FIRESTORE_LATENCY_MS=str(args.firestore_latency_ms),
+               FAKE_AUTH_LATENCY_MS=str(args.auth_latency_ms),
+               FAKE_SEED_USERS=str(args.seed_users),
+               LOG_LEVEL='WARNING',
+               # Measure raw capacity: don't shed, and keep clients from racing the limiter
+               CALLBACK_MAX_CONCURRENT=str(args.concurrency * 2),
+               CALLBACK_MAX_QUEUE=str(args.concurrency * 2),
+               CALLBACK_QUEUE_TIMEOUT='60')
+    command = [sys.executable, '-m', 'gunicorn', '-w', '1', '-b', f"127.0.0.1:{port}", '--timeout', '120']
+    command += [arg.format(threads=args.threads) for arg in SERVER_ARGS[mode]]
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"{mode} server exited: {server.stderr.read().decode()[-2000:]}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{mode} server did not become healthy")
+
+
+async def drive(base_url, users, concurrency, duration):
+    """Log in as users from `concurrency` clients until duration runs out"""
+    latencies = []
+    errors = {}
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        async def virtual_user(n):
+            i = 0
+            while time.perf_counter() < deadline:
+                user = users(n, i)
+                i += 1
+                start = time.perf_counter()
+                try:
+                    response = await client.get('/login/ucl')
+                    state = parse_qs(urlparse(response.headers['location']).query)['state'][0]
+                    response = await client.get('/callback', params={'result': 'allowed', 'code': make_code(user),
+                                                                     'state': state})
+                    location = response.headers.get('location', '')
+                    key = None if location.startswith('conni://success') else f"{response.status_code} {location[:30]}"
+                except httpx.HTTPError as e:
+                    key = type(e).__name__
+                if key is None:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors[key] = errors.get(key, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(virtual_user(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    result = summarize(latencies, elapsed)
+    result['errors'] = errors
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', nargs='+', choices=list(SERVER_ARGS), default=list(SERVER_ARGS))
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per mode and scenario')
+    parser.add_argument('--threads', type=int, default=16, help='threads for the gthread worker')
+    parser.add_argument('--ucl-latency-ms', type=float, default=80.0)
+    parser.add_argument('--firestore-latency-ms', type=float, default=30.0)
+    parser.add_argument('--auth-latency-ms', type=float, default=60.0)
+    parser.add_argument('--seed-users', type=int, default=20000)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    results = {'config': {key: value for key, value in vars(args).items() if key != 'output'}, 'runs': []}
+    print(f"{'mode':<9}{'scenario':<11}{'logins/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  errors")
+    with FakeUCLServer(latency_ms=args.ucl_latency_ms, jitter=0.2) as ucl:
+        for mode in args.modes:
+            port = free_port()
+            server = start_server(mode, args, ucl.url, port)
+            try:
+                scenarios = [
+                    ('new', lambda n, i, mode=mode: f"new{mode}{n}x{i}"),
+                    # Cycles through the seeded users (wrapping if a run outlasts them)
+                    ('returning', lambda n, i: f"seed{(i * args.concurrency + n) % args.seed_users}"),
+                ]
+                for scenario, users in scenarios:
+                    result = asyncio.run(drive(f"http://127.0.0.1:{port}", users, args.concurrency, args.duration))
+                    result.update(mode=mode, scenario=scenario)
+                    results['runs'].append(result)
+                    print(f"{mode:<9}{scenario:<11}{result['per_sec']:>10}{result['p50_ms']:>10}"
+                          f"{result['p95_ms']:>10}{result['p99_ms']:>10}  {result['errors'] or '-'}")
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+    if args.output:
+        save_results(args.output, 'serving', results)
+
+
+if __name__ == "__main__":
+    main()
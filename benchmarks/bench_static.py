@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Static endpoints: per-request jsonify/f-string rendering vs. pre-serialized responses
+
+"before" is a copy of the old handlers and "after" calls the app's
+pre-serialized responses; both are mounted on bare Flask apps so the
+app's metrics/logging hooks don't skew the comparison. Each endpoint is
+requested plain, with Accept-Encoding: gzip, and as a conditional request
+that gets a 304. The view function plus make_response() is timed inside
+one request context, since the test client's own overhead (~300 us per
+request) would otherwise swamp the difference; status and size come from
+a real test-client request.
+
+Usage: python -m benchmarks.bench_static [--requests 5000] [--output results.json]
+"""
+
+import argparse
+import logging
+import time
+
+from benchmarks.common import save_results
+from log_setup import setup_logging
+
+TOKEN = 'eyJhbGciOiAiUlMyNTYiLCAidHlwIjogIkpXVCJ9.' + 'eyJ1aWQiOiAiYWJjIn0' * 20 + '.' + 'c2ln' * 86
+
+
+def legacy_app():
+    """The handlers as they were before pre-serialization"""
+    from flask import Flask, jsonify, request
+
+    legacy = Flask('legacy')
+
+    @legacy.route('/')
+    def index():
+        return jsonify({'message': 'Conni UCL OAuth Backend',
+                        'endpoints': {'login': '/login/ucl', 'callback': '/callback', 'health': '/health'}})
+
+    @legacy.route('/.well-known/apple-app-site-association')
+    def apple_app_site_association():
+        return jsonify({"applinks": {"details": [{"appID": "5ZHL4H672X.com.mycompany.conni", "paths": ["/*"]}]}})
+
+    @legacy.route('/.well-known/assetlinks.json')
+    def assetlinks():
+        return jsonify([{
+            "relation": ["delegate_permission/common.handle_all_urls"],
+            "target": {
+                "namespace": "android_app",
+                "package_name": "com.mycompany.conni",
+                "sha256_cert_fingerprints": [
+                    "94:C8:4A:3D:94:8F:60:2B:4C:18:FF:AD:8D:2C:82:6D:33:99:CF:59:2F:F0:44:E6:80:15:56:2B:82:B1:91:30",
+                    "69:F3:2B:04:F5:C0:32:6B:4F:10:21:5E:8E:07:6A:A6:F0:92:9F:51:F1:50:0A:1F:3D:02:48:91:A8:C9:D7:8C",
+                    "D4:59:DF:8F:3F:39:F0:0C:2C:B1:5E:A6:3E:29:32:78:59:3D:85:8E:47:FC:F2:A7:D7:CC:0C:06:40:90:88:B1"]
+            }
+        }])
+
+    @legacy.route('/success')
+    def success_page():
+        # Same size and shape as the old f-string page
+        import app as app_module
+        token = request.args.get('token')
+        action = request.args.get('action', 'login')
+        template = app_module.SUCCESS_PAGE
+        values = {'action_title': action.title(), 'action_text': 'Welcome back!',
+                  'action_description': "You've successfully logged in with UCL.",
+                  'token': token, 'action': action}
+        out = template._literals[0]
+        for name, literal in zip(template._names, template._literals[1:]):
+            out = f"{out}{values[name]}{literal}"
+        return out
+
+    return legacy
+
+
+def current_app():
+    """The current handlers without the app's before/after request hooks"""
+    import app as app_module
+    from flask import Flask
+
+    current = Flask('current')
+    current.add_url_rule('/', 'index', app_module.index)
+    current.add_url_rule('/.well-known/apple-app-site-association', 'apple_app_site_association',
+                         app_module.apple_app_site_association)
+    current.add_url_rule('/.well-known/assetlinks.json', 'assetlinks', app_module.assetlinks)
+    current.add_url_rule('/success', 'success_page', app_module.success_page)
+    return current
+
+
+def measure(flask_app, path, headers, count):
+    """Mean microseconds per call of the view function plus make_response()"""
+    with flask_app.test_request_context(path, headers=headers):
+        view = flask_app.view_functions[flask_app.url_map.bind('').match(path.split('?', 1)[0])[0]]
+        start = time.perf_counter()
+        for _ in range(count):
+            flask_app.make_response(view())
+        elapsed = time.perf_counter() - start
+    response = flask_app.test_client().get(path, headers=headers)
+    return round(elapsed / count * 1e6, 2), response.status_code, len(response.get_data())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    before = legacy_app()
+    after = current_app()
+    # Importing the app set up its logging pipeline at LOG_LEVEL; keep it to warnings while timing
+    setup_logging(level=logging.WARNING)
+
+    endpoints = ['/', '/.well-known/apple-app-site-association', '/.well-known/assetlinks.json',
+                 f"/success?token={TOKEN}&action=login"]
+    results = {}
+    print(f"{'endpoint':<42}{'variant':<10}{'before us':>10}{'after us':>10}{'status':>8}{'bytes':>8}")
+    for path in endpoints:
+        etag = after.test_client().get(path).headers.get('ETag')
+        variants = [('plain', {}), ('gzip', {'Accept-Encoding': 'gzip, deflate, br'})]
+        if etag:
+            variants.append(('304', {'If-None-Match': etag}))
+        for variant, headers in variants:
+            before_us, _, _ = measure(before, path, headers, args.requests)
+            after_us, status, size = measure(after, path, headers, args.requests)
+            name = path.split('?', 1)[0]
+            results[f"{name} {variant}"] = {'before_us': before_us, 'after_us': after_us,
+                                            'status': status, 'bytes': size}
+            print(f"{name:<42}{variant:<10}{before_us:>10}{after_us:>10}{status:>8}{size:>8}")
+
+    if args.output:
+        save_results(args.output, 'static', results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Custom-token minting: firebase_admin vs. the preloaded local signer
+
+Uses a throwaway RSA key, so no real Firebase project is needed. That the
+two paths produce byte-identical tokens is checked by
+tests/test_token_signer.py.
+
+Usage: python -m benchmarks.bench_token_signer [--iterations N] [--output results.json]
+"""
+
+import argparse
+import time
+
+from benchmarks.common import save_results, summarize
+
+
+def make_service_account():
+    """Service-account JSON with a freshly generated key"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ).decode('utf-8')
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    info = {
+        'type': 'service_account',
+        'project_id': 'conni-bench',
+        'private_key_id': 'bench-key-id',
+        'private_key': private_pem,
+        'client_email': 'bench@conni-bench.iam.gserviceaccount.com',
+        'client_id': '1',
+        'token_uri': 'https://oauth2.googleapis.com/token'
+    }
+    return info, public_pem
+
+
+def verify(token, public_pem):
+    """Decode a token against the public key and return its claims"""
+    from google.auth import jwt
+    from token_signer import FIREBASE_AUDIENCE
+    return jwt.decode(token, certs=public_pem, audience=FIREBASE_AUDIENCE)
+
+
+def run(name, mint, iterations):
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        mint(f"user-{i}")
+        latencies.append(time.perf_counter() - t0)
+    return {name: summarize(latencies, time.perf_counter() - start)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    import firebase_admin
+    from firebase_admin import auth, credentials
+    from token_signer import CustomTokenSigner
+
+    info, _ = make_service_account()
+    cred = credentials.Certificate(info)
+    bench_app = firebase_admin.initialize_app(cred, name='token-bench')
+    signer = CustomTokenSigner.from_certificate(cred)
+
+    results = {}
+    # Warm up both paths (firebase_admin initializes its signing provider lazily)
+    auth.create_custom_token('warmup', app=bench_app)
+    signer.create_custom_token('warmup')
+    results.update(run('firebase_admin', lambda uid: auth.create_custom_token(uid, app=bench_app), args.iterations))
+    results.update(run('local_signer', signer.create_custom_token, args.iterations))
+
+    print()
+    print(f"{'minter':<16}{'tokens/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['per_sec']:>10}{r['p50_ms']:>10}{r['p99_ms']:>10}")
+
+    if args.output:
+        save_results(args.output, 'token_signer', results)
+
+    firebase_admin.delete_app(bench_app)
+
+
+if __name__ == "__main__":
+    main()
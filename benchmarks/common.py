@@ -0,0 +1,52 @@
+"""
+Helpers shared by the benchmark scripts
+"""
+
+import json
+import os
+import platform
+from datetime import datetime
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, elapsed):
+    """Throughput and latency percentiles (in ms) for a run"""
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'elapsed_s': round(elapsed, 4),
+        'per_sec': round(len(values) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3) if values else 0.0
+    }
+
+
+def check(failures, ok, message):
+    """Print a ✅/❌ line for a benchmark sanity check, recording it in failures if it failed"""
+    print(f"  {'✅' if ok else '❌'} {message}")
+    if not ok:
+        failures.append(message)
+
+
+def save_results(path, name, results):
+    """Write results with enough metadata to compare runs later"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({
+            'benchmark': name,
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'results': results
+        }, f, indent=2)
+    print(f"💾 Results saved to {path}")
@@ -0,0 +1,38 @@
+"""
+The backend wired to in-memory Firestore/Auth fakes, for serving under a real server
+
+    FAKE_UCL_URL=http://127.0.0.1:8765 gunicorn benchmarks.fake_app:app
+    FAKE_UCL_URL=... gunicorn -k uvicorn.workers.UvicornWorker benchmarks.fake_app:asgi
+
+Fakes are installed when a worker imports this module (don't use
+--preload, so each worker gets its own). Settings:
+
+    FAKE_UCL_URL                  fake uclapi.com to call (see fakes.FakeUCLServer)
+    FAKE_FIRESTORE_LATENCY_MS     per Firestore call (default 30)
+    FAKE_AUTH_LATENCY_MS          per Firebase Auth call (default 60)
+    FAKE_JITTER                   relative latency jitter (default 0.2)
+    FAKE_SEED_USERS               returning users seed0..seed{N-1} (default 0)
+"""
+
+import os
+
+import app as app_module
+from benchmarks.fakes import FakeAuth, FakeFirestore, install_fakes, make_signer, seed_user
+
+_jitter = float(os.environ.get('FAKE_JITTER', 0.2))
+_signer = make_signer()
+_db = FakeFirestore(latency_ms=float(os.environ.get('FAKE_FIRESTORE_LATENCY_MS', 30)), jitter=_jitter)
+_auth = FakeAuth(latency_ms=float(os.environ.get('FAKE_AUTH_LATENCY_MS', 60)), jitter=_jitter, signer=_signer)
+install_fakes(app_module, os.environ['FAKE_UCL_URL'], _db, _auth, _signer)
+for i in range(int(os.environ.get('FAKE_SEED_USERS', 0))):
+    seed_user(_db, _auth, f"seed{i}")
+
+app = app_module.app
+
+
+def __getattr__(name):
+    # The ASGI app is only imported when asked for, so sync runs don't need Starlette
+    if name == 'asgi':
+        import asgi_app
+        return asgi_app.app
+    raise AttributeError(name)
@@ -0,0 +1,607 @@
+"""
+Local stand-ins for uclapi.com, Firestore and Firebase Auth
+
+FakeUCLServer is a real HTTP server on 127.0.0.1 speaking the two OAuth
+endpoints /callback uses, so the pooled client, timeouts and retries are
+exercised for real. FakeFirestore and FakeAuth are in-memory objects that
+implement the slice of the google-cloud-firestore / firebase_admin.auth
+APIs the backend uses. All of them can inject latency (and the UCL server
+errors) to model production round-trip times.
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+try:
+    from google.api_core.exceptions import NotFound
+except ImportError:
+    class NotFound(Exception):
+        """Stand-in for google.api_core.exceptions.NotFound"""
+
+try:
+    from firebase_admin.exceptions import FirebaseError
+except ImportError:
+    class FirebaseError(Exception):
+        """Stand-in for firebase_admin.exceptions.FirebaseError"""
+
+        def __init__(self, code, message, cause=None, http_response=None):
+            Exception.__init__(self, message)
+            self.code = code
+
+DEPARTMENTS = [
+    'Computer Science', 'Mathematics', 'Physics & Astronomy', 'Economics',
+    'History', 'Laws', 'Medical School', 'Bartlett School of Architecture',
+    'Chemistry', 'Psychology & Language Sciences'
+]
+
+
+def _sleep(seconds, jitter=0.0):
+    if seconds > 0:
+        time.sleep(seconds * (1 + random.uniform(-jitter, jitter)) if jitter else seconds)
+
+
+# ---------------------------------------------------------------------------
+# uclapi.com
+# ---------------------------------------------------------------------------
+
+def email_for_code(code):
+    """Codes look like '<user>~<nonce>'; the user part picks the identity"""
+    return f"{code.split('~', 1)[0]}@ucl.ac.uk"
+
+
+def make_code(user):
+    """Fresh single-use authorization code for a user"""
+    return f"{user}~{uuid.uuid4().hex[:12]}"
+
+
+class _UCLHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, Nagle plus the
+    # client's delayed ACK adds ~40 ms to every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject(self, endpoint):
+        """Apply configured latency/errors; returns True if an error was sent"""
+        server = self.server.fake
+        server.count(endpoint)
+        _sleep(server.latency(endpoint), server.jitter)
+        if server.slow_rate and endpoint in server.slow_endpoints and random.random() < server.slow_rate:
+            _sleep(server.slow_ms / 1000.0)
+        if server.error_rate and random.random() < server.error_rate:
+            self._send(server.error_status, {'ok': False, 'error': 'injected failure'})
+            return True
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        if urlparse(self.path).path.rstrip('/') != '/oauth/token':
+            return self._send(404, {'ok': False, 'error': 'not found'})
+        if self._inject('token'):
+            return
+        code = form.get('code', [''])[0]
+        if not code or not self.server.fake.use_code(code):
+            return self._send(400, {'ok': False, 'error': 'invalid or used code'})
+        self._send(200, {
+            'ok': True,
+            'token': f"uclapi-user-{code}",
+            'scope': '["student_number"]',
+            'client_id': form.get('client_id', [''])[0]
+        })
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/oauth/user/data':
+            return self._send(404, {'ok': False, 'error': 'not found'})
+        if self._inject('user_data'):
+            return
+        token = parse_qs(url.query).get('token', [''])[0]
+        if not token.startswith('uclapi-user-'):
+            return self._send(400, {'ok': False, 'error': 'invalid token'})
+        email = email_for_code(token[len('uclapi-user-'):])
+        upi = email.split('@', 1)[0]
+        rng = random.Random(upi)
+        self._send(200, {
+            'ok': True,
+            'email': email,
+            'full_name': f"Student {upi}",
+            'department': rng.choice(DEPARTMENTS),
+            'upi': upi,
+            'is_student': rng.random() < 0.9,
+            'cn': upi
+        })
+
+
+class FakeUCLServer:
+    """Threaded HTTP fake of the uclapi.com OAuth endpoints
+
+    latency_ms applies to both endpoints unless token_latency_ms or
+    user_data_latency_ms is given. slow_rate of requests to slow_endpoints
+    take an extra slow_ms (a latency tail). error_rate/latency can be changed while the
+    server is running.
+    """
+
+    def __init__(self, latency_ms=0.0, token_latency_ms=None, user_data_latency_ms=None,
+                 jitter=0.0, error_rate=0.0, error_status=503, single_use_codes=True,
+                 slow_rate=0.0, slow_ms=0.0, slow_endpoints=('token', 'user_data')):
+        self.token_latency_ms = latency_ms if token_latency_ms is None else token_latency_ms
+        self.user_data_latency_ms = latency_ms if user_data_latency_ms is None else user_data_latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.slow_endpoints = slow_endpoints
+        self.single_use_codes = single_use_codes
+        self.requests = {'token': 0, 'user_data': 0}
+        self._used_codes = set()
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    def latency(self, endpoint):
+        ms = self.token_latency_ms if endpoint == 'token' else self.user_data_latency_ms
+        return ms / 1000.0
+
+    def count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def use_code(self, code):
+        if not self.single_use_codes:
+            return True
+        with self._lock:
+            if code in self._used_codes:
+                return False
+            self._used_codes.add(code)
+            return True
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, port=0):
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', port), _UCLHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.request_queue_size = 1024
+        self._httpd.fake = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-ucl', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ---------------------------------------------------------------------------
+# Firestore
+# ---------------------------------------------------------------------------
+
+def _set_path(data, path, value):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        data = data.setdefault(key, {})
+    data[keys[-1]] = value
+
+
+def _get_path(data, path):
+    for key in path.split('.'):
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def _deep_merge(target, source):
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_merge(target[key], value)
+        else:
+            target[key] = deepcopy(value)
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return deepcopy(_get_path(self._data or {}, field))
+
+
+class FakeDocumentReference:
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self._collection = collection
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    def get(self, retry=None, timeout=None):
+        self._db.rpc('get')
+        with self._db.lock:
+            return FakeSnapshot(self, deepcopy(self._db.docs(self._collection).get(self.id)))
+
+    def set(self, data, merge=False):
+        self._db.rpc('set')
+        with self._db.lock:
+            self._db.apply(('set', self, data, merge))
+
+    def update(self, fields):
+        self._db.rpc('update')
+        with self._db.lock:
+            self._db.check_exists(self)
+            self._db.apply(('update', self, fields, None))
+
+    def delete(self):
+        self._db.rpc('delete')
+        with self._db.lock:
+            self._db.apply(('delete', self, None, None))
+
+
+class FakeQuery:
+    def __init__(self, db, collection, filters=(), order=None, start_after=None, limit=None):
+        self._db = db
+        self._collection = collection
+        self._filters = list(filters)
+        self._order = order
+        self._start_after = start_after
+        self._limit = limit
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, order=self._order,
+                     start_after=self._start_after, limit=self._limit)
+        state.update(changes)
+        return FakeQuery(self._db, self._collection, **state)
+
+    def where(self, field, op, value):
+        if op not in ('==', 'in'):
+            raise NotImplementedError(f"FakeFirestore does not support '{op}' filters")
+        return self._copy(filters=self._filters + [(field, op, value)])
+
+    def order_by(self, field):
+        return self._copy(order=field)
+
+    def start_after(self, snapshot_or_values):
+        if isinstance(snapshot_or_values, FakeSnapshot):
+            cursor = snapshot_or_values.id if self._order == '__name__' else snapshot_or_values.get(self._order)
+        elif isinstance(snapshot_or_values, dict):
+            cursor = snapshot_or_values[self._order]
+        else:
+            cursor = snapshot_or_values
+        return self._copy(start_after=cursor)
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def _key(self, doc_id, data):
+        return doc_id if self._order == '__name__' else _get_path(data, self._order)
+
+    def _matches(self, data):
+        for field, op, value in self._filters:
+            actual = _get_path(data, field)
+            if op == '==' and actual != value:
+                return False
+            if op == 'in' and actual not in value:
+                return False
+        return True
+
+    def get(self):
+        return list(self.stream())
+
+    def stream(self):
+        self._db.rpc('query')
+        with self._db.lock:
+            docs = self._db.docs(self._collection)
+            if self._order == '__name__' and not self._filters:
+                # Paging by document ID: seek in the cached ID order instead of sorting
+                ids = self._db.sorted_ids(self._collection)
+                first = 0 if self._start_after is None else bisect_right(ids, self._start_after)
+                last = len(ids) if self._limit is None else first + self._limit
+                return iter([FakeSnapshot(FakeDocumentReference(self._db, self._collection, doc_id),
+                                          deepcopy(docs[doc_id])) for doc_id in ids[first:last]])
+            items = [(doc_id, data) for doc_id, data in docs.items() if self._matches(data)]
+            if self._order is not None:
+                items = [item for item in items if self._key(*item) is not None]
+                items.sort(key=lambda item: self._key(*item))
+                if self._start_after is not None:
+                    items = [item for item in items if self._key(*item) > self._start_after]
+            if self._limit is not None:
+                items = items[:self._limit]
+            results = [FakeSnapshot(FakeDocumentReference(self._db, self._collection, doc_id), deepcopy(data))
+                       for doc_id, data in items]
+        return iter(results)
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, db, name):
+        super().__init__(db, name)
+        self.id = name
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._db, self._collection, doc_id or uuid.uuid4().hex[:20])
+
+
+class FakeWriteBatch:
+    MAX_OPS = 500
+
+    def __init__(self, db):
+        self._db = db
+        self._ops = []
+
+    def _add(self, op):
+        if len(self._ops) >= self.MAX_OPS:
+            raise ValueError('maximum 500 writes allowed per request')
+        self._ops.append(op)
+
+    def set(self, ref, data, merge=False):
+        self._add(('set', ref, data, merge))
+
+    def update(self, ref, fields):
+        self._add(('update', ref, fields, None))
+
+    def delete(self, ref):
+        self._add(('delete', ref, None, None))
+
+    def commit(self):
+        self._db.rpc('commit', len(self._ops))
+        with self._db.lock:
+            # Atomic like Firestore: validate everything before applying anything
+            for kind, ref, _, _ in self._ops:
+                if kind == 'update':
+                    self._db.check_exists(ref)
+            for op in self._ops:
+                self._db.apply(op)
+        self._db.count('batch_writes', len(self._ops))
+        self._ops = []
+
+
+class FakeFirestore:
+    """Thread-safe in-memory Firestore with optional per-RPC (and per batched write) latency"""
+
+    def __init__(self, latency_ms=0.0, jitter=0.0, write_latency_ms=0.0):
+        self.latency_ms = latency_ms
+        self.write_latency_ms = write_latency_ms
+        self.jitter = jitter
+        self.lock = threading.RLock()
+        self.counts = {}
+        self._collections = {}
+        self._sorted_ids = {}
+
+    def rpc(self, kind, writes=0):
+        self.count(kind)
+        _sleep((self.latency_ms + writes * self.write_latency_ms) / 1000.0, self.jitter)
+
+    def count(self, kind, amount=1):
+        with self.lock:
+            self.counts[kind] = self.counts.get(kind, 0) + amount
+
+    def docs(self, collection):
+        return self._collections.setdefault(collection, {})
+
+    def sorted_ids(self, collection):
+        """Document IDs in order, cached until a document is added or removed"""
+        docs = self.docs(collection)
+        ids = self._sorted_ids.get(collection)
+        if ids is None or len(ids) != len(docs):
+            ids = self._sorted_ids[collection] = sorted(docs)
+        return ids
+
+    def check_exists(self, ref):
+        if ref.id not in self.docs(ref._collection):
+            raise NotFound(f"No document to update: {ref.path}")
+
+    def apply(self, op):
+        kind, ref, data, merge = op
+        docs = self.docs(ref._collection)
+        if kind in ('set', 'delete') and (ref.id in docs) != (kind == 'set'):
+            self._sorted_ids.pop(ref._collection, None)
+        if kind == 'set':
+            if merge and ref.id in docs:
+                _deep_merge(docs[ref.id], data)
+            else:
+                docs[ref.id] = deepcopy(data)
+        elif kind == 'update':
+            for path, value in data.items():
+                _set_path(docs[ref.id], path, deepcopy(value))
+        elif kind == 'delete':
+            docs.pop(ref.id, None)
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def get_all(self, refs):
+        self.rpc('get_all')
+        with self.lock:
+            return [FakeSnapshot(ref, deepcopy(self.docs(ref._collection).get(ref.id))) for ref in refs]
+
+    def size(self, collection):
+        with self.lock:
+            return len(self.docs(collection))
+
+
+# ---------------------------------------------------------------------------
+# Firebase Auth
+# ---------------------------------------------------------------------------
+
+class UserNotFoundError(FirebaseError):
+    def __init__(self, message):
+        super().__init__('NOT_FOUND', message)
+
+
+class EmailAlreadyExistsError(FirebaseError):
+    def __init__(self, message):
+        super().__init__('ALREADY_EXISTS', message)
+
+
+class FakeUserRecord:
+    def __init__(self, uid, email, display_name=None, email_verified=False):
+        self.uid = uid
+        self.email = email
+        self.display_name = display_name
+        self.email_verified = email_verified
+
+
+class UidIdentifier:
+    def __init__(self, uid):
+        self.uid = uid
+
+
+class GetUsersResult:
+    def __init__(self, users, not_found):
+        self.users = users
+        self.not_found = not_found
+
+
+class FakeAuth:
+    """In-memory stand-in for the firebase_admin.auth functions we call"""
+
+    UserNotFoundError = UserNotFoundError
+    EmailAlreadyExistsError = EmailAlreadyExistsError
+    UidIdentifier = UidIdentifier
+
+    def __init__(self, latency_ms=0.0, jitter=0.0, signer=None):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.signer = signer
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._by_uid = {}
+        self._by_email = {}
+
+    def _rpc(self, kind):
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+        _sleep(self.latency_ms / 1000.0, self.jitter)
+
+    def add_user(self, email, uid=None, display_name=None):
+        """Seed a user without latency"""
+        record = FakeUserRecord(uid or uuid.uuid4().hex[:28], email, display_name, True)
+        with self._lock:
+            self._by_uid[record.uid] = record
+            self._by_email[email.lower()] = record
+        return record
+
+    def get_user_by_email(self, email):
+        self._rpc('get_user_by_email')
+        with self._lock:
+            record = self._by_email.get(email.lower())
+        if record is None:
+            raise UserNotFoundError(f"No user record found for the provided email: {email}")
+        return record
+
+    def get_user(self, uid):
+        self._rpc('get_user')
+        with self._lock:
+            record = self._by_uid.get(uid)
+        if record is None:
+            raise UserNotFoundError(f"No user record found for the provided user ID: {uid}")
+        return record
+
+    def get_users(self, identifiers):
+        if len(identifiers) > 100:
+            raise ValueError('get_users() takes at most 100 identifiers')
+        self._rpc('get_users')
+        with self._lock:
+            found = [(identifier, self._by_uid.get(identifier.uid)) for identifier in identifiers]
+        return GetUsersResult([record for _, record in found if record],
+                              [identifier for identifier, record in found if not record])
+
+    def create_user(self, email=None, email_verified=False, display_name=None, uid=None):
+        self._rpc('create_user')
+        with self._lock:
+            if email and email.lower() in self._by_email:
+                raise EmailAlreadyExistsError(f"The user with the provided email already exists: {email}")
+        return self.add_user(email, uid=uid, display_name=display_name)
+
+    def create_custom_token(self, uid):
+        if self.signer is not None:
+            return self.signer.create_custom_token(uid)
+        return f"fake-custom-token-{uid}".encode('utf-8')
+
+
+def make_signer():
+    """CustomTokenSigner with a throwaway key, so minting costs real CPU"""
+    from benchmarks.bench_token_signer import make_service_account
+    from token_signer import CustomTokenSigner
+    info, _ = make_service_account()
+    return CustomTokenSigner.from_service_account_info(info)
+
+
+def seed_user(db, auth, user):
+    """Create a returning user exactly as a first login would have"""
+    from user_store import save_new_user
+    email = f"{user}@ucl.ac.uk"
+    record = auth.add_user(email, display_name=f"Student {user}")
+    latency, db.latency_ms = db.latency_ms, 0.0
+    try:
+        save_new_user(db, record.uid, email, {
+            'email': email,
+            'display_name': f"Student {user}",
+            'ucl_verified': True,
+            'auth_method': 'ucl_oauth',
+            'isOnboarded': True
+        })
+    finally:
+        db.latency_ms = latency
+    return record.uid
+
+
+def install_fakes(app_module, ucl_url, db, auth, signer=None):
+    """Point an imported app module at the fakes"""
+    import os
+    import firebase_setup
+    import ucl_client
+    from ucl_client import UCLAPIClient
+    from user_cache import EmailUIDCache
+    from write_behind import get_write_behind_queue
+
+    ucl_client._client = UCLAPIClient(base_url=ucl_url)
+    firebase_setup._db = db
+    firebase_setup._db_pid = os.getpid()
+    app_module.get_db = lambda: db
+    app_module.auth = auth
+    app_module.firebase_initialized = True
+    app_module.FirebaseError = FirebaseError
+    app_module.NotFound = NotFound
+    app_module.token_signer = signer
+    app_module.email_uid_cache = EmailUIDCache()
+    app_module.write_behind = get_write_behind_queue(firebase_setup.get_db)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Replay a traffic capture (see traffic_recorder.py) as load
+
+Requests are sent open-loop at their recorded arrival times, relative to
+the first record, so a burst arrives as a burst however the server copes:
+
+  --scale N   send each request N times (fractions allowed), the copies
+              spread over the following second: N× the rate, same duration
+  --speed N   compress time N×: same requests at N× the rate
+
+A /callback record is replayed as a whole login: GET /login/ucl for a
+state, then GET /callback with a fake code for a new or returning user
+(the capture's own /login/ucl records are folded into those). Denied,
+invalid-state and coalesced callbacks are replayed as such. Other routes
+are plain GETs.
+
+Targets:
+  in-process (default)  the Flask app wired to local fakes: a fake
+                        uclapi.com and in-memory Firestore/Auth
+  --url URL             a running server, e.g. benchmarks.fake_app under
+                        gunicorn with FAKE_SEED_USERS >= --seed-users;
+                        --fake-ucl-port starts the fake uclapi.com here
+                        for its FAKE_UCL_URL
+
+Latency is measured from each request's scheduled send time, so time spent
+queued behind an overloaded server counts. Reports offered vs. achieved
+rate, per-route percentiles and the status/outcome mix next to the
+capture's.
+
+Usage: python -m benchmarks.replay traffic.jsonl [--scale 1] [--speed 1]
+       [--url http://127.0.0.1:8000] [--fake-ucl-port 8765] [--concurrency 256]
+       [--seed-users 1000] [--output results.json]
+"""
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.common import percentile, save_results, summarize
+from benchmarks.fakes import (FakeAuth, FakeFirestore, FakeUCLServer, install_fakes,
+                              make_code, make_signer, seed_user)
+
+LOGIN_ROUTE = '/login/ucl'
+CALLBACK_ROUTE = '/callback'
+
+
+def load_capture(path):
+    """Records from a JSONL capture, oldest first (unreadable lines are skipped)"""
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and 'ts' in record and 'route' in record:
+                records.append(record)
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+
+def build_schedule(records, scale=1.0, speed=1.0, rng=None):
+    """[(offset_seconds, record)] to replay, sorted by offset"""
+    rng = rng or random.Random(0)
+    if not records:
+        return []
+    start = records[0]['ts']
+    schedule = []
+    for record in records:
+        if record['route'] in (LOGIN_ROUTE, 'unmatched'):
+            continue
+        offset = record['ts'] - start
+        copies = int(scale) + (1 if rng.random() < scale - int(scale) else 0)
+        for copy in range(copies):
+            schedule.append(((offset + (rng.random() if copy else 0.0)) / speed, record))
+    schedule.sort(key=lambda item: item[0])
+    return schedule
+
+
+class InProcessTarget:
+    """The Flask app through per-thread test clients"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._local = threading.local()
+
+    def get(self, path, params=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.flask_app.test_client()
+        response = client.get(path, query_string=params)
+        return response.status_code, response.location or ''
+
+
+class HTTPTarget:
+    """A running server through per-thread requests sessions"""
+
+    def __init__(self, base_url, timeout=60):
+        import requests
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self, path, params=None):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self.requests.Session()
+        try:
+            response = session.get(self.base_url + path, params=params, allow_redirects=False, timeout=self.timeout)
+        except self.requests.RequestException as e:
+            return type(e).__name__, ''
+        return response.status_code, response.headers.get('Location', '')
+
+
+def response_kind(route, status, location):
+    """Short label for a response: the status, or new/returning user for a completed login"""
+    if route == CALLBACK_ROUTE and status == 302 and location.startswith('conni://success'):
+        return 'returning_user' if 'action=login' in location else 'new_user'
+    return str(status)
+
+
+def capture_kind(record):
+    """The same label for a captured request"""
+    if record.get('user'):
+        return f"{record['user']}_user"
+    return str(record['status'])
+
+
+class Replayer:
+    """Sends a schedule at its offsets from a thread pool and collects the results"""
+
+    def __init__(self, target, concurrency=256, seed_users=1000, rng=None):
+        self.target = target
+        self.concurrency = concurrency
+        self.seed_users = seed_users
+        self.rng = rng or random.Random(0)
+        self.run_id = uuid.uuid4().hex[:6]
+        self.latencies = {}
+        self.kinds = Counter()
+        self.late = []
+        self._lock = threading.Lock()
+        self._new_users = 0
+        self._last_code = None
+
+    def _code_for(self, record):
+        """Fake authorization code reproducing the recorded login"""
+        with self._lock:
+            if record.get('outcome') == 'coalesced' and self._last_code:
+                return self._last_code
+            if record.get('user') == 'new':
+                self._new_users += 1
+                user = f"replay{self.run_id}x{self._new_users}"
+            else:
+                user = f"seed{self.rng.randrange(self.seed_users)}"
+            self._last_code = make_code(user)
+            return self._last_code
+
+    def _login(self, record):
+        status, location = self.target.get(LOGIN_ROUTE)
+        if status != 302:
+            return status, location
+        state = parse_qs(urlparse(location).query).get('state', [''])[0]
+        if record.get('outcome') == 'invalid_state':
+            state = 'v1.replayed.0.0.invalid'
+        params = {'result': 'denied' if record.get('outcome') == 'access_denied' else 'allowed',
+                  'code': self._code_for(record), 'state': state}
+        return self.target.get(CALLBACK_ROUTE, params)
+
+    def _send(self, record, scheduled):
+        sent = time.perf_counter()
+        try:
+            if record['route'] == CALLBACK_ROUTE:
+                status, location = self._login(record)
+            elif record['route'] == '/success':
+                status, location = self.target.get('/success', {'token': 'replay'})
+            else:
+                status, location = self.target.get(record['route'])
+        except Exception as e:
+            status, location = type(e).__name__, ''
+        done = time.perf_counter()
+        with self._lock:
+            self.latencies.setdefault(record['route'], []).append(done - scheduled)
+            self.kinds[(record['route'], response_kind(record['route'], status, location))] += 1
+            self.late.append(sent - scheduled)
+
+    def run(self, schedule):
+        """Replay the schedule; returns the report"""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='replay') as pool:
+            for offset, record in schedule:
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self._send, record, start + offset)
+        elapsed = time.perf_counter() - start
+        return self.report(schedule, elapsed)
+
+    def report(self, schedule, elapsed):
+        duration = schedule[-1][0] if schedule else 0.0
+        return {
+            'requests': len(schedule),
+            'offered_per_sec': round(len(schedule) / duration, 1) if duration else None,
+            'achieved_per_sec': round(sum(self.kinds.values()) / elapsed, 1) if elapsed else 0.0,
+            'elapsed_s': round(elapsed, 2),
+            'late_start_p99_ms': round(percentile(sorted(self.late), 99) * 1000, 1),
+            'routes': {route: summarize(values, elapsed) for route, values in sorted(self.latencies.items())},
+            'replayed': {f"{route} {kind}": n for (route, kind), n in sorted(self.kinds.items())},
+            'captured': {f"{route} {kind}": n for (route, kind), n in sorted(
+                Counter((record['route'], capture_kind(record)) for _, record in schedule).items())}
+        }
+
+
+def print_report(report):
+    print(f"   {report['requests']} requests, offered {report['offered_per_sec']}/s, "
+          f"achieved {report['achieved_per_sec']}/s over {report['elapsed_s']} s "
+          f"(send lag p99 {report['late_start_p99_ms']} ms)")
+    print(f"   {'route':<40}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, result in report['routes'].items():
+        print(f"   {route:<40}{result['count']:>7}{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}")
+    print(f"   {'response':<48}{'captured':>10}{'replayed':>10}")
+    for key in sorted(set(report['captured']) | set(report['replayed'])):
+        print(f"   {key:<48}{report['captured'].get(key, 0):>10}{report['replayed'].get(key, 0):>10}")
+
+
+def in_process_target(args, ucl):
+    """The Flask app wired to the fake uclapi.com and in-memory Firestore/Auth"""
+    import app as app_module
+    logging.getLogger().setLevel(logging.ERROR)
+    signer = make_signer()
+    db = FakeFirestore(latency_ms=args.firestore_latency_ms, jitter=0.2)
+    auth = FakeAuth(latency_ms=args.auth_latency_ms, jitter=0.2, signer=signer)
+    install_fakes(app_module, ucl.url, db, auth, signer)
+    for i in range(args.seed_users):
+        seed_user(db, auth, f"seed{i}")
+    return InProcessTarget(app_module.app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('capture', help='JSONL written by the traffic recorder')
+    parser.add_argument('--scale', type=float, default=1.0, help='send each request N times (N× the rate)')
+    parser.add_argument('--speed', type=float, default=1.0, help='compress time N×')
+    parser.add_argument('--url', help='replay against a running server instead of the in-process app')
+    parser.add_argument('--fake-ucl-port', type=int, default=0, help='serve the fake uclapi.com on this port')
+    parser.add_argument('--concurrency', type=int, default=256, help='max requests in flight')
+    parser.add_argument('--seed-users', type=int, default=1000, help='returning users seed0..seedN-1')
+    parser.add_argument('--ucl-latency-ms', type=float, default=80.0)
+    parser.add_argument('--firestore-latency-ms', type=float, default=30.0)
+    parser.add_argument('--auth-latency-ms', type=float, default=60.0)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    records = load_capture(args.capture)
+    sampled = {record.get('sample_rate', 1.0) for record in records}
+    if sampled != {1.0}:
+        print(f"⚠️  The capture was sampled at {sorted(sampled)}; use --scale to restore the original rate")
+    schedule = build_schedule(records, scale=args.scale, speed=args.speed)
+    if not schedule:
+        print(f"❌ Nothing to replay in {args.capture}")
+        return
+
+    ucl = FakeUCLServer(latency_ms=args.ucl_latency_ms, jitter=0.2)
+    if args.url:
+        if args.fake_ucl_port:
+            ucl.start(port=args.fake_ucl_port)
+            print(f"🎭 Fake uclapi.com on {ucl.url} (FAKE_UCL_URL for the server)")
+        target = HTTPTarget(args.url)
+    else:
+        ucl.start()
+        target = in_process_target(args, ucl)
+
+    print(f"▶️  Replaying {args.capture} against {args.url or 'the in-process app'} "
+          f"(scale {args.scale:g}×, speed {args.speed:g}×)")
+    try:
+        report = Replayer(target, args.concurrency, args.seed_users).run(schedule)
+    finally:
+        ucl.stop()
+    print_report(report)
+    if args.output:
+        save_results(args.output, 'replay', report)
+
+
+if __name__ == "__main__":
+    main()
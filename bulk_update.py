@@ -0,0 +1,277 @@
+"""
+Bulk rewrites of a Firestore collection for admin.py
+
+Documents are streamed in document-ID order a page at a time (the next
+page is fetched while the current one is transformed), and the writes a
+transform produces are committed in batches of up to 500 operations from a
+thread pool, under an optional writes/sec limit. After each page the ID of
+the last document whose writes have all been committed is saved to a
+checkpoint file, so an interrupted run resumes from there. Transforms must
+be idempotent: batches in flight when a run stops are redone on resume.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Firestore caps a batched write at 500 operations
+MAX_BATCH_SIZE = 500
+
+BULK_PAGE_SIZE = 1000
+BULK_WORKERS = 8
+# Firestore's ramp-up guidance: start a new write load at up to 500 ops/s
+BULK_WRITES_PER_SEC = 500
+BULK_COMMIT_ATTEMPTS = 3
+
+
+class Write(namedtuple('Write', 'kind ref data')):
+    """One batched operation: kind is 'set', 'merge', 'update' or 'delete'"""
+
+    def apply(self, batch):
+        if self.kind == 'set':
+            batch.set(self.ref, self.data)
+        elif self.kind == 'merge':
+            batch.set(self.ref, self.data, merge=True)
+        elif self.kind == 'update':
+            batch.update(self.ref, self.data)
+        elif self.kind == 'delete':
+            batch.delete(self.ref)
+        else:
+            raise ValueError(f"Unknown write kind: {self.kind}")
+
+
+class RateLimiter:
+    """Token bucket shared by the commit threads; rate <= 0 means unlimited"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or MAX_BATCH_SIZE
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n):
+        """Block until n tokens are available, then take them"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return
+                wait = (n - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """Progress of a run in a JSON file, replaced atomically on each save"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+class BulkRun:
+    """Stream a collection through a transform and commit its writes in parallel batches
+
+    transform(docs) gets a page of document snapshots and returns
+    (doc_id, [Write, ...]) pairs for the documents it changes. One
+    document's writes always land in the same batch.
+    """
+
+    def __init__(self, db, name, transform, collection='users', page_size=BULK_PAGE_SIZE,
+                 workers=BULK_WORKERS, writes_per_sec=BULK_WRITES_PER_SEC, dry_run=False,
+                 checkpoint=None, limit=None, progress=None, progress_interval=5.0):
+        self.db = db
+        self.name = name
+        self.transform = transform
+        self.collection = collection
+        self.page_size = page_size
+        self.workers = max(1, workers)
+        self.limiter = RateLimiter(writes_per_sec)
+        self.dry_run = dry_run
+        self.checkpoint = checkpoint
+        self.limit = limit
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.counts = {'scanned': 0, 'changed': 0, 'writes': 0, 'committed': 0, 'batches': 0, 'retries': 0}
+        self.commit_latencies = []
+        self.error = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers * 2)
+        # (sequence number, last document ID covered) in submission order
+        self._pending = deque()
+        self._done = set()
+        self._next_seq = 0
+        self._watermark = None
+
+    def _page(self, cursor):
+        query = self.db.collection(self.collection).order_by('__name__').limit(self.page_size)
+        if cursor is not None:
+            query = query.start_after({'__name__': cursor})
+        return list(query.stream())
+
+    def _commit(self, writes):
+        self.limiter.acquire(len(writes))
+        for attempt in range(1, BULK_COMMIT_ATTEMPTS + 1):
+            start = time.perf_counter()
+            try:
+                batch = self.db.batch()
+                for write in writes:
+                    write.apply(batch)
+                batch.commit()
+                break
+            except Exception as e:
+                if attempt == BULK_COMMIT_ATTEMPTS:
+                    raise
+                logger.warning(f"Batch of {len(writes)} writes failed (attempt {attempt}), retrying: {e}")
+                with self._lock:
+                    self.counts['retries'] += 1
+                time.sleep(0.5 * 2 ** (attempt - 1))
+        with self._lock:
+            self.counts['committed'] += len(writes)
+            self.counts['batches'] += 1
+            self.commit_latencies.append(time.perf_counter() - start)
+
+    def _track(self, last_id):
+        """Register a unit of work covering documents up to last_id; returns its sequence number"""
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._pending.append((seq, last_id))
+        return seq
+
+    def _finish(self, seq, future=None):
+        error = future.exception() if future is not None else None
+        with self._lock:
+            if error is not None:
+                # The watermark never passes a failed batch, so a resume redoes it
+                logger.error(f"Batch failed after {BULK_COMMIT_ATTEMPTS} attempts: {error}")
+                self.error = self.error or error
+                return
+            self._done.add(seq)
+            while self._pending and self._pending[0][0] in self._done:
+                done_seq, self._watermark = self._pending.popleft()
+                self._done.discard(done_seq)
+
+    def _submit(self, pool, writes, last_id):
+        seq = self._track(last_id)
+        if self.dry_run:
+            self._finish(seq)
+            return
+        self._slots.acquire()
+        future = pool.submit(self._commit, writes)
+        future.add_done_callback(lambda f: (self._slots.release(), self._finish(seq, f)))
+
+    def _save_checkpoint(self, resumed_from, finished=False):
+        if self.checkpoint is None or self.dry_run:
+            return
+        with self._lock:
+            state = {
+                'transform': self.name,
+                'collection': self.collection,
+                'last_doc_id': self._watermark if self._watermark is not None else resumed_from,
+                'finished': finished,
+                'counts': dict(self.counts),
+                'updated_at': datetime.utcnow().isoformat()
+            }
+        self.checkpoint.save(state)
+
+    def run(self, start_after=None):
+        """Process every document after start_after; returns the throughput report"""
+        self._watermark = start_after
+        started = time.perf_counter()
+        last_progress = started
+        batch, last_id = [], start_after
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bulk-commit') as pool, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix='bulk-read') as reader:
+            next_page = reader.submit(self._page, start_after)
+            while self.error is None:
+                docs = next_page.result()
+                fetched = len(docs)
+                if self.limit is not None:
+                    docs = docs[:max(0, self.limit - self.counts['scanned'])]
+                exhausted = fetched < self.page_size and len(docs) == fetched
+                if not docs:
+                    break
+                more = not exhausted and (self.limit is None or self.counts['scanned'] + len(docs) < self.limit)
+                if more:
+                    next_page = reader.submit(self._page, docs[-1].id)
+
+                changes = dict(self.transform(docs))
+                for doc in docs:
+                    writes = changes.get(doc.id)
+                    if writes:
+                        if len(batch) + len(writes) > MAX_BATCH_SIZE:
+                            self._submit(pool, batch, last_id)
+                            batch = []
+                        batch.extend(writes)
+                        self.counts['changed'] += 1
+                        self.counts['writes'] += len(writes)
+                    last_id = doc.id
+                self.counts['scanned'] += len(docs)
+                if not batch:
+                    # Nothing to write for the rest of the page: mark it covered in order
+                    self._finish(self._track(last_id))
+                self._save_checkpoint(start_after)
+
+                now = time.perf_counter()
+                if self.progress and now - last_progress >= self.progress_interval:
+                    self.progress(self.report(now - started))
+                    last_progress = now
+                if not more:
+                    break
+
+            if batch and self.error is None:
+                self._submit(pool, batch, last_id)
+
+        report = self.report(time.perf_counter() - started)
+        report['resumed_from'] = start_after
+        # A --limit run that stopped early isn't finished, so it can be resumed
+        self._save_checkpoint(start_after, finished=exhausted and self.error is None)
+        return report
+
+    def report(self, elapsed):
+        with self._lock:
+            latencies = sorted(self.commit_latencies)
+            counts = dict(self.counts)
+            last_doc_id = self._watermark
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000, 1) \
+                if latencies else 0.0
+
+        return dict(counts,
+                    transform=self.name,
+                    dry_run=self.dry_run,
+                    elapsed_s=round(elapsed, 2),
+                    docs_per_sec=round(counts['scanned'] / elapsed, 1) if elapsed else 0.0,
+                    writes_per_sec=round(counts['committed'] / elapsed, 1) if elapsed else 0.0,
+                    commit_p50_ms=percentile(50),
+                    commit_p95_ms=percentile(95),
+                    last_doc_id=last_doc_id,
+                    error=str(self.error) if self.error else None)
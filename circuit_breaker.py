@@ -0,0 +1,142 @@
+"""
+Circuit breaker for upstream HTTP dependencies
+
+Tracks the outcome of the last `window_size` calls. When enough of them
+failed, or were slower than `slow_call_duration`, the breaker opens and
+calls are rejected immediately with CircuitOpenError instead of tying up
+a worker on a dependency that is down. After `open_duration` it lets a
+few trial calls through (half-open): if they all succeed it closes,
+otherwise it opens again.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+STATES = (CLOSED, HALF_OPEN, OPEN)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit '{name}' is open; retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Failure-rate and slow-call-rate circuit breaker over a sliding window of calls"""
+
+    def __init__(self, name, failure_rate_threshold=0.5, slow_call_duration=5.0, slow_call_rate_threshold=0.8,
+                 window_size=20, minimum_calls=10, open_duration=30.0, half_open_calls=3):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self._lock = threading.Lock()
+        self._window = deque(maxlen=window_size)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        # Bumped on every transition so outcomes of calls admitted in an
+        # earlier state don't count as half-open trials
+        self._generation = 0
+        self._trials_started = 0
+        self._trials_succeeded = 0
+        self.calls = {'success': 0, 'failure': 0, 'slow': 0, 'rejected': 0}
+        self.transitions = {}
+
+    def _transition(self, state):
+        previous, self._state = self._state, state
+        self._generation += 1
+        self._window.clear()
+        self._trials_started = self._trials_succeeded = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        key = (previous, state)
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        log = logger.info if state == CLOSED else logger.warning
+        log("Circuit breaker state change", extra={'breaker': self.name, 'from': previous, 'to': state})
+
+    def _refresh(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_duration:
+            self._transition(HALF_OPEN)
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def acquire(self):
+        """Admit a call or raise CircuitOpenError; returns a permit for record()"""
+        with self._lock:
+            self._refresh()
+            if self._state == CLOSED:
+                return self._generation
+            if self._state == HALF_OPEN and self._trials_started < self.half_open_calls:
+                self._trials_started += 1
+                return self._generation
+            self.calls['rejected'] += 1
+            if self._state == OPEN:
+                retry_after = self.open_duration - (time.monotonic() - self._opened_at)
+            else:
+                retry_after = 1.0
+            raise CircuitOpenError(self.name, max(retry_after, 1.0))
+
+    def record(self, permit, success, duration):
+        """Report the outcome of a call admitted by acquire()"""
+        slow = success and duration >= self.slow_call_duration
+        with self._lock:
+            self.calls['slow' if slow else 'success' if success else 'failure'] += 1
+            if permit != self._generation:
+                return
+            if self._state == HALF_OPEN:
+                if not success or slow:
+                    self._transition(OPEN)
+                else:
+                    self._trials_succeeded += 1
+                    if self._trials_succeeded >= self.half_open_calls:
+                        self._transition(CLOSED)
+                return
+            if self._state != CLOSED:
+                return
+            self._window.append((success, slow))
+            if len(self._window) < self.minimum_calls:
+                return
+            failures = sum(1 for ok, _ in self._window if not ok)
+            slow_calls = sum(1 for _, was_slow in self._window if was_slow)
+            if (failures / len(self._window) >= self.failure_rate_threshold
+                    or slow_calls / len(self._window) >= self.slow_call_rate_threshold):
+                self._transition(OPEN)
+
+    def call(self, fn, *args, is_failure=None, **kwargs):
+        """Run fn through the breaker; exceptions and is_failure(result) count as failures"""
+        permit = self.acquire()
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record(permit, False, time.monotonic() - start)
+            raise
+        self.record(permit, not (is_failure and is_failure(result)), time.monotonic() - start)
+        return result
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            return {
+                'state': self._state,
+                'calls': dict(self.calls),
+                'transitions': {f"{a}->{b}": count for (a, b), count in self.transitions.items()}
+            }
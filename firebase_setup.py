@@ -0,0 +1,102 @@
+"""
+Firebase Admin initialization
+
+init_firebase() does the expensive, fork-safe part: importing the SDK,
+parsing FIREBASE_SERVICE_ACCOUNT and initializing the default app. When
+gunicorn runs with --preload this happens once in the master and workers
+inherit it copy-on-write. The gRPC Firestore client is not fork-safe, so
+get_db() creates it lazily in each worker process after the fork.
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+firebase_initialized = False
+firebase_cred = None
+
+# Seconds spent in each startup stage, reported on /health
+STARTUP_TIMINGS = {}
+
+_db = None
+_db_pid = None
+_db_lock = threading.Lock()
+
+
+def init_firebase():
+    """Import the SDK and initialize the default Firebase app once"""
+    global firebase_initialized, firebase_cred
+    if firebase_initialized:
+        return True
+
+    try:
+        start = time.perf_counter()
+        import firebase_admin
+        from firebase_admin import credentials, auth, firestore  # noqa: F401 (warm imports for workers)
+        STARTUP_TIMINGS['import_s'] = round(time.perf_counter() - start, 4)
+
+        start = time.perf_counter()
+        if not firebase_admin._apps:
+            # For production, use environment variable for Firebase config
+            if os.environ.get('FIREBASE_SERVICE_ACCOUNT'):
+                # Parse JSON from environment variable
+                firebase_config = json.loads(os.environ['FIREBASE_SERVICE_ACCOUNT'])
+                cred = credentials.Certificate(firebase_config)
+            else:
+                # Fallback to file (for local development)
+                cred = credentials.Certificate('firebase-service-account.json')
+            STARTUP_TIMINGS['credential_parse_s'] = round(time.perf_counter() - start, 4)
+
+            start = time.perf_counter()
+            firebase_admin.initialize_app(cred)
+            STARTUP_TIMINGS['app_init_s'] = round(time.perf_counter() - start, 4)
+            firebase_cred = cred
+        else:
+            firebase_cred = firebase_admin.get_app().credential
+
+        STARTUP_TIMINGS['init_pid'] = os.getpid()
+        firebase_initialized = True
+        logger.info(f"Firebase initialized: {STARTUP_TIMINGS}")
+    except ImportError:
+        print("Firebase Admin SDK not installed. Install with: pip install firebase-admin")
+        firebase_initialized = False
+    except Exception as e:
+        print(f"Firebase initialization failed: {e}")
+        firebase_initialized = False
+
+    return firebase_initialized
+
+
+def get_db():
+    """Return this process's Firestore client, creating it on first use"""
+    global _db, _db_pid
+    pid = os.getpid()
+    if _db is None or _db_pid != pid:
+        with _db_lock:
+            if _db is None or _db_pid != pid:
+                import firebase_admin
+                from google.cloud import firestore
+
+                # Built directly rather than via firebase_admin.firestore.client(),
+                # which caches on the app and would hand a forked worker the
+                # parent's gRPC channel
+                start = time.perf_counter()
+                app = firebase_admin.get_app()
+                _db = firestore.Client(credentials=app.credential.get_credential(),
+                                       project=app.project_id)
+                _db_pid = pid
+                STARTUP_TIMINGS['client_create_s'] = round(time.perf_counter() - start, 4)
+                STARTUP_TIMINGS['client_pid'] = pid
+                logger.info(f"Created Firestore client in process {pid} "
+                            f"in {STARTUP_TIMINGS['client_create_s']}s")
+    return _db
+
+
+def startup_report():
+    """Startup timings for this process (master timings are inherited)"""
+    init_pid = STARTUP_TIMINGS.get('init_pid')
+    return dict(STARTUP_TIMINGS, pid=os.getpid(), preloaded=init_pid is not None and init_pid != os.getpid())
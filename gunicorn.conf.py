@@ -0,0 +1,70 @@
+"""
+Gunicorn settings, sized from the container (see server_sizing.py)
+
+    gunicorn -c gunicorn.conf.py app:app              # SERVING_MODE=sync (gthread workers)
+    SERVING_MODE=async gunicorn -c gunicorn.conf.py asgi_app:app
+
+Gunicorn also picks this file up by itself when started from this directory.
+"""
+
+import os
+import sys
+import logging
+
+import server_sizing
+
+_plan = server_sizing.plan()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+worker_class = _plan['worker_class']
+workers = _plan['workers']
+threads = _plan['threads']
+timeout = _plan['timeout']
+graceful_timeout = _plan['graceful_timeout']
+keepalive = _plan['keepalive']
+# Recycle workers to bound memory growth; the jitter keeps them from restarting together
+max_requests = _plan['max_requests']
+max_requests_jitter = _plan['max_requests_jitter']
+# Parse the Firebase credentials once in the master (see firebase_setup.py)
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+# Worker heartbeats on tmpfs: a slow container filesystem must not look like a hung worker
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+def _app_module():
+    """The preloaded app module (app.py), or None"""
+    return sys.modules.get('app')
+
+
+def on_starting(server):
+    # Counters from a previous run of this container must not be summed into this one
+    from metrics import store
+    store.clear()
+    server.log.info(f"Sizing: {_plan}")
+
+
+def post_worker_init(worker):
+    # Probe dependencies right away so /ready is accurate before the first request
+    app_module = _app_module()
+    if app_module is not None and hasattr(app_module, 'dependency_prober'):
+        app_module.dependency_prober.ensure_running()
+
+
+def worker_exit(server, worker):
+    # Flush the per-worker state a recycled worker would otherwise lose
+    app_module = _app_module()
+    if app_module is None:
+        return
+    for name, flush in (('write_behind', 'stop'), ('login_analytics', 'write'), ('traffic_recorder', 'flush')):
+        component = getattr(app_module, name, None)
+        if component:
+            try:
+                getattr(component, flush)()
+            except Exception as e:
+                logging.getLogger(__name__).error(f"{name}.{flush}() failed on worker exit: {e}")
+    from metrics import store
+    try:
+        store.retire()
+    except OSError as e:
+        server.log.warning(f"Could not fold the final metrics snapshot: {e}")
@@ -0,0 +1,211 @@
+"""
+Non-blocking, structured, sampled logging
+
+Request threads only put LogRecords on a bounded queue; a listener thread
+redacts, formats them as compact JSON and writes them to stdout. INFO and
+DEBUG records are sampled per request (a request's records are kept or
+dropped together) at LOG_SAMPLE_RATE; warnings and errors are always
+kept. The per-request decision lives in a context variable, so it follows
+a request through the Flask hooks or the ASGI app's tasks and executor
+calls alike. Tokens and secrets are redacted from messages and extra fields.
+"""
+
+import os
+import re
+import sys
+import json
+import queue
+import random
+import logging
+import logging.handlers
+import threading
+import contextvars
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+REDACTED = '[REDACTED]'
+
+# Extra fields whose values are never logged
+SENSITIVE_KEYS = frozenset([
+    'token', 'access_token', 'custom_token', 'client_secret', 'secret',
+    'password', 'authorization', 'private_key', 'code', 'state'
+])
+
+_SENSITIVE_PATTERNS = [
+    # JWTs (Firebase custom tokens, ID tokens)
+    (re.compile(r'eyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+'), REDACTED),
+    # key=value in URLs and form bodies
+    (re.compile(r'((?:token|access_token|client_secret|code|state)=)[^&\s\'"]+', re.I), r'\1' + REDACTED),
+    # 'key': 'value' in dict reprs and JSON
+    (re.compile(r'''(['"](?:token|access_token|client_secret|private_key)['"]\s*:\s*['"])[^'"]*''', re.I),
+     r'\1' + REDACTED),
+    (re.compile(r'(Bearer\s+)\S+', re.I), r'\1' + REDACTED),
+]
+
+# LogRecord attributes that are not user-supplied extra fields
+_RESERVED_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def redact(text):
+    """Mask tokens and secrets in a string"""
+    for pattern, replacement in _SENSITIVE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _redact_value(key, value):
+    if key.lower() in SENSITIVE_KEYS:
+        return REDACTED
+    if isinstance(value, str):
+        return redact(value)
+    if isinstance(value, dict):
+        return {k: _redact_value(str(k), v) for k, v in value.items()}
+    return value
+
+
+def extra_fields(record):
+    """User-supplied `extra=` fields of a record"""
+    return {key: value for key, value in record.__dict__.items() if key not in _RESERVED_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """One compact JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': redact(record.getMessage()),
+        }
+        for key, value in extra_fields(record).items():
+            entry[key] = _redact_value(key, value)
+        if record.exc_text:
+            entry['exc'] = redact(record.exc_text)
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+
+class RedactingTextFormatter(logging.Formatter):
+    """Plain-text format for local development, still redacted"""
+
+    def format(self, record):
+        return redact(super().format(record))
+
+
+# The current request's sampling draw in [0, 1); None outside a request
+_sample_draw = contextvars.ContextVar('log_sample_draw', default=None)
+
+
+def start_request_sampling():
+    """Draw the sampling decision for the request starting in this context
+
+    Returns a token for end_request_sampling().
+    """
+    return _sample_draw.set(random.random())
+
+
+def end_request_sampling(token):
+    _sample_draw.reset(token)
+
+
+class RequestSamplingFilter(logging.Filter):
+    """Drop a sampled-out request's INFO/DEBUG records; keep all warnings and errors"""
+
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        draw = _sample_draw.get()
+        # Outside a request (startup, background threads) everything is kept
+        return draw is None or draw < self.rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller and restarts its listener after fork"""
+
+    def __init__(self, target_handler, maxsize=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.target_handler = target_handler
+        self.dropped = 0
+        self._listener = None
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._lock:
+            if self._listener_pid == pid:
+                return
+            if self._listener_pid is not None:
+                # Forked: the parent's listener thread did not survive
+                self.queue = queue.Queue(self.queue.maxsize)
+            self._listener = logging.handlers.QueueListener(self.queue, self.target_handler,
+                                                            respect_handler_level=True)
+            self._listener.start()
+            self._listener_pid = pid
+
+    def prepare(self, record):
+        # Only resolve what can't wait: the message arguments and the traceback.
+        # Redaction and JSON formatting happen on the listener thread.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def stop(self):
+        """Flush queued records (called at exit)"""
+        if self._listener is not None and self._listener_pid == os.getpid():
+            self._listener.stop()
+            self._listener_pid = None
+
+
+_queue_handler = None
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, sample_rate=LOG_SAMPLE_RATE, stream=None):
+    """Route all logging through the queue pipeline; returns the queue handler"""
+    global _queue_handler
+    import atexit
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(RedactingTextFormatter('%(levelname)s:%(name)s:%(message)s'))
+
+    handler = NonBlockingQueueHandler(output)
+    handler.addFilter(RequestSamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    if _queue_handler is not None:
+        _queue_handler.stop()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    if _queue_handler is None:
+        atexit.register(lambda: _queue_handler and _queue_handler.stop())
+    _queue_handler = handler
+    return handler
@@ -0,0 +1,372 @@
+"""
+In-process login analytics: counts and approximate unique users
+
+complete_login() records every successful login here: one hash of the
+UPI and a few counter and register updates under a lock, a few
+microseconds. Each worker keeps rolling buckets:
+
+  per minute (last ANALYTICS_MINUTES)  logins, new vs. returning and
+                                       unique users, by is_student
+  per day, UTC (last ANALYTICS_DAYS)   the same, also by department
+
+Unique users are HyperLogLog sketches of 2**ANALYTICS_HLL_PRECISION
+one-byte registers (2048 by default: ~2.3% standard error). Sketches
+merge losslessly across buckets and workers, so "unique users in the last
+hour" is exact up to that error. Memory is bounded: departments beyond
+ANALYTICS_MAX_DEPARTMENTS are counted as one, so a worker holds at most
+3 * ANALYTICS_MINUTES + ANALYTICS_DAYS * (ANALYTICS_MAX_DEPARTMENTS + 4)
+sketches (~2 MB with the defaults).
+
+Like the metrics snapshots, each worker writes its state to
+ANALYTICS_DIR every ANALYTICS_FLUSH_INTERVAL seconds (and at exit), and
+/admin/analytics merges every worker's file. Files of exited workers are
+kept until their last day ages out, so recycled workers' logins still
+count. No Firestore reads are involved, and no UPI is stored.
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import zlib
+import atexit
+import base64
+import hashlib
+import tempfile
+import threading
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_ENABLED = os.environ.get('ANALYTICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ANALYTICS_DIR = os.environ.get('ANALYTICS_DIR', os.path.join(tempfile.gettempdir(), 'conni-analytics'))
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 10))
+ANALYTICS_MINUTES = int(os.environ.get('ANALYTICS_MINUTES', 120))
+ANALYTICS_DAYS = int(os.environ.get('ANALYTICS_DAYS', 7))
+ANALYTICS_HLL_PRECISION = int(os.environ.get('ANALYTICS_HLL_PRECISION', 11))
+ANALYTICS_MAX_DEPARTMENTS = int(os.environ.get('ANALYTICS_MAX_DEPARTMENTS', 100))
+
+# Departments past ANALYTICS_MAX_DEPARTMENTS are counted under this name
+OTHER_DEPARTMENTS = 'Other departments'
+KINDS = ('new', 'returning')
+
+_INVERSE_POWERS = [2.0 ** -r for r in range(66)]
+
+
+def hll_position(value, precision):
+    """(register index, rank) of a value in a sketch of 2**precision registers"""
+    h = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+    rest = 64 - precision
+    return h >> rest, rest - (h & ((1 << rest) - 1)).bit_length() + 1
+
+
+class HyperLogLog:
+    """Approximate distinct count in 2**precision one-byte registers"""
+
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision, registers=None):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << precision)
+
+    def add(self, value):
+        self.update(*hll_position(value, self.precision))
+
+    def update(self, index, rank):
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Fold another sketch of the same precision into this one (a union)"""
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(_INVERSE_POWERS[r] for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_json(self):
+        # Mostly-empty sketches (a quiet department) compress to a few bytes
+        return base64.b64encode(zlib.compress(bytes(self.registers), 1)).decode('ascii')
+
+    @classmethod
+    def from_json(cls, precision, data):
+        return cls(precision, zlib.decompress(base64.b64decode(data)))
+
+
+class Bucket:
+    """Login counts and unique-user sketches for one minute or day, by group
+
+    Groups are 'all', 'is_student:true|false' and (per day)
+    'department:<name>'.
+    """
+
+    __slots__ = ('precision', 'counts', 'uniques', '_json')
+
+    def __init__(self, precision):
+        self.precision = precision
+        self.counts = {}
+        self.uniques = {}
+        # Serialized form, reused until the bucket changes
+        self._json = None
+
+    def add(self, groups, kind, index, rank):
+        for group in groups:
+            counts = self.counts.get(group)
+            if counts is None:
+                counts = self.counts[group] = dict.fromkeys(KINDS, 0)
+                self.uniques[group] = HyperLogLog(self.precision)
+            counts[kind] += 1
+            self.uniques[group].update(index, rank)
+        self._json = None
+
+    def merge(self, other):
+        for group, counts in other.counts.items():
+            mine = self.counts.get(group)
+            if mine is None:
+                self.counts[group] = dict(counts)
+                self.uniques[group] = HyperLogLog(self.precision, other.uniques[group].registers)
+                continue
+            for kind in KINDS:
+                mine[kind] += counts[kind]
+            self.uniques[group].merge(other.uniques[group])
+
+    def group_report(self, group):
+        counts = self.counts.get(group, dict.fromkeys(KINDS, 0))
+        sketch = self.uniques.get(group)
+        return {
+            'logins': sum(counts.values()),
+            'new': counts['new'],
+            'returning': counts['returning'],
+            'unique_users': sketch.count() if sketch else 0
+        }
+
+    def to_json(self):
+        if self._json is None:
+            self._json = {'counts': {group: dict(counts) for group, counts in self.counts.items()},
+                          'uniques': {group: sketch.to_json() for group, sketch in self.uniques.items()}}
+        return self._json
+
+    @classmethod
+    def from_json(cls, precision, data):
+        bucket = cls(precision)
+        bucket.counts = {group: dict(counts) for group, counts in data['counts'].items()}
+        bucket.uniques = {group: HyperLogLog.from_json(precision, sketch)
+                          for group, sketch in data['uniques'].items()}
+        return bucket
+
+
+def _prune(buckets, oldest):
+    for key in [key for key in buckets if key < oldest]:
+        del buckets[key]
+
+
+class LoginAnalytics:
+    """This worker's rolling login buckets, shared with the other workers through files"""
+
+    def __init__(self, directory=ANALYTICS_DIR, interval=ANALYTICS_FLUSH_INTERVAL, minutes=ANALYTICS_MINUTES,
+                 days=ANALYTICS_DAYS, precision=ANALYTICS_HLL_PRECISION, max_departments=ANALYTICS_MAX_DEPARTMENTS):
+        self.directory = directory
+        self.interval = interval
+        self.minutes = minutes
+        self.days = days
+        self.precision = precision
+        self.max_departments = max_departments
+        self.recorded = 0
+        # Minute and day number since the epoch (UTC) -> Bucket
+        self._minutes = {}
+        self._days = {}
+        self._departments = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+        self._file = None
+
+    def record(self, upi, department, is_student, new_user, now=None):
+        """Count one successful login"""
+        index, rank = hll_position(upi, self.precision)
+        kind = 'new' if new_user else 'returning'
+        student = 'is_student:true' if is_student else 'is_student:false'
+        now = time.time() if now is None else now
+        minute, day = int(now // 60), int(now // 86400)
+        self._ensure_writer()
+        with self._lock:
+            if department not in self._departments:
+                if len(self._departments) < self.max_departments:
+                    self._departments.add(department)
+                else:
+                    department = OTHER_DEPARTMENTS
+            bucket = self._minutes.get(minute)
+            if bucket is None:
+                bucket = self._minutes[minute] = Bucket(self.precision)
+                _prune(self._minutes, minute - self.minutes + 1)
+            bucket.add(('all', student), kind, index, rank)
+            bucket = self._days.get(day)
+            if bucket is None:
+                bucket = self._days[day] = Bucket(self.precision)
+                _prune(self._days, day - self.days + 1)
+            bucket.add(('all', student, f'department:{department}'), kind, index, rank)
+            self.recorded += 1
+
+    def _ensure_writer(self):
+        # Started lazily so each gunicorn worker gets its own writer thread and file
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            if self._thread_pid is not None:
+                # Forked: the parent's logins are in the parent's file
+                self._minutes, self._days, self.recorded = {}, {}, 0
+            # pid plus a random suffix: a recycled pid must not overwrite a dead worker's file
+            self._file = os.path.join(self.directory, f"worker-{pid}-{uuid.uuid4().hex[:8]}.json")
+            self._thread = threading.Thread(target=self._run, name='login-analytics', daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except Exception as e:
+                logger.warning(f"Failed to write login analytics: {e}")
+
+    def snapshot(self):
+        """JSON-serializable copy of this worker's buckets"""
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'time': time.time(),
+                'precision': self.precision,
+                'minutes': {str(key): bucket.to_json() for key, bucket in self._minutes.items()},
+                'days': {str(key): bucket.to_json() for key, bucket in self._days.items()}
+            }
+
+    def write(self):
+        """Replace this worker's file with its current buckets"""
+        if self._file is None:
+            return None
+        snapshot = self.snapshot()
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self._file}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp, self._file)
+        return snapshot
+
+    def collect(self, now=None):
+        """(minutes, days, workers): every worker's buckets merged, oldest pruned"""
+        now = time.time() if now is None else now
+        own = self.write()
+        snapshots = [own or self.snapshot()]
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if not name.startswith('worker-') or not name.endswith('.json') or path == self._file:
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if snapshot.get('precision') != self.precision:
+                continue
+            if snapshot['time'] < now - self.days * 86400:
+                # Nothing in it is still reported
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            snapshots.append(snapshot)
+
+        minutes, days = {}, {}
+        for snapshot in snapshots:
+            for merged, key, oldest in ((minutes, 'minutes', int(now // 60) - self.minutes + 1),
+                                        (days, 'days', int(now // 86400) - self.days + 1)):
+                for number, data in snapshot[key].items():
+                    number = int(number)
+                    if number < oldest:
+                        continue
+                    bucket = Bucket.from_json(self.precision, data)
+                    if number in merged:
+                        merged[number].merge(bucket)
+                    else:
+                        merged[number] = bucket
+        return minutes, days, len(snapshots)
+
+    def report(self, window=60, now=None):
+        """Dashboard JSON: the last `window` minutes per minute and in total, and each day"""
+        now = time.time() if now is None else now
+        minutes, days, workers = self.collect(now)
+        first = int(now // 60) - window + 1
+        recent = Bucket(self.precision)
+        per_minute = []
+        for number in sorted(key for key in minutes if key >= first):
+            bucket = minutes[number]
+            recent.merge(bucket)
+            per_minute.append(dict(bucket.group_report('all'), minute=_iso(number * 60)))
+
+        def breakdown(bucket, prefix):
+            return {group[len(prefix):]: bucket.group_report(group)
+                    for group in sorted(bucket.counts) if group.startswith(prefix)}
+
+        return {
+            'generated_at': _iso(now),
+            'workers': workers,
+            'unique_users_error': round(1.04 / math.sqrt(1 << self.precision), 4),
+            'window': dict(recent.group_report('all'), minutes=window,
+                           by_is_student=breakdown(recent, 'is_student:')),
+            'minutes': per_minute,
+            'days': [dict(bucket.group_report('all'),
+                          day=datetime.fromtimestamp(number * 86400, timezone.utc).strftime('%Y-%m-%d'),
+                          by_is_student=breakdown(bucket, 'is_student:'),
+                          by_department=breakdown(bucket, 'department:'))
+                     for number, bucket in sorted(days.items(), reverse=True)]
+        }
+
+    def stats(self):
+        with self._lock:
+            sketches = sum(len(bucket.uniques) for bucket in (*self._minutes.values(), *self._days.values()))
+            return {
+                'enabled': True,
+                'recorded': self.recorded,
+                'minute_buckets': len(self._minutes),
+                'day_buckets': len(self._days),
+                'departments': len(self._departments),
+                'sketches': sketches,
+                'sketch_bytes': sketches << self.precision
+            }
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+_analytics = None
+_analytics_lock = threading.Lock()
+
+
+def get_login_analytics():
+    """Return the process-wide login analytics, or None when ANALYTICS_ENABLED is false"""
+    global _analytics
+    if not ANALYTICS_ENABLED:
+        return None
+    if _analytics is None:
+        with _analytics_lock:
+            if _analytics is None:
+                _analytics = LoginAnalytics()
+                # Keep the last partial interval when a worker exits cleanly
+                atexit.register(_analytics.write)
+    return _analytics
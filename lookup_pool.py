@@ -0,0 +1,62 @@
+"""
+Shared thread pool for the independent Google calls made by /callback
+
+The Firestore email-index read and the Firebase Auth lookup by email hit
+different backends and don't depend on each other, so /callback issues
+them together; custom-token minting runs alongside the Firestore write
+once the UID is known. The pool is bounded and created lazily per
+process, so a pool created before gunicorn forks is never shared.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from profiler import get_profiler
+
+LOOKUP_POOL_SIZE = int(os.environ.get('LOOKUP_POOL_SIZE', 32))
+LOOKUP_FANOUT_ENABLED = os.environ.get('LOOKUP_FANOUT_ENABLED', 'true').lower() == 'true'
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_lookup_pool():
+    """Return this process's lookup thread pool"""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ThreadPoolExecutor(max_workers=LOOKUP_POOL_SIZE, thread_name_prefix='lookup')
+                _pool_pid = pid
+    return _pool
+
+
+class Deferred:
+    """Future-like call made inline on the first result() (fan-out disabled)
+
+    Like the old sequential code, a call whose result is never needed is
+    never made.
+    """
+
+    def __init__(self, fn, *args):
+        self._call = (fn, args)
+        self._result = None
+
+    def result(self):
+        if self._call is not None:
+            fn, args = self._call
+            self._call = None
+            self._result = fn(*args)
+        return self._result
+
+
+def submit(fn, *args):
+    """Run fn on the lookup pool, or lazily inline when fan-out is disabled"""
+    if not LOOKUP_FANOUT_ENABLED:
+        return Deferred(fn, *args)
+    if get_profiler().active:
+        fn = get_profiler().task(fn)
+    return get_lookup_pool().submit(fn, *args)
@@ -0,0 +1,404 @@
+"""
+Per-stage latency metrics and Prometheus exposition
+
+callback() times each stage with StageTimer (two perf_counter calls per
+stage). The timings feed histograms and outcome counters held in an
+in-process Registry. Each gunicorn worker periodically writes a snapshot
+of its registry to METRICS_DIR, and /metrics merges every worker's
+snapshot: counters and histograms are summed, and gauges are reported per
+live worker. The counters and histograms of exited (e.g. recycled) workers
+are folded into one aggregate file and their snapshots removed, so the
+directory holds one file per live worker plus the aggregate. The gunicorn
+master clears it when it starts (gunicorn.conf.py).
+"""
+
+import os
+import json
+import uuid
+import fcntl
+import time
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'conni-metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# Seconds; covers a cache hit (sub-ms) up to the 30 s upstream read timeout
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(**labels):
+    """Prometheus label set, e.g. stage="token_exchange" """
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Registry:
+    """Counters, gauges and histograms for one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.meta = {}
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def counter(self, name, help_text):
+        self.meta[name] = ('counter', help_text, None)
+        self._counters.setdefault(name, {})
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.meta[name] = ('histogram', help_text, tuple(buckets))
+        self._histograms.setdefault(name, {})
+
+    def collector(self, name, kind, help_text, fn):
+        """Register a counter/gauge whose value is read from fn() at snapshot time
+
+        fn returns a number or a {label_string: number} dict.
+        """
+        self.meta[name] = (kind, help_text, None)
+        self._collectors.append((name, kind, fn))
+
+    def inc(self, name, labels='', amount=1):
+        with self._lock:
+            series = self._counters[name]
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, value, labels=''):
+        buckets = self.meta[name][2]
+        with self._lock:
+            series = self._histograms[name]
+            state = series.get(labels)
+            if state is None:
+                state = series[labels] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def snapshot(self):
+        """JSON-serializable copy of this process's metrics"""
+        with self._lock:
+            snapshot = {
+                'pid': os.getpid(),
+                'time': time.time(),
+                'counters': {name: dict(series) for name, series in self._counters.items()},
+                'gauges': {},
+                'histograms': {name: {labels: {'buckets': list(s['buckets']), 'sum': s['sum'], 'count': s['count']}
+                                      for labels, s in series.items()}
+                               for name, series in self._histograms.items()}
+            }
+        for name, kind, fn in self._collectors:
+            try:
+                value = fn()
+            except Exception as e:
+                logger.warning(f"Metrics collector {name} failed: {e}")
+                continue
+            series = value if isinstance(value, dict) else {'': value}
+            snapshot['counters' if kind == 'counter' else 'gauges'][name] = series
+        return snapshot
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def merge_snapshots(snapshots):
+    """Sum counters and histograms; keep gauges per live worker"""
+    merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    for snapshot in snapshots:
+        for name, series in snapshot.get('counters', {}).items():
+            target = merged['counters'].setdefault(name, {})
+            for labels, value in series.items():
+                target[labels] = target.get(labels, 0) + value
+        if 'pid' in snapshot and _pid_alive(snapshot['pid']):
+            worker = format_labels(pid=snapshot['pid'])
+            for name, series in snapshot.get('gauges', {}).items():
+                target = merged['gauges'].setdefault(name, {})
+                for labels, value in series.items():
+                    target[f"{labels},{worker}" if labels else worker] = value
+        for name, series in snapshot.get('histograms', {}).items():
+            target = merged['histograms'].setdefault(name, {})
+            for labels, state in series.items():
+                existing = target.get(labels)
+                if existing is None:
+                    target[labels] = {'buckets': list(state['buckets']), 'sum': state['sum'], 'count': state['count']}
+                else:
+                    existing['buckets'] = [a + b for a, b in zip(existing['buckets'], state['buckets'])]
+                    existing['sum'] += state['sum']
+                    existing['count'] += state['count']
+    return merged
+
+
+def render(merged, meta):
+    """Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for name in sorted(meta):
+        kind, help_text, buckets = meta[name]
+        if kind == 'histogram':
+            series = merged['histograms'].get(name, {})
+        else:
+            series = merged['counters' if kind == 'counter' else 'gauges'].get(name, {})
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels in sorted(series):
+            if kind != 'histogram':
+                lines.append(f"{name}{{{labels}}} {series[labels]}" if labels else f"{name} {series[labels]}")
+                continue
+            state = series[labels]
+            prefix = f"{labels}," if labels else ''
+            cumulative = 0
+            for bound, count in zip(buckets, state['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {state["count"]}')
+            lines.append(f"{name}_sum{{{labels}}} {state['sum']}" if labels else f"{name}_sum {state['sum']}")
+            lines.append(f"{name}_count{{{labels}}} {state['count']}" if labels else f"{name}_count {state['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+class MultiprocessStore:
+    """Per-worker snapshot files in a directory shared by all workers"""
+
+    AGGREGATE = 'aggregate.json'
+
+    def __init__(self, registry, directory=METRICS_DIR, interval=METRICS_FLUSH_INTERVAL):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._file = None
+        self._file_pid = None
+        self._thread = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    def _path(self):
+        """This process's snapshot file"""
+        pid = os.getpid()
+        with self._lock:
+            if self._file_pid != pid:
+                # pid plus a random suffix: a recycled pid must not overwrite a dead worker's file
+                self._file = os.path.join(self.directory, f"worker-{pid}-{uuid.uuid4().hex[:8]}.json")
+                self._file_pid = pid
+            return self._file
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock on the directory, between processes and threads"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write(self):
+        snapshot = self.registry.snapshot()
+        path = self._path()
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+        return snapshot
+
+    def ensure_writer(self):
+        """Start this process's background snapshot writer (once per pid)"""
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except Exception as e:
+                logger.warning(f"Failed to write metrics snapshot: {e}")
+
+    def _fold(self, own=False):
+        """Fold exited workers' snapshots (and this one's if own) into the aggregate; hold _locked()
+
+        Returns the aggregate. Folded file names are recorded in it until the
+        files are gone, so a crash between writing it and removing them can't
+        count a worker twice.
+        """
+        aggregate_path = os.path.join(self.directory, self.AGGREGATE)
+        aggregate = self._load(aggregate_path) or {'counters': {}, 'histograms': {}, 'folded': []}
+        try:
+            names = set(os.listdir(self.directory))
+        except FileNotFoundError:
+            names = set()
+        folded = set(aggregate.get('folded', [])) & names
+        own_name = os.path.basename(self._file) if self._file_pid == os.getpid() else None
+        retiring, snapshots = [], [aggregate]
+        for name in names - folded:
+            if not name.startswith('worker-') or not name.endswith('.json'):
+                continue
+            if name == own_name:
+                if not own:
+                    continue
+            else:
+                try:
+                    pid = int(name[len('worker-'):].split('-', 1)[0].split('.', 1)[0])
+                except ValueError:
+                    continue
+                if _pid_alive(pid):
+                    continue
+            snapshot = self._load(os.path.join(self.directory, name))
+            if snapshot is not None:
+                snapshots.append(snapshot)
+            retiring.append(name)
+
+        if retiring:
+            merged = merge_snapshots(snapshots)
+            aggregate = {'time': time.time(), 'counters': merged['counters'], 'histograms': merged['histograms'],
+                         'folded': sorted(folded.union(retiring))}
+            tmp = f"{aggregate_path}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(aggregate, f)
+            os.replace(tmp, aggregate_path)
+        for name in folded.union(retiring):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+        return aggregate
+
+    def retire(self):
+        """Fold this worker's final counts into the aggregate (call as the worker exits)"""
+        self.write()
+        with self._locked():
+            self._fold(own=True)
+
+    def collect(self):
+        """Fresh snapshot for this worker plus the aggregate and the latest from all others"""
+        own = self.write()
+        own_name = os.path.basename(self._file)
+        with self._locked():
+            aggregate = self._fold()
+            snapshots = [own, aggregate]
+            skip = set(aggregate.get('folded', [])) | {own_name}
+            for name in os.listdir(self.directory):
+                if not name.startswith('worker-') or not name.endswith('.json') or name in skip:
+                    continue
+                snapshot = self._load(os.path.join(self.directory, name))
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+        return merge_snapshots(snapshots)
+
+    def fold(self):
+        """Fold the snapshots of exited workers into the aggregate"""
+        with self._locked():
+            self._fold()
+
+    def clear(self):
+        """Remove every snapshot and the aggregate
+
+        Call from the gunicorn master before workers start.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.startswith('worker-') and not name.startswith(self.AGGREGATE):
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+
+class StageTimer:
+    """Accumulates per-stage durations for one request"""
+
+    __slots__ = ('start', 'stages', 'outcome', 'current', 'cpu')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.outcome = None
+        # Stage running now, and per-stage thread CPU time while profiled (profiler.py)
+        self.current = None
+        self.cpu = None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        cpu_start = time.thread_time() if self.cpu is not None else None
+        outer, self.current = self.current, name
+        try:
+            yield
+        finally:
+            self.current = outer
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+            if cpu_start is not None:
+                self.cpu[name] = self.cpu.get(name, 0.0) + time.thread_time() - cpu_start
+
+    def server_timing(self, total=None):
+        """Server-Timing header value (durations in ms)"""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        if total is not None:
+            parts.append(f"total;dur={total * 1000:.1f}")
+        return ', '.join(parts)
+
+
+registry = Registry()
+store = MultiprocessStore(registry)
+
+registry.histogram('conni_http_request_duration_seconds', 'HTTP request latency by route')
+registry.counter('conni_http_requests_total', 'HTTP requests by route and status')
+registry.histogram('conni_callback_stage_seconds', 'Latency of each /callback stage')
+registry.counter('conni_callback_outcomes_total', 'Completed /callback requests by outcome')
+
+
+def record_request(route, status, duration, timer=None):
+    """Feed one finished request into the registry"""
+    registry.observe('conni_http_request_duration_seconds', duration, format_labels(route=route))
+    registry.inc('conni_http_requests_total', format_labels(route=route, status=status))
+    if timer is not None:
+        for name, seconds in timer.stages.items():
+            registry.observe('conni_callback_stage_seconds', seconds, format_labels(stage=name))
+        if timer.outcome:
+            registry.inc('conni_callback_outcomes_total', format_labels(outcome=timer.outcome))
+    store.ensure_writer()
+
+
+def render_metrics():
+    """Prometheus text for all workers"""
+    return render(store.collect(), registry.meta)
@@ -0,0 +1,117 @@
+"""
+Stateless, HMAC-signed OAuth `state` parameter
+
+The state carries its own nonce, issue time and expiry and is signed with
+a key shared by every replica, so /callback can verify it without a
+session or a shared store; the browser that finishes the flow does not
+need the cookie of the one that started it. A bounded in-process replay
+cache rejects a state seen a second time by the same worker (UCL
+authorization codes are single-use as well, so this is defense in depth
+rather than the only guard against replay across replicas).
+"""
+
+import os
+import hmac
+import time
+import base64
+import hashlib
+import secrets
+import threading
+
+from user_cache import InMemoryLRUBackend
+
+OAUTH_STATE_TTL = int(os.environ.get('OAUTH_STATE_TTL', 600))
+OAUTH_STATE_REPLAY_CACHE_SIZE = int(os.environ.get('OAUTH_STATE_REPLAY_CACHE_SIZE', 10000))
+
+_VERSION = 'v1'
+
+
+class InvalidState(Exception):
+    """The state parameter is missing, malformed, forged, expired or reused"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+class ReplayCache:
+    """Remembers consumed nonces for the state lifetime
+
+    Every nonce is kept for the same ttl from when it was used, which covers
+    the rest of its state's life and keeps the backend in expiry order, so
+    used nonces are purged as new ones arrive.
+    """
+
+    def __init__(self, ttl=OAUTH_STATE_TTL, backend=None):
+        self.ttl = ttl
+        self.backend = backend if backend is not None else InMemoryLRUBackend(OAUTH_STATE_REPLAY_CACHE_SIZE)
+        self._lock = threading.Lock()
+
+    def consume(self, nonce):
+        """Mark nonce as used; False if it was already used"""
+        with self._lock:
+            if self.backend.get(nonce) is not None:
+                return False
+            self.backend.set(nonce, True, max(self.ttl, 1))
+            return True
+
+
+class StateSigner:
+    """Issues and verifies `v1.<nonce>.<iat>.<exp>.<mac>` state tokens"""
+
+    def __init__(self, secret, ttl=OAUTH_STATE_TTL, replay_cache=None):
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        # Separate key so the state MAC can't be confused with other uses of SECRET_KEY
+        self._key = hmac.new(secret, b'conni-oauth-state', hashlib.sha256).digest()
+        self.ttl = ttl
+        self.replay_cache = replay_cache if replay_cache is not None else ReplayCache(ttl)
+
+    def _mac(self, message):
+        return _b64(hmac.new(self._key, message.encode('ascii'), hashlib.sha256).digest())
+
+    def issue(self):
+        """New state for an authorization redirect"""
+        issued_at = int(time.time())
+        message = f"{_VERSION}.{secrets.token_urlsafe(16)}.{issued_at}.{issued_at + self.ttl}"
+        return f"{message}.{self._mac(message)}"
+
+    def verify(self, state):
+        """Check signature, expiry and reuse; returns the nonce or raises InvalidState"""
+        if not state:
+            raise InvalidState('missing')
+        parts = state.split('.')
+        if len(parts) != 5 or parts[0] != _VERSION:
+            raise InvalidState('malformed')
+        message, mac = state.rsplit('.', 1)
+        if not hmac.compare_digest(mac, self._mac(message)):
+            raise InvalidState('bad_signature')
+        try:
+            issued_at, expires_at = int(parts[2]), int(parts[3])
+        except ValueError:
+            raise InvalidState('malformed')
+        now = time.time()
+        if now >= expires_at or issued_at > now + 60:
+            raise InvalidState('expired')
+        nonce = parts[1]
+        if not self.replay_cache.consume(nonce):
+            raise InvalidState('replayed')
+        return nonce
+
+
+_signer = None
+_signer_lock = threading.Lock()
+
+
+def get_state_signer(secret):
+    """Return the process-wide state signer"""
+    global _signer
+    if _signer is None:
+        with _signer_lock:
+            if _signer is None:
+                _signer = StateSigner(secret)
+    return _signer
@@ -0,0 +1,353 @@
+"""
+On-demand statistical profiler for one worker
+
+An admin request starts a session that samples the Python stack of the
+worker's threads (sys._current_frames()) every PROFILE_INTERVAL_MS for a
+number of seconds, either across all threads or only in a fraction of the
+requests that start during the session. Samples taken inside a request are
+rooted at its route and the StageTimer stage it was in, and each one ends
+in a [cpu] or [wait] frame. That comes from the thread's CPU clock: a thread
+that used at least half the wall time since its previous sample was on CPU.
+Profiled requests also read their thread's CPU clock around each stage,
+for exact CPU vs. wall time per stage; work they hand to the lookup pool
+is attributed to them as a stage named after the function. Nothing runs when no session is
+open: the request hooks check one attribute.
+
+Output is collapsed stacks (flamegraph.pl, speedscope, inferno), a
+speedscope JSON file, or a summary of CPU and wait time by stage and by
+component (requests, Firebase/gRPC, JWT signing, JSON, sockets, app code).
+Like any sampler on CPython, it can't see inside a C call that holds the
+GIL (an RSA sign, say); the per-stage CPU clock covers those.
+"""
+
+import os
+import re
+import json
+import sys
+import time
+import random
+import threading
+import logging
+from collections import Counter
+
+from metrics import StageTimer
+
+logger = logging.getLogger(__name__)
+
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60))
+
+FORMATS = ('collapsed', 'speedscope', 'summary')
+
+# Leaf functions that block, for platforms without per-thread CPU clocks
+WAIT_FUNCTIONS = {'wait', 'acquire', 'sleep', 'select', 'poll', 'recv', 'recv_into', 'readinto', 'read',
+                  'connect', 'accept', 'create_connection', 'get', 'join', 'result', '_worker'}
+
+# Module path prefixes -> component; a sample belongs to its innermost frame's
+# component, or to 'app' for the app's own modules
+COMPONENTS = (
+    (('jwt/', 'cryptography/', 'token_signer.py', 'google/auth/crypt/'), 'jwt_signing'),
+    (('google/', 'firebase_admin/', 'grpc/', 'proto/'), 'firebase'),
+    (('requests/', 'urllib3/', 'httpx/', 'httpcore/', 'ucl_client.py'), 'http_client'),
+    (('json/',), 'json'),
+    (('ssl.py', 'socket.py', 'selectors.py', 'http/client.py'), 'socket'),
+    (('threading.py', 'queue.py', 'concurrent/futures/'), 'threading')
+)
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+_PATH_ROOTS = sorted({p + os.sep for p in sys.path if p and os.path.isdir(p)}, key=len, reverse=True)
+
+
+def _short_path(filename):
+    """Path relative to the app or to the sys.path entry it was imported from"""
+    if filename.startswith(_APP_DIR):
+        return filename[len(_APP_DIR):]
+    for root in _PATH_ROOTS:
+        if filename.startswith(root):
+            return filename[len(root):]
+    return filename
+
+
+def _thread_kind(name):
+    """Thread name without its pool index, so pool threads merge"""
+    return re.sub(r'[-_ ]?\d+(_\d+)?$', '', name) or name
+
+
+class ProfileSession:
+    """Samples from one session, aggregated by stack"""
+
+    def __init__(self, seconds, interval, rate=None, idle=True):
+        self.seconds = seconds
+        self.interval = interval
+        self.rate = rate
+        self.idle = idle
+        self.stacks = Counter()
+        # (stage, component, kind) -> samples
+        self.breakdown = Counter()
+        self.samples = 0
+        self.ticks = 0
+        self.requests = 0
+        self.started = None
+        self.elapsed = 0.0
+        # stage -> [requests, wall seconds, CPU seconds] from the StageTimers
+        self.stage_clock = {}
+        self._labels = {}
+        self._locations = {}
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            path = _short_path(code.co_filename)
+            component = 'app' if code.co_filename.startswith(_APP_DIR) else None
+            for prefixes, name in COMPONENTS:
+                if path.startswith(prefixes) or path.endswith(prefixes):
+                    component = name
+                    break
+            label = self._labels[code] = (f"{code.co_name} ({path}:{code.co_firstlineno})", component)
+            self._locations[label[0]] = (path, code.co_firstlineno)
+        return label
+
+    def add(self, frame, root, stage, on_cpu):
+        """Record one sample: frame is the thread's innermost frame, root its synthetic parent frames"""
+        labels = []
+        component = None
+        while frame is not None:
+            label, frame_component = self._label(frame.f_code)
+            labels.append(label)
+            if component is None:
+                component = frame_component
+            frame = frame.f_back
+        if on_cpu is None:
+            on_cpu = bool(labels) and labels[0].split(' ', 1)[0] not in WAIT_FUNCTIONS
+        kind = 'cpu' if on_cpu else 'wait'
+        labels.reverse()
+        self.stacks[tuple(root) + tuple(labels) + (f"[{kind}]",)] += 1
+        self.breakdown[(stage or '-', component or 'other', kind)] += 1
+        self.samples += 1
+
+    def add_request(self, timer):
+        """Fold a finished request's per-stage wall and CPU time into the session"""
+        for stage, wall in timer.stages.items():
+            entry = self.stage_clock.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += wall
+            entry[2] += timer.cpu.get(stage, 0.0)
+
+    def collapsed(self):
+        """Brendan Gregg's collapsed stack format: frame;frame;frame count"""
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def speedscope(self, name='conni'):
+        """speedscope's file format: one sampled profile, weights in milliseconds"""
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, count in self.stacks.most_common():
+            ids = []
+            for label in stack:
+                if label not in index:
+                    index[label] = len(frames)
+                    frame = {'name': label}
+                    if label in self._locations:
+                        frame['file'], frame['line'] = self._locations[label]
+                    frames.append(frame)
+                ids.append(index[label])
+            samples.append(ids)
+            weights.append(round(count * self.interval * 1000, 3))
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'conni profiler',
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': round(sum(weights), 3),
+                'samples': samples,
+                'weights': weights
+            }]
+        }
+
+    def summary(self):
+        """CPU and wait milliseconds by stage, and by component within each stage"""
+        ms = self.interval * 1000
+        stages = {}
+        for (stage, component, kind), count in sorted(self.breakdown.items()):
+            entry = stages.setdefault(stage, {'cpu_ms': 0.0, 'wait_ms': 0.0, 'components': {}})
+            entry[f'{kind}_ms'] += count * ms
+            part = entry['components'].setdefault(component, {'cpu_ms': 0.0, 'wait_ms': 0.0})
+            part[f'{kind}_ms'] += count * ms
+        for entry in stages.values():
+            entry['cpu_ms'], entry['wait_ms'] = round(entry['cpu_ms'], 1), round(entry['wait_ms'], 1)
+            for part in entry['components'].values():
+                part['cpu_ms'], part['wait_ms'] = round(part['cpu_ms'], 1), round(part['wait_ms'], 1)
+        return {
+            'pid': os.getpid(),
+            'seconds': round(self.elapsed, 2),
+            'interval_ms': self.interval * 1000,
+            'mode': 'all_threads' if self.rate is None else 'requests',
+            'request_rate': self.rate,
+            'requests_profiled': self.requests,
+            'ticks': self.ticks,
+            'samples': self.samples,
+            'stages': stages,
+            # Exact per-stage totals: a long C call holding the GIL (an RSA sign)
+            # shows up here even when the sampler can't see inside it
+            'stage_clock': {stage: {'count': count, 'wall_ms': round(wall * 1000, 1), 'cpu_ms': round(cpu * 1000, 1)}
+                            for stage, (count, wall, cpu) in sorted(self.stage_clock.items())}
+        }
+
+    def render(self, fmt):
+        """(body, content type, headers) of the session in one of FORMATS"""
+        headers = {'Cache-Control': 'no-store'}
+        if fmt == 'collapsed':
+            return self.collapsed(), 'text/plain; charset=utf-8', headers
+        if fmt == 'speedscope':
+            headers['Content-Disposition'] = f'attachment; filename="conni-{os.getpid()}.speedscope.json"'
+            return json.dumps(self.speedscope(), separators=(',', ':')), 'application/json', headers
+        return json.dumps(self.summary(), indent=2), 'application/json', headers
+
+
+class Profiler:
+    """Runs one profiling session at a time in this worker"""
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS, max_seconds=PROFILE_MAX_SECONDS):
+        self.interval = interval_ms / 1000
+        self.max_seconds = max_seconds
+        # Read by the request hooks; None when no session is open
+        self.active = None
+        # thread ident -> (route, StageTimer or None) for requests in the session
+        self._requests = {}
+        self._lock = threading.Lock()
+        self._cpu = {}
+
+    def begin(self, route, timer=None):
+        """Request hook: tag this thread's samples with the request (call only when active)"""
+        session = self.active
+        if session is None or (session.rate is not None and random.random() >= session.rate):
+            return
+        if timer is not None:
+            # Makes the timer read the thread's CPU clock around each stage
+            timer.cpu = {}
+        self._requests[threading.get_ident()] = (route, timer, session)
+        session.requests += 1
+
+    def end(self):
+        """Request hook: the thread has finished its request"""
+        request = self._requests.pop(threading.get_ident(), None)
+        if request is not None and request[1] is not None:
+            request[2].add_request(request[1])
+
+    def task(self, fn):
+        """Wrap fn, about to go to a pool thread, so its samples and CPU time count toward this request
+
+        The work shows up as a stage named after the function, e.g.
+        mint_custom_token for the custom token minted on the lookup pool.
+        """
+        request = self._requests.get(threading.get_ident())
+        if request is None:
+            return fn
+        route, _, session = request
+        name = getattr(fn, '__name__', 'task').lstrip('_')
+
+        def run(*args):
+            ident = threading.get_ident()
+            timer = StageTimer()
+            timer.cpu = {}
+            self._requests[ident] = (route, timer, session)
+            try:
+                with timer.stage(name):
+                    return fn(*args)
+            finally:
+                self._requests.pop(ident, None)
+                session.add_request(timer)
+        return run
+
+    def _cpu_fraction(self, ident, now):
+        """Share of the wall time since the last sample this thread spent on CPU (None if unknown)"""
+        try:
+            cpu = time.clock_gettime(time.pthread_getcpuclockid(ident))
+        except (AttributeError, OSError, OverflowError):
+            return None
+        last = self._cpu.get(ident)
+        self._cpu[ident] = (now, cpu)
+        if last is None or now <= last[0]:
+            return None
+        return (cpu - last[1]) / (now - last[0])
+
+    def _sample(self, session, own):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        now = time.perf_counter()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            request = self._requests.get(ident)
+            if request is None and session.rate is not None:
+                continue
+            fraction = self._cpu_fraction(ident, now)
+            on_cpu = None if fraction is None else fraction >= 0.5
+            if request is not None:
+                route, timer, _ = request
+                stage = getattr(timer, 'current', None) if timer is not None else None
+                root = [route] + ([f"stage:{stage}"] if stage else [])
+            else:
+                if not session.idle and (on_cpu is False or fraction is None):
+                    continue
+                stage = None
+                root = [f"thread:{_thread_kind(names.get(ident, str(ident)))}"]
+            session.add(frame, root, stage, on_cpu)
+        session.ticks += 1
+
+    def profile(self, seconds, rate=None, idle=True):
+        """Sample for `seconds` from the calling thread and return the session
+
+        rate=None samples every thread; a rate in (0, 1] samples only that
+        share of the requests that start during the session. idle=False
+        drops samples of threads outside a request that are waiting.
+        Raises RuntimeError if a session is already running.
+        """
+        seconds = max(0.0, min(seconds, self.max_seconds))
+        session = ProfileSession(seconds, self.interval, rate, idle)
+        with self._lock:
+            if self.active is not None:
+                raise RuntimeError('A profiling session is already running in this worker')
+            self.active = session
+        own = threading.get_ident()
+        logger.info(f"Profiling {'all threads' if rate is None else f'{rate:.0%} of requests'} for {seconds:g} s")
+        try:
+            session.started = time.time()
+            start = time.perf_counter()
+            deadline = start + seconds
+            tick = start
+            while tick < deadline:
+                self._sample(session, own)
+                tick += self.interval
+                delay = tick - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Fell behind (GIL contention): skip the missed ticks
+                    tick = time.perf_counter()
+            session.elapsed = time.perf_counter() - start
+        finally:
+            with self._lock:
+                self.active = None
+                self._requests.clear()
+                self._cpu.clear()
+        return session
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    """Return the process-wide profiler"""
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = Profiler()
+    return _profiler
@@ -0,0 +1,156 @@
+"""
+Background dependency probes behind /ready
+
+A daemon thread checks each dependency (Firestore, uclapi.com DNS and TCP)
+every READINESS_PROBE_INTERVAL seconds, jittered so workers and replicas
+don't probe in lockstep, and publishes the results as one snapshot that is
+replaced whole. Only the required dependencies gate readiness; the rest
+are reported. /ready only reads that snapshot, so answering a platform
+probe makes no network call. A result older than READINESS_STALE_AFTER
+counts as down: a stuck prober can't keep reporting ready. The thread is
+started lazily per process, so under --preload it runs in each worker.
+"""
+
+import os
+import time
+import random
+import socket
+import logging
+import threading
+from datetime import datetime
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+READINESS_PROBE_INTERVAL = float(os.environ.get('READINESS_PROBE_INTERVAL', 15))
+READINESS_PROBE_JITTER = float(os.environ.get('READINESS_PROBE_JITTER', 0.2))
+READINESS_PROBE_TIMEOUT = float(os.environ.get('READINESS_PROBE_TIMEOUT', 3))
+READINESS_STALE_AFTER = float(os.environ.get('READINESS_STALE_AFTER', 60))
+
+
+def tcp_probe(url, timeout):
+    """Resolve url's host and open (then close) a TCP connection to it"""
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    start = time.perf_counter()
+    # getaddrinfo can't time out; a hang shows up as a stale result instead
+    family, kind, proto, _, address = socket.getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)[0]
+    resolved = time.perf_counter()
+    with socket.socket(family, kind, proto) as sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+    return {
+        'dns_ms': round((resolved - start) * 1000, 1),
+        'connect_ms': round((time.perf_counter() - resolved) * 1000, 1)
+    }
+
+
+class DependencyProber:
+    """Periodically runs named checks and keeps the latest result of each
+
+    A check is fn(timeout) that raises on failure and may return a dict of
+    extra details to report. `required` names the checks that gate
+    readiness (all of them by default).
+    """
+
+    def __init__(self, checks, required=None, interval=READINESS_PROBE_INTERVAL, jitter=READINESS_PROBE_JITTER,
+                 timeout=READINESS_PROBE_TIMEOUT, stale_after=READINESS_STALE_AFTER):
+        self.checks = dict(checks)
+        self.required = set(self.checks if required is None else required)
+        self.interval = interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.rounds = 0
+        self._results = {}
+        self._thread = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    def ensure_running(self):
+        """Start this process's probe thread if it isn't running (cheap to call per request)"""
+        if self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            pid = os.getpid()
+            if self._thread is None or self._thread_pid != pid or not self._thread.is_alive():
+                if self._thread_pid not in (None, pid):
+                    # Forked: the parent's results say nothing about this process
+                    self._results = {}
+                self._thread = threading.Thread(target=self._run, name='dependency-prober', daemon=True)
+                self._thread_pid = pid
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self.probe_once()
+            time.sleep(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def probe_once(self):
+        """Run every check now and publish the results"""
+        for name, check in self.checks.items():
+            start = time.perf_counter()
+            try:
+                details, error = check(self.timeout) or {}, None
+            except Exception as e:
+                details, error = {}, f"{type(e).__name__}: {e}"
+            latency = time.perf_counter() - start
+
+            previous = self._results.get(name)
+            if previous is not None and previous['ok'] != (error is None):
+                log = logger.info if error is None else logger.warning
+                log("Dependency probe changed state", extra={'dependency': name, 'ok': error is None,
+                                                              'error': error})
+            failures = 0 if error is None else (previous['consecutive_failures'] if previous else 0) + 1
+            result = dict(details, ok=error is None, error=error, latency_ms=round(latency * 1000, 1),
+                          consecutive_failures=failures, checked_at=time.time(), checked_mono=time.monotonic())
+            # Readers see the old or the new dict, never a partial update
+            self._results = dict(self._results, **{name: result})
+        self.rounds += 1
+
+    def snapshot(self):
+        """Readiness from the latest results; no I/O"""
+        results = self._results
+        now = time.monotonic()
+        ready = True
+        dependencies = {}
+        for name in self.checks:
+            result = results.get(name)
+            required = name in self.required
+            if result is None:
+                dependencies[name] = {'status': 'pending', 'required': required}
+                ready = ready and not required
+                continue
+            age = now - result['checked_mono']
+            if not result['ok']:
+                status = 'down'
+            elif age > self.stale_after:
+                status = 'stale'
+            else:
+                status = 'up'
+            ready = ready and (status == 'up' or not required)
+            report = {key: value for key, value in result.items() if key not in ('ok', 'checked_mono')}
+            report.update(status=status, required=required, age_s=round(age, 1),
+                          checked_at=datetime.utcfromtimestamp(result['checked_at']).isoformat())
+            dependencies[name] = report
+        return {
+            'ready': ready,
+            'dependencies': dependencies,
+            'probe_interval_s': self.interval,
+            'stale_after_s': self.stale_after,
+            'pid': os.getpid()
+        }
+
+
+_prober = None
+_prober_lock = threading.Lock()
+
+
+def get_dependency_prober(checks, required=None):
+    """Return the process-wide dependency prober (checks are fixed by the first call)"""
+    global _prober
+    if _prober is None:
+        with _prober_lock:
+            if _prober is None:
+                _prober = DependencyProber(checks, required)
+    return _prober
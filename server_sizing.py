@@ -0,0 +1,171 @@
+"""
+Gunicorn worker/thread sizing from the container's limits and the upstream timeouts
+
+gunicorn.conf.py applies plan(); `python server_sizing.py` prints the plan
+for the current container. A login is mostly network wait (uclapi.com,
+Firestore, Firebase Auth), so:
+
+  workers   one per CPU of the cgroup CPU quota (at least 2, so recycling
+            or losing one worker never takes the instance down), capped by
+            what the cgroup memory limit holds at GUNICORN_WORKER_MEMORY_MB
+            each
+  threads   (gthread) enough for CALLBACK_MAX_CONCURRENT running logins,
+            CALLBACK_MAX_QUEUE queued ones and CHEAP_ROUTE_THREADS for
+            /ready, /health and /metrics, so the /callback limiter fills up
+            and sheds with a fast 503 before gunicorn's accept backlog does
+  timeout   a login's worst case: the token POST and the user-data GET,
+            each bounded with its retries by UCL_CALL_DEADLINE (one
+            attempt's connect + read timeout by default), the admission
+            queue wait and the Firebase calls. A sync worker is killed at
+            this timeout, so it must exceed the upstream time
+  graceful  the timeout plus the write-behind drain, so logins in flight
+            when a worker is told to stop still finish
+  recycle   after GUNICORN_MAX_REQUESTS requests (with jitter) to bound
+            memory growth. An exiting worker closes the connections it has
+            accepted or kept alive but not started a request on, so each
+            recycle resets a few requests that the proxy has to retry
+
+WEB_CONCURRENCY, GUNICORN_THREADS, GUNICORN_TIMEOUT and the other
+GUNICORN_* variables override each value.
+"""
+
+import os
+import math
+import logging
+
+from admission import CALLBACK_MAX_CONCURRENT, CALLBACK_MAX_QUEUE, CALLBACK_QUEUE_TIMEOUT
+from ucl_client import UCL_CALL_DEADLINE
+from write_behind import WRITE_BEHIND_DRAIN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+SERVING_MODE = os.environ.get('SERVING_MODE', 'sync')
+# Resident memory of one worker with firebase-admin and gRPC loaded, plus headroom
+GUNICORN_WORKER_MEMORY_MB = float(os.environ.get('GUNICORN_WORKER_MEMORY_MB', 160))
+GUNICORN_KEEPALIVE = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+GUNICORN_MAX_REQUESTS = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+GUNICORN_MAX_REQUESTS_JITTER = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# Share of the memory limit the workers may use; the rest is the master,
+# page cache and the spikes between worker recycles
+MEMORY_USABLE_FRACTION = 0.75
+# Firestore reads/writes and Firebase Auth calls within one login, seconds
+FIREBASE_CALL_BUDGET = 10
+# gthread threads beyond the /callback limiter's running + queued logins
+CHEAP_ROUTE_THREADS = 8
+
+WORKER_CLASSES = {'sync': 'gthread', 'async': 'uvicorn.workers.UvicornWorker'}
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit(root=CGROUP_ROOT):
+    """CPUs allowed by the cgroup CPU quota (v2 or v1), or None if unlimited"""
+    value = _read(os.path.join(root, 'cpu.max'))
+    if value:
+        quota, _, period = value.partition(' ')
+        if quota != 'max':
+            return int(quota) / int(period or 100000)
+        return None
+    for directory in ('cpu', 'cpu,cpuacct'):
+        quota = _read(os.path.join(root, directory, 'cpu.cfs_quota_us'))
+        period = _read(os.path.join(root, directory, 'cpu.cfs_period_us'))
+        if quota and period and int(quota) > 0:
+            return int(quota) / int(period)
+    return None
+
+
+def cgroup_memory_limit(root=CGROUP_ROOT):
+    """Bytes allowed by the cgroup memory limit (v2 or v1), or None if unlimited"""
+    value = _read(os.path.join(root, 'memory.max'))
+    if value is None:
+        value = _read(os.path.join(root, 'memory', 'memory.limit_in_bytes'))
+    if not value or value == 'max' or int(value) >= 1 << 60:
+        # v1 reports "unlimited" as a huge number
+        return None
+    return int(value)
+
+
+def available_cpus(root=CGROUP_ROOT):
+    """CPUs this process can use: the CPU affinity, capped by the cgroup quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit(root)
+    return min(cpus, limit) if limit else cpus
+
+
+def available_memory(root=CGROUP_ROOT):
+    """Bytes of memory: the cgroup limit, else the machine's, else None"""
+    limit = cgroup_memory_limit(root)
+    if limit is not None:
+        return limit
+    meminfo = _read('/proc/meminfo') or ''
+    for line in meminfo.splitlines():
+        if line.startswith('MemTotal:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+def login_budget():
+    """Seconds a /callback can take with both uclapi.com calls at their deadline"""
+    return 2 * UCL_CALL_DEADLINE + CALLBACK_QUEUE_TIMEOUT + FIREBASE_CALL_BUDGET
+
+
+def plan(mode=SERVING_MODE, cpus=None, memory=None, env=os.environ):
+    """Gunicorn settings for this container: {setting: value} plus the inputs used"""
+    cpus = available_cpus() if cpus is None else cpus
+    memory = available_memory() if memory is None else memory
+    worker_class = env.get('GUNICORN_WORKER_CLASS') or WORKER_CLASSES.get(mode, 'gthread')
+
+    workers = max(2, math.ceil(cpus))
+    if memory:
+        workers = min(workers, max(1, int(memory / 2 ** 20 * MEMORY_USABLE_FRACTION / GUNICORN_WORKER_MEMORY_MB)))
+    if env.get('WEB_CONCURRENCY'):
+        workers = int(env['WEB_CONCURRENCY'])
+
+    if worker_class == 'gthread':
+        threads = CALLBACK_MAX_CONCURRENT + CALLBACK_MAX_QUEUE + CHEAP_ROUTE_THREADS
+    else:
+        # The sync worker has one; the uvicorn worker sizes its pool with ASYNC_FIREBASE_THREADS
+        threads = 1
+    if env.get('GUNICORN_THREADS'):
+        threads = int(env['GUNICORN_THREADS'])
+
+    timeout = math.ceil(login_budget()) + 5
+    if env.get('GUNICORN_TIMEOUT'):
+        timeout = int(env['GUNICORN_TIMEOUT'])
+    graceful_timeout = timeout + math.ceil(WRITE_BEHIND_DRAIN_TIMEOUT)
+
+    return {
+        'worker_class': worker_class,
+        'workers': workers,
+        'threads': threads,
+        'timeout': timeout,
+        'graceful_timeout': graceful_timeout,
+        # Behind the platform's proxy; sync workers don't keep connections alive
+        'keepalive': GUNICORN_KEEPALIVE,
+        'max_requests': GUNICORN_MAX_REQUESTS,
+        'max_requests_jitter': GUNICORN_MAX_REQUESTS_JITTER,
+        'inputs': {
+            'cpus': round(cpus, 2),
+            'memory_mb': round(memory / 2 ** 20) if memory else None,
+            'worker_memory_mb': GUNICORN_WORKER_MEMORY_MB,
+            'login_budget_s': login_budget(),
+            'callback_max_concurrent': CALLBACK_MAX_CONCURRENT,
+            'callback_max_queue': CALLBACK_MAX_QUEUE
+        }
+    }
+
+
+if __name__ == "__main__":
+    import json
+    print(json.dumps(plan(), indent=2))
@@ -0,0 +1,135 @@
+"""
+Pre-serialized responses for constant endpoints
+
+Bodies are serialized once at startup together with their gzip (and,
+when the brotli package is installed, br) variants and strong ETags, so a
+request only negotiates the encoding, answers If-None-Match with 304, or
+sends prebuilt bytes (serve() for Flask, negotiate() for other
+frameworks). CompiledTemplate covers pages like /success that
+only substitute a few escaped values into fixed markup.
+"""
+
+import re
+import gzip
+import hashlib
+from html import escape
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _accepted_encodings(header, available=('br', 'gzip')):
+    """Encodings the client accepts (q > 0); `*` stands for any of `available` not listed"""
+    accepted, refused = set(), set()
+    wildcard = False
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        params = params.replace(' ', '')
+        quality = 1.0
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        if name == '*':
+            wildcard = quality > 0
+        elif quality > 0:
+            accepted.add(name)
+        else:
+            refused.add(name)
+    if wildcard:
+        accepted.update(encoding for encoding in available if encoding not in refused)
+    return accepted
+
+
+class PrecomputedResponse:
+    """A constant body served with ETag, Cache-Control and precompressed variants"""
+
+    def __init__(self, body, mimetype, max_age=300):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.mimetype = mimetype
+        self.cache_control = f"public, max-age={max_age}"
+        digest = hashlib.sha256(body).hexdigest()[:32]
+
+        # Strong ETags identify one representation, so each encoding gets its own
+        self.variants = {None: (body, f'"{digest}"')}
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            self.variants['gzip'] = (compressed, f'"{digest}-gz"')
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants['br'] = (compressed, f'"{digest}-br"')
+        self._etags = frozenset(etag for _, etag in self.variants.values())
+
+    @classmethod
+    def json(cls, app, data, max_age=300):
+        """Serialize data exactly as jsonify() would"""
+        return cls(app.json.response(data).get_data(), 'application/json', max_age)
+
+    def _not_modified(self, header):
+        if header.strip() == '*':
+            return True
+        for tag in header.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag in self._etags:
+                return True
+        return False
+
+    def negotiate(self, accept_encoding, if_none_match):
+        """(status, body, headers) for a request with these headers"""
+        encoding = None
+        if len(self.variants) > 1:
+            accepted = _accepted_encodings(accept_encoding or '')
+            for candidate in ('br', 'gzip'):
+                if candidate in self.variants and candidate in accepted:
+                    encoding = candidate
+                    break
+        body, etag = self.variants[encoding]
+
+        headers = {'ETag': etag, 'Cache-Control': self.cache_control}
+        if len(self.variants) > 1:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if if_none_match and self._not_modified(if_none_match):
+            return 304, b'', headers
+
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return 200, body, headers
+
+    def serve(self):
+        """Flask response for the current request"""
+        status, body, headers = self.negotiate(request.headers.get('Accept-Encoding'),
+                                               request.headers.get('If-None-Match'))
+        if status == 304:
+            return Response(status=304, headers=headers)
+        return Response(body, mimetype=self.mimetype, headers=headers)
+
+
+class CompiledTemplate:
+    """Markup with {{ name }} placeholders, split once and filled with escaped values"""
+
+    _PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+    def __init__(self, source):
+        parts = self._PLACEHOLDER.split(source)
+        self._literals = parts[0::2]
+        self._names = parts[1::2]
+
+    def render(self, **values):
+        out = [self._literals[0]]
+        for name, literal in zip(self._names, self._literals[1:]):
+            out.append(escape(str(values[name])))
+            out.append(literal)
+        return ''.join(out)
@@ -0,0 +1,22 @@
+"""
+Shared fixtures: the real Flask app driven against the in-memory fakes in
+benchmarks/fakes.py, so no Firebase project or uclapi.com access is needed
+"""
+
+import logging
+
+import pytest
+
+from benchmarks.fakes import make_signer
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    logging.getLogger().setLevel(logging.ERROR)
+    return app
+
+
+@pytest.fixture(scope='session')
+def signer():
+    return make_signer()
@@ -0,0 +1,98 @@
+"""
+admin.py transforms over a synthetic users collection: dry runs, normalize-email,
+resuming after failed commits, and the CLI
+"""
+
+import logging
+import random
+
+import pytest
+
+import admin
+from benchmarks.bench_admin import run, seed
+from bulk_update import Checkpoint
+from user_store import EMAIL_INDEX_COLLECTION, USERS_COLLECTION, email_index_key, lookup_uid, normalize_email
+
+USERS = 3000
+SEEDED = {'backfill-onboarded': 'not_onboarded', 'normalize-email': 'unnormalized',
+          'migrate-ucl-data': 'partial_ucl_data', 'delete-orphans': 'orphan', 'backfill-email-index': 'unindexed'}
+
+
+@pytest.fixture
+def users():
+    return seed(USERS, 0.0, 0.0, random.Random(42))
+
+
+@pytest.mark.parametrize('name', SEEDED)
+def test_dry_run_finds_the_seeded_documents_and_writes_nothing(users, name):
+    db, auth, expected = users
+    report = run(db, auth, name, dry_run=True, writes_per_sec=0)
+    assert report['scanned'] == USERS
+    assert report['changed'] == expected[SEEDED[name]]
+    assert db.counts.get('commit', 0) == 0
+
+
+def test_normalize_email_keeps_users_findable_through_the_index(users):
+    db, auth, _ = users
+    raw = {uid: doc['email'] for uid, doc in db.docs(USERS_COLLECTION).items()
+           if doc['email'] != normalize_email(doc['email'])}
+    report = run(db, auth, 'normalize-email', workers=4, writes_per_sec=0)
+    assert report['stats']['normalized'] == len(raw) and report['stats']['conflicts'] == 0
+    assert all(db.docs(USERS_COLLECTION)[uid]['email'] == normalize_email(email) for uid, email in raw.items())
+    assert all(lookup_uid(db, email) == uid for uid, email in raw.items())
+
+
+def test_resume_finishes_a_run_whose_commits_failed(users, tmp_path):
+    db, auth, expected = users
+    checkpoint = Checkpoint(str(tmp_path / 'backfill-onboarded.json'))
+    real_batch, allowed = db.batch, [1]
+
+    def failing_batch():
+        batch = real_batch()
+        commit = batch.commit
+
+        def maybe_fail():
+            with db.lock:
+                allowed[0] -= 1
+                fail = allowed[0] < 0
+            if fail:
+                raise RuntimeError('injected commit failure')
+            commit()
+        batch.commit = maybe_fail
+        return batch
+
+    db.batch = failing_batch
+    logging.getLogger('bulk_update').setLevel(logging.CRITICAL)
+    try:
+        first = run(db, auth, 'backfill-onboarded', page_size=500, workers=1, writes_per_sec=0,
+                    checkpoint=checkpoint)
+    finally:
+        logging.getLogger('bulk_update').setLevel(logging.NOTSET)
+    state = checkpoint.load()
+    assert first['error'] is not None and not state['finished']
+
+    db.batch = real_batch
+    second = run(db, auth, 'backfill-onboarded', start_after=state['last_doc_id'], page_size=500, workers=1,
+                 writes_per_sec=0, checkpoint=checkpoint)
+    assert checkpoint.load()['finished']
+    assert not any('isOnboarded' not in doc for doc in db.docs(USERS_COLLECTION).values())
+    assert second['scanned'] < USERS
+    assert first['committed'] + second['committed'] == expected['not_onboarded']
+
+
+def test_cli_delete_orphans_and_backfill_email_index(users, tmp_path, monkeypatch):
+    db, auth, expected = users
+    monkeypatch.setattr(admin, 'firebase_clients', lambda: (db, auth))
+    flags = ['--workers', '4', '--rate', '0']
+
+    orphans = ['--checkpoint', str(tmp_path / 'orphans.json')]
+    assert admin.main(['delete-orphans'] + flags + orphans) == 1
+    assert len(db.docs(USERS_COLLECTION)) == USERS
+    assert admin.main(['delete-orphans', '--yes'] + flags + orphans) == 0
+    users = db.docs(USERS_COLLECTION)
+    assert len(users) == USERS - expected['orphan']
+    assert all(uid in auth._by_uid for uid in users)
+
+    assert admin.main(['backfill-email-index'] + flags + ['--checkpoint', str(tmp_path / 'index.json')]) == 0
+    index = db.docs(EMAIL_INDEX_COLLECTION)
+    assert all(email_index_key(doc['email']) in index for doc in users.values())
@@ -0,0 +1,58 @@
+"""
+uclapi.com circuit breaker through the real /login/ucl -> /callback flow
+"""
+
+import time
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.bench_breaker import run_logins, use_client
+from benchmarks.bench_login import login
+from benchmarks.fakes import FakeAuth, FakeFirestore, FakeUCLServer, install_fakes, make_code
+
+LOGINS = 60
+CONCURRENCY = 4
+
+
+def test_outage_opens_breaker_and_recovers_through_half_open(app_module, signer):
+    with FakeUCLServer(latency_ms=5, error_rate=1.0) as ucl:
+        install_fakes(app_module, ucl.url, FakeFirestore(), FakeAuth(signer=signer), signer)
+        client = use_client(app_module, ucl)
+
+        failing = run_logins(app_module.app, LOGINS, CONCURRENCY, 'outage')
+        assert client.breaker.stats()['transitions'].get('closed->open', 0) >= 1
+        # Only the calls that filled the breaker's window reached uclapi.com
+        assert failing['outcomes'].get('conni://ucl-callback', 0) >= LOGINS - 2 * CONCURRENCY - 5
+        assert ucl.requests['token'] < LOGINS
+
+        ucl.error_rate = 0.0
+        time.sleep(client.breaker.open_duration + 0.1)
+        run_logins(app_module.app, LOGINS, CONCURRENCY, 'recovering')
+        assert client.breaker.state == 'closed'
+        recovered = run_logins(app_module.app, LOGINS, CONCURRENCY, 'recovered')
+        assert recovered['outcomes'] == {'conni://success': LOGINS}
+
+
+def test_open_breaker_redirects_with_a_friendly_error(app_module, signer):
+    with FakeUCLServer(latency_ms=5, error_rate=1.0) as ucl:
+        install_fakes(app_module, ucl.url, FakeFirestore(), FakeAuth(signer=signer), signer)
+        client = use_client(app_module, ucl)
+        run_logins(app_module.app, 10, 1, 'trip')
+        assert client.breaker.state == 'open'
+
+        calls = ucl.requests['token']
+        status, location = login(app_module.app.test_client(), make_code('blocked'))
+        assert status == 302
+        assert location.startswith('conni://ucl-callback?')
+        query = parse_qs(urlparse(location).query)
+        assert query['error'] == ['UCL login is temporarily unavailable. Please try again shortly.']
+        assert 0 <= int(query['retry_after'][0]) <= client.breaker.open_duration
+        assert ucl.requests['token'] == calls
+
+
+def test_slow_calls_open_the_breaker(app_module, signer):
+    with FakeUCLServer(latency_ms=150) as ucl:
+        install_fakes(app_module, ucl.url, FakeFirestore(), FakeAuth(signer=signer), signer)
+        client = use_client(app_module, ucl, slow_call_duration=0.05)
+        result = run_logins(app_module.app, 20, CONCURRENCY, 'slow')
+        assert client.breaker.stats()['transitions'].get('closed->open', 0) >= 1
+        assert result['outcomes'].get('conni://ucl-callback', 0) > 0
@@ -0,0 +1,40 @@
+"""
+Local custom-token signing matches firebase_admin byte for byte
+"""
+
+from unittest import mock
+
+import pytest
+
+from benchmarks.bench_token_signer import make_service_account, verify
+
+
+@pytest.fixture(scope='module')
+def signers():
+    import firebase_admin
+    from firebase_admin import credentials
+    from token_signer import CustomTokenSigner
+
+    info, public_pem = make_service_account()
+    cred = credentials.Certificate(info)
+    firebase_app = firebase_admin.initialize_app(cred, name='token-signer-test')
+    yield firebase_app, CustomTokenSigner.from_certificate(cred), public_pem
+    firebase_admin.delete_app(firebase_app)
+
+
+def test_tokens_are_byte_identical_to_firebase_admin(signers):
+    from firebase_admin import auth
+    firebase_app, signer, _ = signers
+    for uid in ('compat-uid', 'a' * 128, 'ünïcode-uid'):
+        with mock.patch('time.time', return_value=1700000000.0):
+            expected = auth.create_custom_token(uid, app=firebase_app)
+            assert signer.create_custom_token(uid) == expected
+
+
+def test_tokens_verify_against_the_public_key(signers):
+    _, signer, public_pem = signers
+    claims = verify(signer.create_custom_token('compat-uid'), public_pem)
+    assert claims['uid'] == 'compat-uid'
+    assert claims['exp'] - claims['iat'] == 3600
+    for i in range(20):
+        assert verify(signer.create_custom_token(f"user-{i}"), public_pem)['uid'] == f"user-{i}"
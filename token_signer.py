@@ -0,0 +1,90 @@
+"""
+Local Firebase custom-token minting
+
+Signs custom tokens with the service-account key that was already parsed
+for firebase_admin, keeping the signer and the encoded JWT header in
+memory so each login only serializes the claims and does one RSA sign.
+Tokens are byte-for-byte what auth.create_custom_token() would produce for
+the same issue time.
+"""
+
+import os
+import json
+import time
+import base64
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+LOCAL_TOKEN_SIGNING = os.environ.get('LOCAL_TOKEN_SIGNING', 'true').lower() in ('1', 'true', 'yes')
+
+# Same constants firebase_admin._token_gen uses
+FIREBASE_AUDIENCE = ('https://identitytoolkit.googleapis.com/google.'
+                     'identity.identitytoolkit.v1.IdentityToolkit')
+MAX_TOKEN_LIFETIME_SECONDS = 3600
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+class CustomTokenSigner:
+    """Mints Firebase custom tokens with a preloaded RS256 signer"""
+
+    def __init__(self, signer, signer_email):
+        self.signer = signer
+        self.signer_email = signer_email
+        # Built the way google.auth.jwt.encode builds firebase_admin's header
+        header = {'alg': 'RS256', 'typ': 'JWT'}
+        if signer.key_id is not None:
+            header['kid'] = signer.key_id
+        self._header_segment = _b64(json.dumps(header).encode('utf-8'))
+
+    @classmethod
+    def from_certificate(cls, cred):
+        """Reuse the signer of a firebase_admin credentials.Certificate"""
+        return cls(cred.signer, cred.service_account_email)
+
+    @classmethod
+    def from_service_account_info(cls, info):
+        """Parse a service-account JSON dict"""
+        from google.auth.crypt import RSASigner
+        return cls(RSASigner.from_service_account_info(info), info['client_email'])
+
+    def create_custom_token(self, uid):
+        """Return a signed custom token for uid as bytes"""
+        if not uid or not isinstance(uid, str) or len(uid) > 128:
+            raise ValueError('uid must be a string between 1 and 128 characters.')
+
+        now = int(time.time())
+        payload = {
+            'iss': self.signer_email,
+            'sub': self.signer_email,
+            'aud': FIREBASE_AUDIENCE,
+            'uid': uid,
+            'iat': now,
+            'exp': now + MAX_TOKEN_LIFETIME_SECONDS,
+        }
+        signing_input = self._header_segment + b'.' + _b64(json.dumps(payload).encode('utf-8'))
+        return signing_input + b'.' + _b64(self.signer.sign(signing_input))
+
+
+_signer = None
+_signer_lock = threading.Lock()
+
+
+def get_token_signer(cred):
+    """Return the process-wide signer for cred, or None if it can't sign locally"""
+    global _signer
+    if not LOCAL_TOKEN_SIGNING or cred is None:
+        return None
+    if _signer is None:
+        with _signer_lock:
+            if _signer is None:
+                try:
+                    _signer = CustomTokenSigner.from_certificate(cred)
+                except Exception as e:
+                    logger.warning(f"Local token signing unavailable, using firebase_admin: {e}")
+                    return None
+    return _signer
@@ -0,0 +1,138 @@
+"""
+Optional capture of request timing and shape, for replaying as load
+
+When TRAFFIC_RECORD_PATH is set, every finished request (or a
+TRAFFIC_RECORD_SAMPLE_RATE share of them) is appended to that file as one
+JSON line: arrival time, route, status, total and per-stage latency, and
+for /callback the outcome and whether it was a new or returning user.
+Nothing identifying is kept: no query strings, codes, states, emails,
+UIDs or tokens. Request threads only append to a bounded buffer; a
+per-process thread writes it out in batches, each with a single O_APPEND
+write, so all gunicorn workers can share one file. benchmarks/replay.py
+turns a capture back into load.
+"""
+
+import os
+import json
+import time
+import atexit
+import random
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+TRAFFIC_RECORD_PATH = os.environ.get('TRAFFIC_RECORD_PATH', '')
+TRAFFIC_RECORD_SAMPLE_RATE = float(os.environ.get('TRAFFIC_RECORD_SAMPLE_RATE', 1.0))
+TRAFFIC_RECORD_BUFFER = int(os.environ.get('TRAFFIC_RECORD_BUFFER', 10000))
+TRAFFIC_RECORD_FLUSH_INTERVAL = float(os.environ.get('TRAFFIC_RECORD_FLUSH_INTERVAL', 1.0))
+
+# /callback outcomes that say which kind of user logged in
+USER_KINDS = {'new_user': 'new', 'returning_user': 'returning'}
+
+
+class TrafficRecorder:
+    """Buffers request records and appends them to a JSONL file from a background thread"""
+
+    def __init__(self, path, sample_rate=TRAFFIC_RECORD_SAMPLE_RATE, max_buffer=TRAFFIC_RECORD_BUFFER,
+                 flush_interval=TRAFFIC_RECORD_FLUSH_INTERVAL):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self.dropped = 0
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._thread_pid = None
+
+    def record(self, route, status, duration, timer=None):
+        """Capture one finished request (duration in seconds, timer a StageTimer for /callback)"""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        entry = {
+            'ts': round(time.time() - duration, 4),
+            'route': route,
+            'status': status,
+            'duration_ms': round(duration * 1000, 2)
+        }
+        if timer is not None:
+            entry['stages'] = {name: round(seconds * 1000, 2) for name, seconds in timer.stages.items()}
+            entry['outcome'] = timer.outcome
+            entry['user'] = USER_KINDS.get(timer.outcome)
+        if self.sample_rate < 1.0:
+            entry['sample_rate'] = self.sample_rate
+        with self._cond:
+            self._ensure_writer()
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                return
+            self._buffer.append(entry)
+
+    def _ensure_writer(self):
+        # Started lazily so each gunicorn worker gets its own writer thread
+        pid = os.getpid()
+        if self._thread is None or self._thread_pid != pid or not self._thread.is_alive():
+            if self._thread_pid not in (None, pid):
+                # Forked: the parent's buffered records are the parent's to write
+                self._buffer = []
+            self._thread = threading.Thread(target=self._run, name='traffic-recorder', daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write out everything buffered so far"""
+        with self._cond:
+            entries, self._buffer = self._buffer, []
+        if not entries:
+            return
+        data = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries).encode('utf-8')
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.error(f"Could not write {len(entries)} traffic records to {self.path}: {e}")
+            with self._cond:
+                self.dropped += len(entries)
+            return
+        with self._cond:
+            self.recorded += len(entries)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'enabled': True,
+                'path': self.path,
+                'sample_rate': self.sample_rate,
+                'recorded': self.recorded,
+                'buffered': len(self._buffer),
+                'dropped': self.dropped
+            }
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_traffic_recorder():
+    """Return the process-wide traffic recorder, or None when TRAFFIC_RECORD_PATH is unset"""
+    global _recorder
+    if not TRAFFIC_RECORD_PATH:
+        return None
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = TrafficRecorder(TRAFFIC_RECORD_PATH)
+                # Write out the last partial batch when a worker exits cleanly
+                atexit.register(_recorder.flush)
+    return _recorder
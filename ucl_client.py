@@ -0,0 +1,538 @@
+"""
+Shared HTTP client for the UCL API (uclapi.com)
+
+Keeps a pooled, keep-alive requests.Session per process so that the token
+exchange and user-data calls made by /callback reuse TCP+TLS connections
+instead of paying a fresh handshake on every login. Both calls go through
+a circuit breaker, and the user-data GET can optionally be hedged: if it
+hasn't answered within the recent p95 latency a second request is sent
+and whichever answers first wins. The token POST is never hedged since
+authorization codes are single-use. Retries (connect errors, and 5xx for
+the GET) happen within one deadline per call; read timeouts are not
+retried.
+
+The *_async methods are the event-loop equivalents used by the ASGI app
+(asgi_app.py); they share the breaker, latency window and hedge counters
+but use an httpx.AsyncClient instead of the requests session.
+"""
+
+import os
+import time
+import asyncio
+import threading
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from circuit_breaker import CircuitBreaker
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# UCL API client configuration
+UCL_API_BASE_URL = os.environ.get('UCL_API_BASE_URL', 'https://uclapi.com')
+UCL_POOL_CONNECTIONS = int(os.environ.get('UCL_POOL_CONNECTIONS', 4))
+UCL_POOL_MAXSIZE = int(os.environ.get('UCL_POOL_MAXSIZE', 16))
+UCL_CONNECT_TIMEOUT = float(os.environ.get('UCL_CONNECT_TIMEOUT', 5))
+UCL_READ_TIMEOUT = float(os.environ.get('UCL_READ_TIMEOUT', 30))
+UCL_MAX_RETRIES = int(os.environ.get('UCL_MAX_RETRIES', 2))
+UCL_RETRY_BACKOFF = float(os.environ.get('UCL_RETRY_BACKOFF', 0.2))
+UCL_RETRY_BACKOFF_MAX = float(os.environ.get('UCL_RETRY_BACKOFF_MAX', 2))
+# Seconds one call may take across all its attempts; by default a single attempt's timeouts
+UCL_CALL_DEADLINE = float(os.environ.get('UCL_CALL_DEADLINE', UCL_CONNECT_TIMEOUT + UCL_READ_TIMEOUT))
+
+# Statuses the user-data GET is retried on
+RETRY_STATUSES = (502, 503, 504)
+
+# Circuit breaker around both uclapi.com calls
+UCL_BREAKER_ENABLED = os.environ.get('UCL_BREAKER_ENABLED', 'true').lower() == 'true'
+UCL_BREAKER_FAILURE_RATE = float(os.environ.get('UCL_BREAKER_FAILURE_RATE', 0.5))
+UCL_BREAKER_SLOW_CALL_S = float(os.environ.get('UCL_BREAKER_SLOW_CALL_S', 5))
+UCL_BREAKER_SLOW_CALL_RATE = float(os.environ.get('UCL_BREAKER_SLOW_CALL_RATE', 0.8))
+UCL_BREAKER_WINDOW = int(os.environ.get('UCL_BREAKER_WINDOW', 20))
+UCL_BREAKER_MIN_CALLS = int(os.environ.get('UCL_BREAKER_MIN_CALLS', 10))
+UCL_BREAKER_OPEN_S = float(os.environ.get('UCL_BREAKER_OPEN_S', 30))
+UCL_BREAKER_HALF_OPEN_CALLS = int(os.environ.get('UCL_BREAKER_HALF_OPEN_CALLS', 3))
+
+# Hedged user-data GET
+UCL_HEDGE_ENABLED = os.environ.get('UCL_HEDGE_ENABLED', 'false').lower() == 'true'
+UCL_HEDGE_PERCENTILE = float(os.environ.get('UCL_HEDGE_PERCENTILE', 95))
+UCL_HEDGE_MIN_DELAY = float(os.environ.get('UCL_HEDGE_MIN_DELAY', 0.05))
+UCL_HEDGE_MAX_DELAY = float(os.environ.get('UCL_HEDGE_MAX_DELAY', 2))
+
+
+class ConnectionStats:
+    """Thread-safe counters for new vs. reused upstream connections"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def record(self, reused):
+        with self._lock:
+            if reused:
+                self.reused_connections += 1
+            else:
+                self.new_connections += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'new_connections': self.new_connections,
+                'reused_connections': self.reused_connections
+            }
+
+
+def _counting_pool(base_cls, stats):
+    """Build a connection pool class that reports connection reuse to stats"""
+
+    class CountingConnectionPool(base_cls):
+        def _make_request(self, conn, *args, **kwargs):
+            # A connection without a socket is about to be (re)connected
+            stats.record(reused=getattr(conn, 'sock', None) is not None)
+            return super()._make_request(conn, *args, **kwargs)
+
+    CountingConnectionPool.__name__ = f"Counting{base_cls.__name__}"
+    return CountingConnectionPool
+
+
+class LatencyTracker:
+    """Recent call latencies, for picking the hedge delay"""
+
+    def __init__(self, size=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct):
+        """pct-th percentile, or None until min_samples calls have been seen"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _nothing_sent(error):
+    """True if a requests error happened before the request reached uclapi.com"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+def _is_server_error(response):
+    return response.status_code >= 500
+
+
+def default_breaker():
+    """Circuit breaker configured from the UCL_BREAKER_* settings"""
+    return CircuitBreaker(
+        'uclapi',
+        failure_rate_threshold=UCL_BREAKER_FAILURE_RATE,
+        slow_call_duration=UCL_BREAKER_SLOW_CALL_S,
+        slow_call_rate_threshold=UCL_BREAKER_SLOW_CALL_RATE,
+        window_size=UCL_BREAKER_WINDOW,
+        minimum_calls=UCL_BREAKER_MIN_CALLS,
+        open_duration=UCL_BREAKER_OPEN_S,
+        half_open_calls=UCL_BREAKER_HALF_OPEN_CALLS
+    )
+
+
+class _CountingAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools count new and reused connections"""
+
+    def __init__(self, stats, **kwargs):
+        # Must be set before HTTPAdapter.__init__ calls init_poolmanager
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self.stats),
+            'https': _counting_pool(HTTPSConnectionPool, self.stats)
+        }
+
+
+class UCLAPIClient:
+    """Pooled client for the uclapi.com OAuth endpoints
+
+    The session is created lazily and rebuilt if the process forks, so a
+    client created before gunicorn forks its workers never shares sockets
+    between them. requests.Session is safe to share between the threads of
+    a single worker once it has been mounted.
+    """
+
+    def __init__(self, base_url=UCL_API_BASE_URL,
+                 pool_connections=UCL_POOL_CONNECTIONS,
+                 pool_maxsize=UCL_POOL_MAXSIZE,
+                 connect_timeout=UCL_CONNECT_TIMEOUT,
+                 read_timeout=UCL_READ_TIMEOUT,
+                 max_retries=UCL_MAX_RETRIES,
+                 backoff_factor=UCL_RETRY_BACKOFF,
+                 backoff_max=UCL_RETRY_BACKOFF_MAX,
+                 call_deadline=UCL_CALL_DEADLINE,
+                 breaker=None,
+                 hedge_enabled=UCL_HEDGE_ENABLED,
+                 hedge_percentile=UCL_HEDGE_PERCENTILE,
+                 hedge_min_delay=UCL_HEDGE_MIN_DELAY,
+                 hedge_max_delay=UCL_HEDGE_MAX_DELAY):
+        self.base_url = base_url.rstrip('/')
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.call_deadline = call_deadline
+        self.breaker = breaker if breaker is not None else (default_breaker() if UCL_BREAKER_ENABLED else None)
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.user_data_latency = LatencyTracker()
+        self.hedges = {'sent': 0, 'won': 0}
+        self.stats = ConnectionStats()
+        self._lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+        self._executor = None
+        self._executor_pid = None
+        self._async_client = None
+        self._async_client_loop = None
+
+    def _build_session(self):
+        # No transport retries: _request() retries within the call deadline
+        adapter = _CountingAdapter(
+            self.stats,
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=0
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @property
+    def session(self):
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    if self._session_pid is not None:
+                        # Forked: counts belong to the parent process
+                        self.stats = ConnectionStats()
+                    self._session = self._build_session()
+                    self._session_pid = pid
+        return self._session
+
+    def _attempt_timeouts(self, deadline):
+        """(connect, read) timeouts for an attempt starting now, cut to the call deadline"""
+        remaining = max(deadline - time.monotonic(), 0.001)
+        return min(self.timeout[0], remaining), min(self.timeout[1], remaining)
+
+    def _retry_delay(self, attempt, deadline):
+        """Seconds to wait before retrying after attempt, or None if no retry is left
+
+        Same schedule as urllib3's Retry: no wait before the first retry, then
+        backoff_factor * 2^n, capped; a retry that would start past the deadline
+        is not made.
+        """
+        if attempt >= self.max_retries:
+            return None
+        delay = min(self.backoff_factor * 2 ** attempt, self.backoff_max) if attempt else 0
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def _request(self, method, path, retry_statuses=False, **kwargs):
+        """One uclapi.com call within call_deadline
+
+        Connect errors are retried for every method since nothing was sent,
+        which keeps the single-use authorization code safe. 502/503/504 are
+        only retried when retry_statuses is set (the idempotent GET). Read
+        errors and timeouts are never retried: the attempt already used the
+        read timeout.
+        """
+        deadline = time.monotonic() + self.call_deadline
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}",
+                                                timeout=self._attempt_timeouts(deadline), **kwargs)
+            except requests.RequestException as e:
+                delay = self._retry_delay(attempt, deadline) if _nothing_sent(e) else None
+                if delay is None:
+                    raise
+            else:
+                delay = self._retry_delay(attempt, deadline) if retry_statuses else None
+                if response.status_code not in RETRY_STATUSES or delay is None:
+                    return response
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def _guarded(self, fn, *args):
+        """Call fn through the breaker; 5xx responses count as failures"""
+        if self.breaker is None:
+            return fn(*args)
+        return self.breaker.call(fn, *args, is_failure=_is_server_error)
+
+    def exchange_code(self, code, client_id, client_secret):
+        """Exchange an authorization code for an access token
+
+        Raises CircuitOpenError without calling uclapi.com if the breaker is open.
+        """
+        return self._guarded(self._post_token, code, client_id, client_secret)
+
+    def _post_token(self, code, client_id, client_secret):
+        return self._request(
+            'POST', '/oauth/token',
+            data={
+                'client_id': client_id,
+                'client_secret': client_secret,
+                'code': code
+            }
+        )
+
+    def get_user_data(self, token, client_secret):
+        """Fetch the signed-in user's data (hedged if enabled)
+
+        Raises CircuitOpenError without calling uclapi.com if the breaker is open.
+        """
+        fetch = self._hedged_get_user_data if self.hedge_enabled else self._get_user_data
+        return self._guarded(fetch, token, client_secret)
+
+    def _get_user_data(self, token, client_secret):
+        start = time.monotonic()
+        response = self._request(
+            'GET', '/oauth/user/data',
+            retry_statuses=True,
+            params={
+                'token': token,
+                'client_secret': client_secret
+            }
+        )
+        if response.status_code < 500:
+            self.user_data_latency.record(time.monotonic() - start)
+        return response
+
+    def hedge_delay(self):
+        """Seconds to wait before sending the hedge: recent p95, clamped"""
+        delay = self.user_data_latency.percentile(self.hedge_percentile)
+        if delay is None:
+            return self.hedge_max_delay
+        return min(max(delay, self.hedge_min_delay), self.hedge_max_delay)
+
+    @property
+    def executor(self):
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    # Each in-flight hedged call uses up to two threads
+                    self._executor = ThreadPoolExecutor(max_workers=self.pool_maxsize * 2,
+                                                        thread_name_prefix='ucl-hedge')
+                    self._executor_pid = pid
+        return self._executor
+
+    def _hedged_get_user_data(self, token, client_secret):
+        primary = self.executor.submit(self._get_user_data, token, client_secret)
+        done, _ = wait([primary], timeout=self.hedge_delay())
+        if done:
+            return primary.result()
+
+        hedge = self.executor.submit(self._get_user_data, token, client_secret)
+        with self._lock:
+            self.hedges['sent'] += 1
+
+        # First usable answer wins; a 5xx or error only wins if nothing better comes
+        pending = {primary, hedge}
+        fallback = error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.RequestException as e:
+                    error = e
+                    continue
+                if response.status_code < 500:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedges['won'] += 1
+                    return response
+                fallback = response
+        if fallback is not None:
+            return fallback
+        raise error
+
+    def hedge_stats(self):
+        """Hedge requests sent and how many answered first"""
+        with self._lock:
+            return dict(self.hedges)
+
+    def connection_stats(self):
+        """Counts of new and reused connections made by this process"""
+        return self.stats.snapshot()
+
+    @property
+    def async_client(self):
+        """httpx.AsyncClient for the running event loop (one per loop, so per worker)"""
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            if httpx is None:
+                raise RuntimeError('httpx is required for the async serving mode')
+            # No transport retries: _request_async() retries within the call deadline
+            transport = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(max_connections=self.pool_maxsize, max_keepalive_connections=self.pool_maxsize)
+            )
+            self._async_client = httpx.AsyncClient(
+                transport=transport,
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0])
+            )
+            self._async_client_loop = loop
+        return self._async_client
+
+    async def _guarded_async(self, fn, *args):
+        """Await fn(*args) through the breaker; 5xx responses count as failures"""
+        if self.breaker is None:
+            return await fn(*args)
+        permit = self.breaker.acquire()
+        start = time.monotonic()
+        try:
+            response = await fn(*args)
+        except Exception:
+            self.breaker.record(permit, False, time.monotonic() - start)
+            raise
+        self.breaker.record(permit, not _is_server_error(response), time.monotonic() - start)
+        return response
+
+    async def _request_async(self, method, path, retry_statuses=False, **kwargs):
+        """_request() for the event loop"""
+        deadline = time.monotonic() + self.call_deadline
+        attempt = 0
+        while True:
+            connect, read = self._attempt_timeouts(deadline)
+            try:
+                response = await self.async_client.request(method, f"{self.base_url}{path}",
+                                                           timeout=httpx.Timeout(read, connect=connect), **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                delay = self._retry_delay(attempt, deadline)
+                if delay is None:
+                    raise
+            else:
+                delay = self._retry_delay(attempt, deadline) if retry_statuses else None
+                if response.status_code not in RETRY_STATUSES or delay is None:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def exchange_code_async(self, code, client_id, client_secret):
+        """exchange_code() for the event loop"""
+        return await self._guarded_async(self._post_token_async, code, client_id, client_secret)
+
+    async def _post_token_async(self, code, client_id, client_secret):
+        return await self._request_async(
+            'POST', '/oauth/token',
+            data={
+                'client_id': client_id,
+                'client_secret': client_secret,
+                'code': code
+            }
+        )
+
+    async def get_user_data_async(self, token, client_secret):
+        """get_user_data() for the event loop (hedged if enabled)"""
+        fetch = self._hedged_get_user_data_async if self.hedge_enabled else self._get_user_data_async
+        return await self._guarded_async(fetch, token, client_secret)
+
+    async def _get_user_data_async(self, token, client_secret):
+        start = time.monotonic()
+        response = await self._request_async('GET', '/oauth/user/data', retry_statuses=True,
+                                             params={'token': token, 'client_secret': client_secret})
+        if response.status_code < 500:
+            self.user_data_latency.record(time.monotonic() - start)
+        return response
+
+    async def _hedged_get_user_data_async(self, token, client_secret):
+        primary = asyncio.ensure_future(self._get_user_data_async(token, client_secret))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay())
+        if done:
+            return primary.result()
+
+        hedge = asyncio.ensure_future(self._get_user_data_async(token, client_secret))
+        with self._lock:
+            self.hedges['sent'] += 1
+
+        pending = {primary, hedge}
+        fallback = error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        response = task.result()
+                    except httpx.HTTPError as e:
+                        error = e
+                        continue
+                    if response.status_code < 500:
+                        if task is hedge:
+                            with self._lock:
+                                self.hedges['won'] += 1
+                        return response
+                    fallback = response
+        finally:
+            for task in pending:
+                task.cancel()
+        if fallback is not None:
+            return fallback
+        raise error
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_client_loop = None
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._session_pid = None
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor = None
+            self._executor_pid = None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_ucl_client():
+    """Return the process-wide UCL API client"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = UCLAPIClient()
+    return _client
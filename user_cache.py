@@ -0,0 +1,132 @@
+"""
+Email -> Firebase UID lookup cache
+
+Lets /callback skip the Firestore `users` email query for returning users.
+Storage is pluggable through CacheBackend so a shared store (e.g. Redis)
+can replace the in-process LRU later without touching the callers.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 10000))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 3600))
+
+
+class CacheBackend:
+    """Storage interface for the email -> UID cache"""
+
+    def get(self, key):
+        """Return the cached value or None if missing or expired"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        """Store value for ttl seconds"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove key if present"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class InMemoryLRUBackend(CacheBackend):
+    """Bounded in-process cache with per-entry TTL and LRU eviction"""
+
+    def __init__(self, max_entries=USER_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (value, now + ttl)
+            self._entries.move_to_end(key)
+            # Drop expired entries from the old end, so keys that are never read
+            # again don't stay until evicted; with one TTL for every key that is all of them
+            while self._entries:
+                _, expires_at = next(iter(self._entries.values()))
+                if expires_at > now:
+                    break
+                self._entries.popitem(last=False)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class EmailUIDCache:
+    """Email -> UID cache with hit/miss counters"""
+
+    def __init__(self, backend=None, ttl=USER_CACHE_TTL):
+        self.backend = backend if backend is not None else InMemoryLRUBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, email):
+        if not email:
+            return None
+        uid = self.backend.get(email)
+        with self._lock:
+            if uid is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return uid
+
+    def put(self, email, uid):
+        if email and uid:
+            self.backend.set(email, uid, self.ttl)
+
+    def invalidate(self, email):
+        if email:
+            self.backend.delete(email)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.backend)
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_email_uid_cache():
+    """Return the process-wide email -> UID cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmailUIDCache()
+    return _cache
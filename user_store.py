@@ -0,0 +1,98 @@
+"""
+Firestore user lookups backed by the users_by_email index
+
+Each users/{uid} document has a companion users_by_email/{normalized_email}
+document pointing back at the UID, so resolving a login is a single
+document get instead of an indexed collection query.
+"""
+
+import os
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+USERS_COLLECTION = 'users'
+EMAIL_INDEX_COLLECTION = 'users_by_email'
+
+# Fall back to the legacy email query on an index miss. Turn off once
+# `admin.py backfill-email-index` reports every user indexed, so new users
+# skip the extra round trip.
+EMAIL_INDEX_QUERY_FALLBACK = os.environ.get('EMAIL_INDEX_QUERY_FALLBACK', 'true').lower() in ('1', 'true', 'yes')
+
+
+def normalize_email(email):
+    """Canonical form of an email used for index keys and cache keys"""
+    return (email or '').strip().lower()
+
+
+def email_index_key(email):
+    """Firestore document ID for an email in the index collection"""
+    # Document IDs may not contain '/', so escape it (and '%' so the
+    # escaping stays reversible)
+    return normalize_email(email).replace('%', '%25').replace('/', '%2F')
+
+
+def email_index_ref(db, email):
+    return db.collection(EMAIL_INDEX_COLLECTION).document(email_index_key(email))
+
+
+def index_entry(email, uid):
+    """Contents of a users_by_email document"""
+    return {
+        'uid': uid,
+        'email': normalize_email(email),
+        'updated_at': datetime.utcnow()
+    }
+
+
+def lookup_uid(db, email):
+    """Resolve a UID from the email index with a single document get"""
+    snapshot = email_index_ref(db, email).get()
+    if snapshot.exists:
+        return (snapshot.to_dict() or {}).get('uid')
+    return None
+
+
+def query_uid(db, email):
+    """Resolve a UID with the legacy query on the stored email
+
+    Matches the email as given or in normalized form, since documents may
+    hold either (admin.py normalize-email rewrites them).
+    """
+    candidates = list(dict.fromkeys([email, normalize_email(email)]))
+    if len(candidates) > 1:
+        query = db.collection(USERS_COLLECTION).where('email', 'in', candidates)
+    else:
+        query = db.collection(USERS_COLLECTION).where('email', '==', email)
+    existing_users = query.limit(1).get()
+    for doc in existing_users:
+        return doc.id
+    return None
+
+
+def resolve_uid(db, email):
+    """Find the UID for an email, falling back to the query for unindexed users
+
+    Users created before the index existed are found by the query once and
+    indexed on the spot, so later logins take the direct-get path. With
+    EMAIL_INDEX_QUERY_FALLBACK off an index miss means a new user.
+    """
+    uid = lookup_uid(db, email)
+    if uid or not EMAIL_INDEX_QUERY_FALLBACK:
+        return uid
+
+    uid = query_uid(db, email)
+    if uid:
+        logger.info(f"Indexing pre-existing user {uid} by email")
+        email_index_ref(db, email).set(index_entry(email, uid))
+    return uid
+
+
+def save_new_user(db, uid, email, user_doc):
+    """Write users/{uid} and its email index entry in one batch"""
+    batch = db.batch()
+    batch.set(db.collection(USERS_COLLECTION).document(uid), user_doc, merge=True)
+    batch.set(email_index_ref(db, email), index_entry(email, uid))
+    batch.commit()
+
@@ -0,0 +1,216 @@
+"""
+Write-behind queue for non-critical Firestore updates
+
+Post-login updates (last_login, ucl_data, isOnboarded) don't affect the
+custom token sent back to the app, so in write-behind mode /callback hands
+them to this queue and redirects immediately. A background thread flushes
+them with batched writes, coalescing repeated updates to the same document.
+"""
+
+import os
+import atexit
+import threading
+import logging
+from collections import OrderedDict
+
+try:
+    from google.api_core.exceptions import NotFound
+except ImportError:
+    class NotFound(Exception):
+        """Never raised when google-api-core is not installed"""
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+WRITE_BEHIND_MAX_QUEUE = int(os.environ.get('WRITE_BEHIND_MAX_QUEUE', 10000))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL', 0.5))
+WRITE_BEHIND_FLUSH_SIZE = int(os.environ.get('WRITE_BEHIND_FLUSH_SIZE', 100))
+WRITE_BEHIND_DRAIN_TIMEOUT = float(os.environ.get('WRITE_BEHIND_DRAIN_TIMEOUT', 10))
+
+# Firestore caps a batched write at 500 operations
+MAX_BATCH_SIZE = 500
+
+
+class WriteBehindQueue:
+    """Bounded, coalescing queue of document updates flushed in batches
+
+    Updates are keyed by document ID; a second update to a document that is
+    still queued is merged into the pending one (later fields win). When the
+    queue is full submit() returns False and the caller should write
+    synchronously instead. Updates that still fail after a per-document
+    retry are counted as dropped, except that an update whose document no
+    longer exists calls the on_missing callback given to submit(), if any.
+    """
+
+    def __init__(self, get_db, collection='users',
+                 max_queue=WRITE_BEHIND_MAX_QUEUE,
+                 flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+                 flush_size=WRITE_BEHIND_FLUSH_SIZE):
+        self.get_db = get_db
+        self.collection = collection
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self.flush_size = max(1, min(flush_size, MAX_BATCH_SIZE))
+        self._pending = OrderedDict()
+        self._on_missing = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._thread_pid = None
+        self._stopping = False
+        self._flushing = 0
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.recreated = 0
+        self.batches = 0
+
+    def _ensure_worker(self):
+        # Started lazily so each gunicorn worker gets its own flusher thread
+        pid = os.getpid()
+        if self._thread is None or self._thread_pid != pid or not self._thread.is_alive():
+            if self._thread_pid not in (None, pid):
+                # Forked: the parent's pending updates are the parent's to write
+                self._pending.clear()
+                self._on_missing.clear()
+                self._flushing = 0
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def submit(self, doc_id, fields, on_missing=None):
+        """Queue an update for doc_id; returns False if the queue is full
+
+        on_missing() is called from the flusher thread if the document has
+        been deleted by the time the update is written.
+        """
+        with self._cond:
+            if self._stopping:
+                self.rejected += 1
+                return False
+            self._ensure_worker()
+            if doc_id in self._pending:
+                self._pending[doc_id].update(fields)
+                self.coalesced += 1
+            elif len(self._pending) >= self.max_queue:
+                self.rejected += 1
+                return False
+            else:
+                self._pending[doc_id] = dict(fields)
+            if on_missing:
+                self._on_missing[doc_id] = on_missing
+            self.submitted += 1
+            if len(self._pending) >= self.flush_size:
+                self._cond.notify()
+            return True
+
+    def _take_batch(self):
+        batch = []
+        while self._pending and len(batch) < self.flush_size:
+            doc_id, fields = self._pending.popitem(last=False)
+            batch.append((doc_id, fields, self._on_missing.pop(doc_id, None)))
+        self._flushing += len(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._pending) < self.flush_size and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                items = self._take_batch()
+                if not items and self._stopping:
+                    self._cond.notify_all()
+                    return
+            if items:
+                self._commit(items)
+
+    def _commit(self, items):
+        db = self.get_db()
+        collection = db.collection(self.collection)
+        try:
+            batch = db.batch()
+            for doc_id, fields, _ in items:
+                batch.update(collection.document(doc_id), fields)
+            batch.commit()
+            flushed, dropped, recreated = len(items), 0, 0
+        except Exception as e:
+            # One missing document fails the whole batch, so retry individually
+            logger.warning(f"Write-behind batch of {len(items)} failed, retrying individually: {e}")
+            flushed = dropped = recreated = 0
+            for doc_id, fields, on_missing in items:
+                try:
+                    collection.document(doc_id).update(fields)
+                    flushed += 1
+                except NotFound as e:
+                    if not on_missing:
+                        dropped += 1
+                        logger.error(f"Dropped write-behind update for {doc_id}: {e}")
+                        continue
+                    try:
+                        on_missing()
+                        recreated += 1
+                    except Exception as e:
+                        dropped += 1
+                        logger.error(f"Could not recreate missing document {doc_id}: {e}")
+                except Exception as e:
+                    dropped += 1
+                    logger.error(f"Dropped write-behind update for {doc_id}: {e}")
+        with self._cond:
+            self._flushing -= len(items)
+            self.flushed += flushed
+            self.dropped += dropped
+            self.recreated += recreated
+            self.batches += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been written"""
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                return not self._pending
+            self._cond.notify()
+            return self._cond.wait_for(lambda: not self._pending and not self._flushing, timeout)
+
+    def stop(self, timeout=WRITE_BEHIND_DRAIN_TIMEOUT):
+        """Drain the queue and stop the flusher (called on worker exit)"""
+        with self._cond:
+            if self._thread is None or self._thread_pid != os.getpid():
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive() or self._pending:
+            logger.error(f"Write-behind drain timed out with {len(self._pending)} updates pending")
+
+    def stats(self):
+        with self._cond:
+            return {
+                'enabled': True,
+                'queue_depth': len(self._pending),
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+                'flushed': self.flushed,
+                'dropped': self.dropped,
+                'recreated': self.recreated,
+                'batches': self.batches
+            }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_write_behind_queue(get_db):
+    """Return the process-wide write-behind queue, or None when disabled"""
+    global _queue
+    if not WRITE_BEHIND_ENABLED:
+        return None
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = WriteBehindQueue(get_db)
+                # Sync gunicorn workers leave through sys.exit, so this drains on graceful shutdown
+                atexit.register(_queue.stop)
+    return _queue